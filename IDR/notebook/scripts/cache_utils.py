@@ -0,0 +1,7 @@
+import pathlib
+import sys
+
+# The notebooks share the Feather cache of the production pipeline
+production_dir = str(pathlib.Path(__file__).parents[2] / "production")
+sys.path.append(production_dir)
+from utils.cache import cache_file_name, cached_sources, cached_table, read_cached
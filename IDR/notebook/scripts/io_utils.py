@@ -1,20 +1,7 @@
 import pathlib
+import sys
 
-
-def walk(path):
-    """Collects paths for files in path parameter
-
-    Parameters
-    ----------
-    path: str or pathlib.Path() object
-            Path to metadata folder containing IDR study directories
-
-    Returns
-    -------
-    PosixPath object
-    """
-    for subdir in pathlib.Path(path).iterdir():
-        if subdir.is_dir():
-            yield from walk(subdir)
-            continue
-        yield subdir.resolve()
+# The notebooks list files with the walk() of the production pipeline
+production_dir = str(pathlib.Path(__file__).parents[2] / "production")
+sys.path.append(production_dir)
+from metadata_extraction.extraction_utils.io import walk
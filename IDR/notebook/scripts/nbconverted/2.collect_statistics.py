@@ -8,6 +8,7 @@ import pandas as pd
 import pathlib
 from scripts.stat_utils import collect_study_stats, collect_databank_stats
 from scripts.io_utils import walk
+from scripts.cache_utils import read_cached
 
 
 # In[2]:
@@ -52,8 +53,8 @@ databank_stats.to_parquet(output_file, compression="gzip")
 # In[4]:
 
 
-study_stats = pd.read_parquet(f"{stats_dir}/individual_studies_diversity.parquet.gzip")
+study_stats = read_cached(f"{stats_dir}/individual_studies_diversity.parquet.gzip", cache_dir="../data/cache")
 print(study_stats.head())
 
-databank_stats = pd.read_parquet(f"{stats_dir}/databank_diversity.parquet.gzip")
+databank_stats = read_cached(f"{stats_dir}/databank_diversity.parquet.gzip", cache_dir="../data/cache")
 print(databank_stats.head())
@@ -1,10 +1,45 @@
+import pathlib
+
 import numpy as np
 import pandas as pd
+from .cache_utils import cached_table
 from .io_utils import walk
 from scipy import ndimage
 from numpy import log as ln
 
 
+def read_metadata(metadata_file_path):
+    """Reads a per-screen metadata file with Channels as 'stain:target;...' strings
+
+    Parameters
+    ----------
+    metadata_file_path: PosixPath object
+        Path to single study .parquet metadata file
+
+    Returns
+    -------
+    metadata_df: pandas dataframe
+    """
+    return join_channel_lists(pd.read_parquet(metadata_file_path))
+
+
+def join_channel_lists(metadata_df):
+    """Converts list typed Channels of a metadata dataframe into 'stain:target;...' strings"""
+    # Channels are stored as lists of stain and target pairs by the production pipeline
+    if "Channels" in metadata_df.columns and not pd.api.types.is_string_dtype(
+        metadata_df["Channels"]
+    ):
+        metadata_df["Channels"] = [
+            ";".join(
+                ":".join(part for part in channel.values() if part is not None)
+                for channel in channels
+            )
+            for channels in metadata_df["Channels"]
+        ]
+
+    return metadata_df
+
+
 def category_frequencies(attribute_elements):
     """Calculates absolute and relative frequencies for unique elements of an image attribute
 
@@ -192,7 +227,6 @@ def collect_study_stats(
     metadata_file_path,
     results_list,
 ):
-
     """Collecting statistics within a single file
 
     Parameters
@@ -210,7 +244,7 @@ def collect_study_stats(
         The input results list appended with statistics from the metadata_file_path study
     """
     # Read parquet into pandas df
-    metadata_df = pd.read_parquet(metadata_file_path)
+    metadata_df = read_metadata(metadata_file_path)
 
     # Extract metadata from file name and dataframe
     metadata_pq = metadata_file_path.name
@@ -254,12 +288,13 @@ def collect_databank_stats(metadata_dir, na_cols):
         Contains all statistics for each image attribute not in na_cols calculated across all studies
     """
 
-    # Open and concatinate study metadata dataframes from .parquet files
-    databank_metadata = pd.concat(
-        [
-            pd.read_parquet(study_metadata_file)
-            for study_metadata_file in walk(metadata_dir)
-        ]
+    # Concatenated study metadata is kept as a memory-mapped Feather file next to the
+    # metadata directory and rebuilt when a .parquet file changes
+    databank_metadata = join_channel_lists(
+        cached_table(
+            list(walk(metadata_dir)),
+            pathlib.Path(pathlib.Path(metadata_dir).parent, "cache", "metadata.feather"),
+        ).to_pandas()
     )
 
     # Get image_attribute names
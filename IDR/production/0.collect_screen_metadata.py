@@ -3,7 +3,7 @@ import subprocess
 import sys
 
 import pandas as pd
-from utils.args import collect_screen_metadata_parser
+from utils.args import collect_screen_metadata_parser, transport_argv
 
 
 def extract_study_info(session, screen_id):
@@ -51,7 +51,9 @@ if __name__ == "__main__":
 
     # Get IDR IDs
     print("\nExtracting screen ids from IDR\n")
-    get_idr_ids = subprocess.Popen(args=["python3", "IDR/production/utils/get_ids.py"])
+    get_idr_ids = subprocess.Popen(
+        args=["python3", "IDR/production/utils/get_ids.py", *transport_argv(args)]
+    )
     get_idr_ids.wait()
 
     if file_type == "downloaded_json":
@@ -67,6 +69,7 @@ if __name__ == "__main__":
                     args=[
                         "python3",
                         "IDR/production/metadata_extraction/get_json_files.py",
+                        *transport_argv(args),
                     ]
                 )
                 get_json_files.wait()
@@ -1,108 +1,110 @@
+import functools
+import multiprocessing
 import pathlib
 import sys
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm import tqdm
-from utils.statistics import collect_databank_stats, collect_study_stats
+from utils import instrumentation
+from utils.args import compute_statistics_parser
+from utils.matrices import save_count_matrices, screen_element_matrices
+from utils.statistics import (
+    BOOTSTRAP_COLUMNS,
+    RAREFACTION_COLUMNS,
+    collect_databank_stats,
+    databank_stats,
+    hierarchical_stats,
+    individual_study_stats,
+    screen_statistics,
+    smallest_screen,
+)
 
 # Define path to extraction_utils directory
 parent_dir = str(pathlib.Path(__file__).parents[1])
 sys.path.append(parent_dir)
 from metadata_extraction.extraction_utils.io import walk
 
-
-def nested_dict_pairs_iterator(elements_and_counts_dict):
-    """Collects all combinations of tuples for a nested dictionary
-
-    Parameters
-    ----------
-    elements_and_counts_dict: dict
-        Nested dictionary of all combinations of all unique entries of a metadata file
-        E.g. {study_name: {screen_id: {image_attribute: {unique_element: count}}}}
-
-    Returns
-    -------
-    All possible combinations of tuples for a nested dictionary
-        E.g. (study_name1, screen_id1, image_attribute1, unique_element1, count1)
-    """
-    # Iterate over all key-value pairs of dict argument
-    for key, value in elements_and_counts_dict.items():
-        # Check if value is of dict type
-        if isinstance(value, dict):
-            # If value is dict then iterate over all its values
-            for pair in nested_dict_pairs_iterator(value):
-                yield (key, *pair)
-        else:
-            # If value is not dict type then yield the value
-            yield (key, value)
-
-
 if __name__ == "__main__":
+    # Define arguments
+    args = compute_statistics_parser().parse_args(sys.argv[1:])
+    if args.profile_dir is not None:
+        instrumentation.enable_profiling(args.profile_dir)
+
     # Define study metadata directory
     studies_metadata_dir = pathlib.Path("IDR/data/metadata")
 
     # Collect metadata file paths
-    metadata_files = list(walk(studies_metadata_dir))
+    metadata_files = list(walk(studies_metadata_dir, extensions=".parquet"))
 
     # Make directories
     stats_dir = pathlib.Path("IDR/data/statistics")
     pathlib.Path.mkdir(stats_dir, exist_ok=True)
 
-    # Calculate statistics for each image attribute for individual studies
-    individual_study_stats = list()
-    unique_elements_and_counts = dict()
-
-    print(f"\nComputing statistics for {len(metadata_files)} screens.\n")
-
-    # Iterate through each study/screen/well.json metadata file
-    for metadata_path in tqdm(metadata_files):
-        parsed_data_path = ((str(metadata_path).split("/")[-1]).split(".")[0]).split(
-            "_"
-        )
-        study_name = parsed_data_path[0]
-        screen_id = parsed_data_path[-1]
-        _, attribute_elements = collect_study_stats(
-            metadata_path,
-            individual_study_stats,
-            na_cols=[
-                "screen_id",
-                "study_name",
-                "plate_name",
-                "plate_id",
-                "well_id",
-                "Organism Part",
-            ],
-            study_name=study_name,
-            screen_id=screen_id,
-        )
+    na_cols = [
+        "screen_id",
+        "study_name",
+        "plate_name",
+        "plate_id",
+        "well_id",
+        "Organism Part",
+    ]
+
+    # Rarefy individual studies to a common number of wells
+    rarefaction_depth = None
+    if args.rarefaction:
+        rarefaction_depth = args.rarefaction_depth or smallest_screen(metadata_files)
+
+    # Every per-screen statistic is computed from a single read of each file
+    screen_pass = functools.partial(
+        screen_statistics,
+        na_cols=na_cols,
+        plate_column="plate_id" if args.hierarchy else None,
+        rarefaction_depth=rarefaction_depth,
+        n_replicates=args.bootstrap,
+        confidence=args.confidence,
+        seed=args.seed,
+    )
 
-        unique_elements_and_counts[study_name] = attribute_elements
+    element_counts_tables = list()
+    hierarchy_stats = list()
+    rarefied_rows = list()
+    bootstrap_rows = list()
 
-    # Convert unique_elements_and_counts dict to Pandas.DataFrame
-    unique_elements_and_counts_list = list(
-        nested_dict_pairs_iterator(unique_elements_and_counts)
-    )
+    print(f"\nComputing statistics for {len(metadata_files)} screens.\n")
 
-    # Generate output dataframes
-    unique_elements_and_counts_df = pd.DataFrame(
-        data=unique_elements_and_counts_list,
-        columns=["Study", "Screen", "Attribute", "Element", "Count"],
-    )
+    with multiprocessing.Pool(processes=args.processes) as pool:
+        if args.processes > 1:
+            screen_results = pool.imap(screen_pass, metadata_files)
+        else:
+            screen_results = map(screen_pass, metadata_files)
 
-    unique_elements_and_counts_df["Element"] = unique_elements_and_counts_df[
-        "Element"
-    ].astype("str")
+        # Iterate through each study/screen/well.json metadata file
+        for results in tqdm(screen_results, total=len(metadata_files)):
+            element_counts_tables.append(results["element_counts"])
+            hierarchy_stats.append(results["hierarchy_stats"])
+            rarefied_rows.extend(results["rarefied"])
+            bootstrap_rows.extend(results["bootstrap"])
 
-    stat_results_df = pd.DataFrame(
-        data=individual_study_stats,
-        columns=["Study_Name", "Attribute", "S", "H", "NME", "J", "E", "GC"],
-    )
+    # Per-screen element counts are concatenated once, with one chunk per screen
+    unique_elements_and_counts = pa.concat_tables(element_counts_tables)
 
     # Save elements and counts as parquet file
     elements_and_counts_output_file = pathlib.Path(
         stats_dir, "unique_elements_and_counts.parquet"
     )
-    unique_elements_and_counts_df.to_parquet(elements_and_counts_output_file)
+    pq.write_table(unique_elements_and_counts, elements_and_counts_output_file)
+
+    # Save a screens by elements count matrix per attribute
+    with instrumentation.stage("matrices"):
+        matrices = screen_element_matrices(unique_elements_and_counts)
+        save_count_matrices(
+            matrices, output_dir=pathlib.Path(stats_dir, "count_matrices")
+        )
+
+    # Individual study stats are computed row-wise from the count matrices
+    stat_results_df = individual_study_stats(unique_elements_and_counts, matrices)
 
     # Save individual stats as parquet file
     indv_studies_output_file = pathlib.Path(
@@ -110,19 +112,59 @@ if __name__ == "__main__":
     )
     stat_results_df.to_parquet(indv_studies_output_file)
 
-    # Collect databank stats
-    databank_stats = collect_databank_stats(
-        metadata_directory=studies_metadata_dir,
-        na_cols=[
-            "screen_id",
-            "study_name",
-            "plate_name",
-            "plate_id",
-            "well_id",
-            "Organism Part",
-        ],
-    )
+    # Statistics at plate, screen, study and databank level
+    if args.hierarchy:
+        with instrumentation.stage("hierarchy"):
+            hierarchical_df = hierarchical_stats(
+                hierarchy_stats, element_counts=unique_elements_and_counts
+            )
+
+        hierarchical_output_file = pathlib.Path(
+            stats_dir, "hierarchical_diversity.parquet"
+        )
+        hierarchical_df.to_parquet(hierarchical_output_file)
+
+    if args.rarefaction:
+        rarefied_output_file = pathlib.Path(
+            stats_dir, "rarefied_studies_diversity.parquet"
+        )
+        pd.DataFrame(data=rarefied_rows, columns=RAREFACTION_COLUMNS).to_parquet(
+            rarefied_output_file
+        )
+
+    # Bootstrap confidence intervals for individual studies
+    if args.bootstrap > 0:
+        bootstrap_output_file = pathlib.Path(
+            stats_dir, "bootstrap_studies_diversity.parquet"
+        )
+        pd.DataFrame(data=bootstrap_rows, columns=BOOTSTRAP_COLUMNS).to_parquet(
+            bootstrap_output_file
+        )
+
+    # Databank stats are merged from the per-screen counts, other modes scan again
+    if args.databank_mode == "in_memory":
+        databank_stats_df = databank_stats(
+            unique_elements_and_counts,
+            hierarchical_df=hierarchical_df if args.hierarchy else None,
+        )
+    else:
+        with instrumentation.stage("databank"):
+            databank_stats_df = collect_databank_stats(
+                metadata_directory=studies_metadata_dir,
+                na_cols=na_cols,
+                mode=args.databank_mode,
+                state_dir=args.databank_state_dir,
+                batch_size=args.batch_size,
+                precision=args.sketch_precision,
+                top_k=args.top_k,
+                processes=args.processes,
+            )
 
     # Save databank stats as parquet file
-    databank_output_file = pathlib.Path(stats_dir, f"databank_diversity.parquet")
-    databank_stats.to_parquet(databank_output_file)
+    databank_output_file = pathlib.Path(stats_dir, "databank_diversity.parquet")
+    databank_stats_df.to_parquet(databank_output_file)
+
+    metrics_file = instrumentation.write_report(
+        metrics_dir=args.metrics_dir, run_name="compute_statistics"
+    )
+    print(f"Metrics report saved to {metrics_file}")
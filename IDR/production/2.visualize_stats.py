@@ -1,22 +1,92 @@
 import pathlib
 
-import pandas as pd
 from plotnine import *
 from sigfig import round
+from utils.cache import read_cached
+
+STAT_TITLES = {
+    "H": "Shannon Index (H')",
+    "J": "Pielou's Evenness (J')",
+    "NME": "Normalized Median Evenness (NME)",
+    "E": "Simpson's Evenness (E)",
+    "GC": "Gini Coefficient (GC)",
+    "S": "Richness (S)",
+}
+
+
+def plot_databank_stat(databank_stats, stat):
+    """Bar plot of one diversity statistic per image attribute across the databank
+
+    Parameters
+    ----------
+    databank_stats: pandas.DataFrame
+        Databank statistics as written by 1.compute_statistics.py
+    stat: str
+        Statistic to plot, one of STAT_TITLES
+
+    Returns
+    -------
+    plotnine.ggplot
+    """
+    dodge_text = position_dodge(width=0.9)
+    databank_stats_sorted = databank_stats.sort_values(
+        by=[stat], ascending=True, na_position="last"
+    )
+    stats_list = databank_stats_sorted["Attribute"].value_counts().index.tolist()
+    databank_plot = (
+        ggplot(data=databank_stats_sorted, mapping=aes(x="Attribute", y=stat))
+        + geom_bar(na_rm=True, stat="identity", position="dodge")
+        + geom_text(
+            aes(label=stat),
+            position=dodge_text,
+            color="gray",
+            size=8,
+            ha="left",
+        )
+        + scale_x_discrete(limits=stats_list)
+        + ylab(STAT_TITLES[stat])
+        + ylim(0, (1.3 * max(databank_stats[stat])))
+        + coord_flip()
+    )
+
+    return databank_plot
+
+
+def plot_study_stat(study_stats, stat):
+    """Jitter plot of one diversity statistic per image attribute for individual studies
+
+    Parameters
+    ----------
+    study_stats: pandas.DataFrame
+        Individual study statistics as written by 1.compute_statistics.py
+    stat: str
+        Statistic to plot, one of STAT_TITLES
+
+    Returns
+    -------
+    plotnine.ggplot
+    """
+    studies_plot = (
+        ggplot(data=study_stats, mapping=aes(x="Attribute", y=stat))
+        + geom_jitter(na_rm=True, stat="identity", position="jitter")
+        + theme(axis_text_x=element_text(rotation=90))
+        + ylab(STAT_TITLES[stat])
+        + ylim(0, max(study_stats[stat]))
+    )
+
+    return studies_plot
 
 
 if __name__ == "__main__":
 
-    # Load data
+    # Load data through memory-mapped copies that are refreshed when the statistics change
     databank_stats_dir = pathlib.Path("IDR/data/statistics/databank_diversity.parquet")
-    databank_stats = pd.read_parquet(databank_stats_dir)
+    databank_stats = read_cached(databank_stats_dir)
 
     study_stats_dir = pathlib.Path(
         "IDR/data/statistics/individual_studies_diversity.parquet"
     )
-    study_stats = pd.read_parquet(study_stats_dir)
-
-    dodge_text = position_dodge(width=0.9)
+    study_stats = read_cached(study_stats_dir)
 
     # Round to 3 sigfigs if not 0
     stats_to_round = ["H", "J", "NME", "E", "GC"]
@@ -50,42 +120,9 @@ if __name__ == "__main__":
 
     # Plot stats for databank and individual study stats
     stats_to_graph = ["H", "J", "NME", "E", "GC", "S"]
-    stat_titles = {
-        "H": "Shannon Index (H')",
-        "J": "Pielou's Evenness (J')",
-        "NME": "Normalized Median Evenness (NME)",
-        "E": "Simpson's Evenness (E)",
-        "GC": "Gini Coefficient (GC)",
-        "S": "Richness (S)",
-    }
     for stat in stats_to_graph:
-        databank_stats_sorted = databank_stats.sort_values(
-            by=[stat], ascending=True, na_position="last"
-        )
-        stats_list = databank_stats_sorted["Attribute"].value_counts().index.tolist()
-        databank_plot = (
-            ggplot(data=databank_stats_sorted, mapping=aes(x="Attribute", y=stat))
-            + geom_bar(na_rm=True, stat="identity", position="dodge")
-            + geom_text(
-                aes(label=stat),
-                position=dodge_text,
-                color="gray",
-                size=8,
-                ha="left",
-            )
-            + scale_x_discrete(limits=stats_list)
-            + ylab(stat_titles[stat])
-            + ylim(0, (1.3 * max(databank_stats[stat])))
-            + coord_flip()
-        )
-
-        studies_plot = (
-            ggplot(data=study_stats, mapping=aes(x="Attribute", y=stat))
-            + geom_jitter(na_rm=True, stat="identity", position="jitter")
-            + theme(axis_text_x=element_text(rotation=90))
-            + ylab(stat_titles[stat])
-            + ylim(0, max(study_stats[stat]))
-        )
+        databank_plot = plot_databank_stat(databank_stats=databank_stats, stat=stat)
+        studies_plot = plot_study_stat(study_stats=study_stats, stat=stat)
 
         databank_output_file = pathlib.Path(databank_imgs_dir, f"{stat}.png")
         databank_plot.save(databank_output_file, dpi=500)
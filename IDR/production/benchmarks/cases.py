@@ -0,0 +1,367 @@
+import importlib.util
+import os
+from multiprocessing.pool import ThreadPool
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+# Define paths to the production and metadata_extraction directories
+production_dir = pathlib.Path(__file__).parents[1]
+sys.path.append(str(production_dir))
+sys.path.append(str(pathlib.Path(production_dir, "metadata_extraction")))
+from extraction_utils.clean_channels import clean_channel
+from extraction_utils.io import walk
+from extraction_utils.list_modifications import iterate_through_values
+from extraction_utils.schema import write_metadata
+from get_json_files import download_screen
+from get_plate_details import describe_screen
+from process_json_metadata import collect_metadata, pull_json_well_metadata
+from utils.diversity import grouped_diversity, ragged_offsets
+from utils.args import get_plate_details_parser
+from utils.matrices import matrix_diversity
+from utils.statistics import (
+    bootstrap_screen_stats,
+    collect_databank_stats,
+    element_attribute_counts,
+    get_unique_entries,
+    gini_coef,
+    parse_metadata_file_name,
+    screen_element_counts,
+    stats_pipeline,
+)
+from utils.synthetic import (
+    SyntheticLayout,
+    attribute_profiles,
+    generate_screen_metadata,
+    well_annotations,
+    write_synthetic_json,
+)
+from utils.transport import SyntheticSession, ThreadSessions
+
+# Fixed inputs so that results are comparable between runs
+SEED = 0
+ELEMENTS_AND_COUNTS_FILE = pathlib.Path(
+    production_dir.parent, "data/statistics/unique_elements_and_counts.parquet"
+)
+NA_COLS = [
+    "screen_id",
+    "study_name",
+    "plate_name",
+    "plate_id",
+    "well_id",
+    "Organism Part",
+]
+SCREEN_PROFILE = {
+    "n_wells": 10_000,
+    "richness": {
+        "Channels": 2,
+        "Organism": 1,
+        "Cell Line": 3,
+        "Strain": 50,
+        "Gene Identifier": 1_000,
+        "Gene Symbol": 900,
+        "Phenotype": 20,
+        "Phenotype Term Name": 15,
+        "Compound Name": 250,
+        "siRNA Identifier": 1_000,
+        "Imaging Method": 1,
+        "Sample": 1,
+    },
+}
+DATABANK_SCREEN_PROFILE = {
+    "n_wells": 2_000,
+    "richness": {
+        attribute: max(1, richness // 4)
+        for attribute, richness in SCREEN_PROFILE["richness"].items()
+    },
+}
+
+
+def load_script(script_path):
+    """Imports a production script whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location(
+        pathlib.Path(script_path).stem.replace(".", "_"), script_path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def zipf_counts(n_elements, exponent=1.0, total=100_000):
+    """Integer Zipf distributed counts for n_elements unique elements"""
+    weights = 1.0 / np.arange(1, n_elements + 1) ** exponent
+    return np.maximum(1, np.round(total * weights / weights.sum())).astype(int)
+
+
+def synthetic_screen_df(screen_id=1, screen_profile=SCREEN_PROFILE):
+    """Per-screen metadata table generated from the calibrated attribute profiles"""
+    attribute_profile, _ = attribute_profiles(
+        elements_and_counts_file=ELEMENTS_AND_COUNTS_FILE
+    )
+    pool_sizes = {
+        attribute: profile["pool_size"]
+        for attribute, profile in attribute_profile.items()
+    }
+
+    return generate_screen_metadata(
+        attribute_profile=attribute_profile,
+        screen_profile=screen_profile,
+        screen_id=screen_id,
+        pool_sizes=pool_sizes,
+        rng=np.random.default_rng(SEED + screen_id),
+    )
+
+
+# Each setup function prepares its inputs under workdir and returns the callable to time
+def setup_download_screen(workdir):
+    layout = SyntheticLayout(n_screens=1, plates_per_screen=2, wells_per_plate=96)
+    session = SyntheticSession(layout=layout)
+    output_dir = pathlib.Path(workdir, "json_download")
+
+    return lambda: download_screen(
+        session=session,
+        screen_id=layout.screen_ids()[0],
+        json_metadata_dir=output_dir,
+    )
+
+
+def setup_describe_screen(workdir):
+    # Emulated round trips show the effect of concurrent requests
+    args = get_plate_details_parser().parse_args(
+        [
+            "--transport",
+            "synthetic",
+            "--latency",
+            "0.002",
+            "--synthetic-screens",
+            "1",
+            "--synthetic-plates",
+            "2",
+            "--synthetic-wells",
+            "96",
+        ]
+    )
+    sessions = ThreadSessions(args)
+    pool = ThreadPool(processes=16)
+
+    return lambda: describe_screen(
+        sessions=sessions,
+        screen_id=1,
+        imaging_method="fluorescence microscopy",
+        pool=pool,
+    )
+
+
+def setup_clean_channel(workdir):
+    channel_formats = [
+        "DAPI:DNA;GFP:tubulin;Cy3:actin",
+        "Hoechst (DNA); Alexa 488 (EdU); Brightfield (cell)",
+        "488 long:nucleoli and cytoplasmic RNA;405:nuclei",
+        "GFP (H2B (histone)); mCherry:tubulin",
+    ]
+    channels = [
+        f"{channel_formats[index % len(channel_formats)]};stain{index}:target{index}"
+        for index in range(2_000)
+    ]
+
+    return lambda: [clean_channel(channel) for channel in channels]
+
+
+def setup_iterate_through_values(workdir):
+    layout = SyntheticLayout(n_screens=1, plates_per_screen=1, wells_per_plate=2_000)
+    annotations = [
+        well_annotations(layout, well_id)["annotations"]
+        for well_id in layout.well_ids(layout.plate_ids(1)[0])
+    ]
+
+    return lambda: [
+        iterate_through_values(annotations=annotation) for annotation in annotations
+    ]
+
+
+def setup_walk_json_metadata(workdir):
+    layout = SyntheticLayout(n_screens=2, plates_per_screen=4, wells_per_plate=384)
+    json_dir = pathlib.Path(workdir, "json_metadata")
+    write_synthetic_json(output_dir=json_dir, layout=layout)
+
+    return lambda: list(walk(json_dir, extensions=".json"))
+
+
+def setup_pull_json_well_metadata(workdir):
+    layout = SyntheticLayout(n_screens=1, plates_per_screen=1, wells_per_plate=384)
+    json_dir = pathlib.Path(workdir, "json_metadata")
+    write_synthetic_json(output_dir=json_dir, layout=layout)
+    well_files = sorted(json_dir.glob("*/*/*.json"))
+    image_attributes = [
+        "Channels",
+        "Organism",
+        "Cell Line",
+        "Gene Identifier",
+        "Gene Symbol",
+        "Phenotype",
+        "Compound Name",
+        "siRNA Identifier",
+    ]
+
+    return lambda: [
+        pull_json_well_metadata(
+            well_metadata_file=well_file, image_attributes=image_attributes
+        )
+        for well_file in well_files
+    ]
+
+
+def setup_collect_metadata(workdir):
+    # collect_metadata() resolves IDR/data relative to the working directory
+    layout = SyntheticLayout(n_screens=1, plates_per_screen=2, wells_per_plate=192)
+    write_synthetic_json(
+        output_dir=pathlib.Path(workdir, "IDR/data/json_metadata"), layout=layout
+    )
+    pathlib.Path.mkdir(pathlib.Path(workdir, "IDR/data/metadata"), parents=True)
+    screen_id = layout.screen_ids()[0]
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            collect_metadata(
+                screen_id=screen_id,
+                idr_name=layout.idr_name(screen_id),
+                imaging_method=layout.imaging_method(screen_id),
+                sample="cell",
+            )
+        finally:
+            os.chdir(cwd)
+
+    return run
+
+
+def setup_get_unique_entries(workdir):
+    screen_df = synthetic_screen_df()
+
+    return lambda: get_unique_entries(
+        metadata_df=screen_df, attribute="Gene Identifier"
+    )
+
+
+def setup_stats_pipeline(workdir):
+    counts = zipf_counts(n_elements=2_000)
+    attribute_elements = {
+        f"element_{index}": int(count) for index, count in enumerate(counts)
+    }
+
+    return lambda: stats_pipeline(attribute_elements=attribute_elements)
+
+
+def setup_grouped_diversity(workdir):
+    # Many small groups, like the (screen, attribute) groups of the statistics stage
+    rng = np.random.default_rng(SEED)
+    lengths = rng.integers(1, 500, size=5_000)
+    counts = np.concatenate([zipf_counts(n_elements=length) for length in lengths])
+
+    return lambda: grouped_diversity(counts=counts, offsets=ragged_offsets(lengths))
+
+
+def setup_matrix_diversity(workdir):
+    # Screens by genes counts, the widest attribute of the databank
+    rng = np.random.default_rng(SEED)
+    matrix = scipy.sparse.random(
+        2_000, 50_000, density=0.005, format="csr", random_state=rng
+    )
+    matrix.data = np.ceil(matrix.data * 100)
+
+    return lambda: matrix_diversity(matrix=matrix)
+
+
+def setup_gini_coef(workdir):
+    counts = zipf_counts(n_elements=5_000).tolist()
+
+    return lambda: gini_coef(absolute_frequencies_list=counts)
+
+
+def write_databank_metadata(workdir):
+    """Writes the per-screen metadata files of a small synthetic databank"""
+    metadata_dir = pathlib.Path(workdir, "metadata")
+    for screen_id in range(1, 5):
+        screen_dir = pathlib.Path(metadata_dir, f"idr{screen_id:04d}-bench", "screenA")
+        pathlib.Path.mkdir(screen_dir, parents=True)
+        screen_metadata_df = synthetic_screen_df(
+            screen_id=screen_id, screen_profile=DATABANK_SCREEN_PROFILE
+        )
+        write_metadata(
+            screen_metadata_df,
+            pathlib.Path(
+                screen_dir, f"idr{screen_id:04d}-bench_screenA_{screen_id}.parquet"
+            ),
+        )
+
+    return metadata_dir
+
+
+def setup_collect_databank_stats(workdir):
+    metadata_dir = write_databank_metadata(workdir)
+
+    return lambda: collect_databank_stats(
+        metadata_directory=metadata_dir, na_cols=NA_COLS
+    )
+
+
+def setup_stream_databank_stats(workdir):
+    metadata_dir = write_databank_metadata(workdir)
+
+    return lambda: collect_databank_stats(
+        metadata_directory=metadata_dir, na_cols=NA_COLS, mode="streaming"
+    )
+
+
+def setup_bootstrap_screen_stats(workdir):
+    metadata_file = next(write_databank_metadata(workdir).glob("*/*/*.parquet"))
+    study_name, screen_id = parse_metadata_file_name(metadata_file)
+    attribute_counts = element_attribute_counts(
+        screen_element_counts(
+            metadata_file, na_cols=NA_COLS, study_name=study_name, screen_id=screen_id
+        )
+    )
+
+    return lambda: bootstrap_screen_stats(
+        attribute_counts, study_name=study_name, screen_id=screen_id, n_replicates=200
+    )
+
+
+def setup_render_databank_plot(workdir):
+    visualize_stats = load_script(pathlib.Path(production_dir, "2.visualize_stats.py"))
+    rng = np.random.default_rng(SEED)
+    databank_stats = pd.DataFrame(
+        {
+            "Attribute": list(SCREEN_PROFILE["richness"].keys()),
+            "H": rng.random(len(SCREEN_PROFILE["richness"])) * 5,
+        }
+    )
+
+    return lambda: visualize_stats.plot_databank_stat(
+        databank_stats=databank_stats, stat="H"
+    ).draw()
+
+
+BENCHMARKS = {
+    "download_screen": setup_download_screen,
+    "describe_screen": setup_describe_screen,
+    "clean_channel": setup_clean_channel,
+    "iterate_through_values": setup_iterate_through_values,
+    "walk_json_metadata": setup_walk_json_metadata,
+    "pull_json_well_metadata": setup_pull_json_well_metadata,
+    "collect_metadata": setup_collect_metadata,
+    "get_unique_entries": setup_get_unique_entries,
+    "stats_pipeline": setup_stats_pipeline,
+    "gini_coef": setup_gini_coef,
+    "grouped_diversity": setup_grouped_diversity,
+    "matrix_diversity": setup_matrix_diversity,
+    "collect_databank_stats": setup_collect_databank_stats,
+    "stream_databank_stats": setup_stream_databank_stats,
+    "bootstrap_screen_stats": setup_bootstrap_screen_stats,
+    "render_databank_plot": setup_render_databank_plot,
+}
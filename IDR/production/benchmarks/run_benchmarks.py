@@ -0,0 +1,197 @@
+import datetime
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+from benchmarks.cases import BENCHMARKS
+from utils.args import benchmark_parser
+
+
+def time_benchmark(setup, repeat):
+    """Times a benchmark case
+
+    Parameters
+    ----------
+    setup: function
+        Benchmark setup function from benchmarks.cases.BENCHMARKS
+    repeat: int
+        Number of timed calls
+
+    Returns
+    -------
+    timings: dict
+        Summary of the wall clock seconds per call
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmark = setup(workdir)
+
+        # Warm up caches and imports before timing
+        benchmark()
+
+        seconds = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            benchmark()
+            seconds.append(time.perf_counter() - start)
+
+    return {
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "mean": statistics.mean(seconds),
+        "stdev": statistics.stdev(seconds) if len(seconds) > 1 else 0.0,
+        "repeat": repeat,
+    }
+
+
+def run_benchmarks(names, repeat):
+    """Runs the selected benchmark cases
+
+    Parameters
+    ----------
+    names: list
+        Benchmark names from benchmarks.cases.BENCHMARKS
+    repeat: int
+        Number of timed calls per benchmark
+
+    Returns
+    -------
+    results: dict
+        Timings per benchmark name. Benchmarks with missing dependencies are skipped
+    """
+    results = dict()
+    for name in names:
+        try:
+            results[name] = time_benchmark(setup=BENCHMARKS[name], repeat=repeat)
+        except ImportError as error:
+            print(f"Skipping {name}: {error}")
+            continue
+        print(f"{name}: {results[name]['min'] * 1000:.2f} ms (min of {repeat})")
+
+    return results
+
+
+def git_commit():
+    """Current git commit hash, or None outside of a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, results_dir):
+    """Saves benchmark timings with the run environment to a timestamped .json file
+
+    Parameters
+    ----------
+    results: dict
+        Output of run_benchmarks()
+    results_dir: pathlib.Path
+        Directory holding the benchmark history
+
+    Returns
+    -------
+    output_file: pathlib.Path
+        Path of the written results file
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    commit = git_commit()
+    run = {
+        "timestamp": timestamp,
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results,
+    }
+
+    pathlib.Path.mkdir(results_dir, exist_ok=True, parents=True)
+    output_file = pathlib.Path(
+        results_dir, f"{timestamp}_{(commit or 'nocommit')[:8]}.json"
+    )
+    with open(output_file, "w") as file:
+        json.dump(run, file, indent=4)
+
+    return output_file
+
+
+def compare_results(baseline_file, candidate_file, threshold):
+    """Compares two benchmark runs and flags regressions
+
+    Parameters
+    ----------
+    baseline_file: pathlib.Path
+        Results file of the reference run
+    candidate_file: pathlib.Path
+        Results file of the run to check
+    threshold: float
+        Relative slowdown of the minimum timing above which a benchmark is flagged
+
+    Returns
+    -------
+    comparison_df: pandas.DataFrame
+        Minimum timings, candidate/baseline ratio and regression flag per benchmark
+    """
+    with open(baseline_file) as file:
+        baseline = json.load(file)["benchmarks"]
+    with open(candidate_file) as file:
+        candidate = json.load(file)["benchmarks"]
+
+    comparison = list()
+    for name in sorted(set(baseline) & set(candidate)):
+        ratio = candidate[name]["min"] / baseline[name]["min"]
+        comparison.append(
+            [
+                name,
+                baseline[name]["min"],
+                candidate[name]["min"],
+                ratio,
+                ratio > 1 + threshold,
+            ]
+        )
+
+    return pd.DataFrame(
+        data=comparison,
+        columns=["Benchmark", "Baseline", "Candidate", "Ratio", "Regression"],
+    )
+
+
+if __name__ == "__main__":
+    # Define arguments
+    args = benchmark_parser().parse_args(sys.argv[1:])
+    results_dir = pathlib.Path(args.results_dir)
+
+    if args.command == "run":
+        names = args.benchmarks or list(BENCHMARKS.keys())
+        results = run_benchmarks(names=names, repeat=args.repeat)
+        output_file = save_results(results=results, results_dir=results_dir)
+        print(f"\nBenchmark results saved to {output_file}")
+
+    elif args.command == "compare":
+        # Default to the two most recent runs
+        history = sorted(results_dir.glob("*.json"))
+        baseline_file = args.baseline or history[-2]
+        candidate_file = args.candidate or history[-1]
+
+        comparison_df = compare_results(
+            baseline_file=baseline_file,
+            candidate_file=candidate_file,
+            threshold=args.threshold,
+        )
+        print(f"Baseline: {baseline_file}\nCandidate: {candidate_file}\n")
+        print(comparison_df.to_string(index=False))
+
+        if comparison_df["Regression"].any():
+            regressions = comparison_df.query("Regression").Benchmark.tolist()
+            print(f"\nRegressions above {args.threshold:.0%}: {regressions}")
+            sys.exit(1)
@@ -0,0 +1,446 @@
+import json
+import os
+import pathlib
+import sys
+
+import pandas as pd
+
+# Define paths to the production and metadata_extraction directories
+production_dir = pathlib.Path(__file__).parents[1]
+sys.path.append(str(production_dir))
+sys.path.append(str(pathlib.Path(production_dir, "metadata_extraction")))
+from extraction_utils.archives import (
+    WELL_JSON_EXTENSIONS,
+    iter_archive,
+    screen_archive,
+)
+from extraction_utils.blocks import iter_block_store, screen_block_store
+from extraction_utils.io import walk
+from extraction_utils.schema import write_metadata
+from get_json_files import (
+    DELTA_SYNC_TTLS,
+    download_screen,
+    screen_inventory,
+    sync_screen,
+)
+from ingest_annotation_csv import screen_well_ids
+from process_json_metadata import (
+    IMAGE_ATTRIBUTES,
+    pull_csv_well_metadata,
+    pull_json_well_metadata,
+)
+from utils import instrumentation
+from utils.statistics import collect_databank_stats
+from utils.synthetic import (
+    SyntheticLayout,
+    annotation_csv,
+    write_synthetic_json,
+    write_synthetic_metadata,
+)
+from utils.transport import CachingSession, SyntheticSession
+
+PLATE_URL = "https://idr.openmicroscopy.org/webgateway/plate/{plate_id}"
+ELEMENTS_AND_COUNTS_FILE = pathlib.Path(
+    production_dir.parent, "data/statistics/unique_elements_and_counts.parquet"
+)
+NA_COLS = [
+    "screen_id",
+    "study_name",
+    "plate_name",
+    "plate_id",
+    "well_id",
+    "Organism Part",
+]
+
+
+def compare_wells(expected_wells, wells, id_columns=("plate_id", "well_id")):
+    """Differences between two sequences of well metadata dicts
+
+    IDs are compared as integers, the type extraction_utils.schema stores them as.
+
+    Returns
+    -------
+    list
+        One message per differing well count or attribute value
+    """
+    expected_wells = list(expected_wells)
+    wells = list(wells)
+    if len(wells) != len(expected_wells):
+        return [f"{len(wells)} wells, expected {len(expected_wells)}"]
+
+    differences = list()
+    for index, (expected, well) in enumerate(zip(expected_wells, wells)):
+        for column in id_columns:
+            expected[column], well[column] = int(expected[column]), int(well[column])
+        for attribute in expected.keys() | well.keys():
+            if well.get(attribute) != expected.get(attribute):
+                differences.append(
+                    f"well {index} {attribute}: {well.get(attribute)!r}, "
+                    f"expected {expected.get(attribute)!r}"
+                )
+
+    return differences
+
+
+class ReleasedSession(SyntheticSession):
+    """Synthetic IDR after a release that re-imaged one well and removed another
+
+    Parameters
+    ----------
+    layout: utils.synthetic.SyntheticLayout
+        Screen, plate and well layout to serve
+    reimaged_well: int
+        Well whose image ID changes in its plate grid
+    removed_well: int
+        Well left out of its plate grid
+    """
+
+    def __init__(self, layout, reimaged_well, removed_well):
+        super().__init__(layout=layout)
+        self.reimaged_well = reimaged_well
+        self.removed_well = removed_well
+
+    def route(self, path, query):
+        body = super().route(path=path, query=query)
+        if body is None or not path.startswith("/webgateway/plate/"):
+            return body
+
+        for row in body["grid"]:
+            for index, well in enumerate(row):
+                if well is None:
+                    continue
+                if well["wellId"] == self.removed_well:
+                    row[index] = None
+                elif well["wellId"] == self.reimaged_well:
+                    well["id"] += 1
+
+        return body
+
+
+def screen_members(json_metadata_dir, screen_id):
+    """Decoded well json documents of a downloaded screen by member name"""
+    store_dir = screen_block_store(json_metadata_dir, screen_id)
+    archive_file = screen_archive(json_metadata_dir, screen_id)
+    screen_dir = pathlib.Path(json_metadata_dir, str(screen_id))
+    if store_dir is not None:
+        members = iter_block_store(store_dir)
+    elif archive_file is not None:
+        members = iter_archive(archive_file)
+    else:
+        members = (
+            (str(path.relative_to(screen_dir.resolve())), path.read_bytes())
+            for path in walk(screen_dir, extensions=WELL_JSON_EXTENSIONS)
+        )
+
+    return {member_name: json.loads(data) for member_name, data in members}
+
+
+def compare_counters(expected_counters):
+    """Differences between instrumentation counters and their expected values"""
+    counters = instrumentation.snapshot()["counters"]
+
+    return [
+        f"{name}: {counters.get(name, 0)}, expected {expected}"
+        for name, expected in expected_counters.items()
+        if counters.get(name, 0) != expected
+    ]
+
+
+def cache_size_differences(cache_dir, max_bytes=None):
+    """Differences between the size index of a response cache and its entries"""
+    walked_size = sum(
+        entry.stat().st_size for entry in pathlib.Path(cache_dir).glob("*/*")
+    )
+    with open(pathlib.Path(cache_dir, "size.json")) as file:
+        indexed_size = json.load(file)["bytes"]
+
+    differences = list()
+    if indexed_size != walked_size:
+        differences.append(f"size index {indexed_size} B, entries {walked_size} B")
+    if max_bytes is not None and walked_size > max_bytes:
+        differences.append(f"cache holds {walked_size} B, bound {max_bytes} B")
+
+    return differences
+
+
+# Each check builds its inputs under workdir and returns the differences it found
+def check_annotation_csv(workdir):
+    """Wells of an annotation CSV match the wells of their json documents"""
+    layout = SyntheticLayout(n_screens=1, plates_per_screen=2, wells_per_plate=24)
+    screen_id = layout.screen_ids()[0]
+    json_dir = pathlib.Path(workdir, "json_metadata")
+    write_synthetic_json(output_dir=json_dir, layout=layout)
+    well_ids = screen_well_ids(
+        session=SyntheticSession(layout=layout), screen_id=screen_id
+    )
+
+    # Rows are listed in reverse so that wells must be matched by plate and position
+    header, *rows = annotation_csv(layout, screen_id=screen_id).splitlines()
+    csv_file = pathlib.Path(workdir, "annotations.csv")
+    csv_file.write_text("\n".join([header, *reversed(rows)]) + "\n")
+
+    json_wells = [
+        pull_json_well_metadata(
+            well_metadata_file=pathlib.Path(
+                json_dir, str(screen_id), str(plate_id), f"{well_id}.json"
+            ),
+            image_attributes=IMAGE_ATTRIBUTES,
+        )
+        for plate_id, well_id in well_ids.values()
+    ]
+    csv_wells = pull_csv_well_metadata(
+        csv_file=csv_file,
+        well_ids=well_ids,
+        image_attributes=IMAGE_ATTRIBUTES,
+        chunksize=10,
+    )
+
+    return compare_wells(expected_wells=json_wells, wells=csv_wells)
+
+
+def check_response_cache(workdir):
+    """Cached responses are served, revalidated and evicted without changing them"""
+    layout = SyntheticLayout(n_screens=1, plates_per_screen=8, wells_per_plate=24)
+    origin = SyntheticSession(layout=layout)
+    urls = [
+        PLATE_URL.format(plate_id=plate_id)
+        for plate_id in layout.plate_ids(layout.screen_ids()[0])
+    ]
+    origin_content = {url: origin.get(url).content for url in urls}
+
+    differences = list()
+
+    def fetch(session, fetch_urls):
+        for url in fetch_urls:
+            if session.get(url).content != origin_content[url]:
+                differences.append(f"{url}: cached content differs from the origin")
+
+    # Responses are requested once and then served from the cache
+    cache_dir = pathlib.Path(workdir, "cache")
+    instrumentation.reset()
+    with CachingSession(session=origin, cache_dir=cache_dir) as session:
+        fetch(session, urls)
+    with CachingSession(session=origin, cache_dir=cache_dir) as session:
+        fetch(session, urls)
+    differences.extend(
+        compare_counters({"cache_misses": len(urls), "cache_hits": len(urls)})
+    )
+    differences.extend(cache_size_differences(cache_dir))
+
+    # Expired responses are revalidated with conditional requests
+    instrumentation.reset()
+    with CachingSession(
+        session=origin, cache_dir=cache_dir, ttls={"/webgateway/plate/": 0}
+    ) as session:
+        fetch(session, urls)
+    differences.extend(
+        compare_counters({"cache_misses": 0, "cache_revalidated": len(urls)})
+    )
+    differences.extend(cache_size_differences(cache_dir))
+
+    # A cache bounded to 4.5 responses evicts the least recently used one
+    with open(pathlib.Path(cache_dir, "size.json")) as file:
+        max_bytes = int(json.load(file)["bytes"] / len(urls) * 4.5)
+    bounded_cache_dir = pathlib.Path(workdir, "bounded_cache")
+    with CachingSession(
+        session=origin, cache_dir=bounded_cache_dir, max_bytes=max_bytes
+    ) as session:
+        fetch(session, urls[:4])
+        fetch(session, urls[:1])
+        instrumentation.reset()
+        fetch(session, urls[4:5])
+        fetch(session, urls[:1])
+        differences.extend(
+            compare_counters({"cache_evictions": 1, "cache_hits": 1, "cache_misses": 1})
+        )
+        instrumentation.reset()
+        fetch(session, urls[1:2])
+        differences.extend(compare_counters({"cache_misses": 1}))
+        fetch(session, urls)
+    differences.extend(cache_size_differences(bounded_cache_dir, max_bytes=max_bytes))
+
+    return differences
+
+
+def check_delta_sync(workdir):
+    """A delta sync fetches only changed wells and matches a fresh download"""
+    layout = SyntheticLayout(n_screens=2, plates_per_screen=2, wells_per_plate=24)
+    released_layout = SyntheticLayout(
+        n_screens=3, plates_per_screen=2, wells_per_plate=24
+    )
+    changed_plate = released_layout.plate_ids(1)[0]
+    reimaged_well, removed_well = released_layout.well_ids(changed_plate)[:2]
+    released = ReleasedSession(
+        layout=released_layout, reimaged_well=reimaged_well, removed_well=removed_well
+    )
+    n_plates = released_layout.plates_per_screen
+    n_wells = released_layout.wells_per_plate * n_plates
+
+    # Screen 1 changed, screen 2 did not and screen 3 is new
+    expected_syncs = {
+        1: (True, {"wells": 1, "wells_removed": 1, "requests": 2 + n_plates}),
+        2: (False, {"wells": 0, "wells_removed": 0, "requests": 1 + n_plates}),
+        3: (
+            True,
+            {"wells": n_wells, "wells_removed": 0, "requests": 1 + n_plates + n_wells},
+        ),
+    }
+
+    differences = list()
+    for bundle in [None, "tar", "blocks"]:
+        synced_dir = pathlib.Path(workdir, str(bundle), "synced")
+        fresh_dir = pathlib.Path(workdir, str(bundle), "fresh")
+        cache_dir = pathlib.Path(workdir, str(bundle), "cache")
+        for json_metadata_dir in [synced_dir, fresh_dir]:
+            pathlib.Path.mkdir(json_metadata_dir, parents=True)
+
+        # The previous release is downloaded through the cache of routine runs
+        inventories = dict()
+        with CachingSession(
+            session=SyntheticSession(layout=layout), cache_dir=cache_dir
+        ) as session:
+            for screen_id in layout.screen_ids():
+                inventories[screen_id] = screen_inventory(
+                    session=session, screen_id=screen_id
+                )
+                download_screen(
+                    session=session,
+                    screen_id=screen_id,
+                    json_metadata_dir=synced_dir,
+                    bundle=bundle,
+                    inventory=inventories[screen_id],
+                )
+
+        # Plate listings and grids are revalidated, so cached grids do not hide changes
+        with CachingSession(
+            session=released, cache_dir=cache_dir, ttls=DELTA_SYNC_TTLS
+        ) as session:
+            for screen_id in released_layout.screen_ids():
+                instrumentation.reset()
+                _, changed = sync_screen(
+                    session=session,
+                    screen_id=screen_id,
+                    json_metadata_dir=synced_dir,
+                    previous=inventories.get(screen_id, dict()),
+                    bundle=bundle,
+                )
+                expected_changed, expected_counters = expected_syncs[screen_id]
+                screen_differences = compare_counters(expected_counters)
+                if changed != expected_changed:
+                    screen_differences.append(
+                        f"changed: {changed}, expected {expected_changed}"
+                    )
+                differences.extend(
+                    f"{bundle} screen {screen_id} {difference}"
+                    for difference in screen_differences
+                )
+
+        for screen_id in released_layout.screen_ids():
+            download_screen(
+                session=released,
+                screen_id=screen_id,
+                json_metadata_dir=fresh_dir,
+                bundle=bundle,
+            )
+            synced_members = screen_members(synced_dir, screen_id)
+            fresh_members = screen_members(fresh_dir, screen_id)
+            differences.extend(
+                f"{bundle} screen {screen_id} {member_name}: differs from a fresh download"
+                for member_name in sorted(synced_members.keys() | fresh_members.keys())
+                if synced_members.get(member_name) != fresh_members.get(member_name)
+            )
+
+    return differences
+
+
+def check_incremental_databank(workdir):
+    """Incremental databank statistics match a recount after every kind of change"""
+    metadata_dir = pathlib.Path(workdir, "metadata")
+    state_dir = pathlib.Path(workdir, "databank_state")
+    metadata_files = write_synthetic_metadata(
+        output_dir=metadata_dir,
+        scale=0.1,
+        elements_and_counts_file=ELEMENTS_AND_COUNTS_FILE,
+    )
+    # The last screen is added by a later update
+    added_file = metadata_files[-1]
+    held_file = pathlib.Path(workdir, added_file.name)
+    os.replace(added_file, held_file)
+
+    def add_screen():
+        os.replace(held_file, added_file)
+
+    def remove_screen():
+        metadata_files[0].unlink()
+
+    def modify_screen():
+        metadata_df = pd.read_parquet(metadata_files[1])
+        write_metadata(metadata_df.iloc[: len(metadata_df) // 2], metadata_files[1])
+
+    updates = [
+        ("initial", None, len(metadata_files) - 1, 0),
+        ("unchanged", None, 0, 0),
+        ("added", add_screen, 1, 0),
+        ("removed", remove_screen, 0, 1),
+        ("modified", modify_screen, 1, 1),
+    ]
+
+    differences = list()
+    for update, change, screens_added, screens_subtracted in updates:
+        if change is not None:
+            change()
+
+        instrumentation.reset()
+        stats_df = collect_databank_stats(
+            metadata_directory=metadata_dir,
+            na_cols=NA_COLS,
+            mode="incremental",
+            state_dir=state_dir,
+        )
+        update_differences = compare_counters(
+            {
+                "screens_added": screens_added,
+                "screens_subtracted": screens_subtracted,
+            }
+        )
+
+        # Statistics of a recount from scratch, in the sorted order of the state
+        expected_df = (
+            collect_databank_stats(
+                metadata_directory=metadata_dir, na_cols=NA_COLS, mode="streaming"
+            )
+            .sort_values("Attribute")
+            .reset_index(drop=True)
+        )
+        # Undefined evenness is None in one and NaN in the other
+        evenness_dtypes = {"NME": "float64", "J": "float64"}
+        try:
+            pd.testing.assert_frame_equal(
+                stats_df.astype(evenness_dtypes),
+                expected_df.astype(evenness_dtypes),
+                check_dtype=False,
+            )
+        except AssertionError as error:
+            update_differences.append(f"statistics differ from a recount: {error}")
+
+        # Only the files of the current generation are kept
+        n_screens = len(list(walk(metadata_dir, extensions=".parquet")))
+        n_screen_files = len(list(pathlib.Path(state_dir, "screens").iterdir()))
+        if n_screen_files != n_screens:
+            update_differences.append(
+                f"{n_screen_files} screen count files for {n_screens} screens"
+            )
+
+        differences.extend(
+            f"{update} update {difference}" for difference in update_differences
+        )
+
+    return differences
+
+
+CHECKS = {
+    "annotation_csv": check_annotation_csv,
+    "response_cache": check_response_cache,
+    "delta_sync": check_delta_sync,
+    "incremental_databank": check_incremental_databank,
+}
@@ -0,0 +1,45 @@
+import pathlib
+import sys
+import tempfile
+
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+from checks.cases import CHECKS
+from utils.args import check_parser
+
+
+def run_checks(names):
+    """Runs the selected regression checks
+
+    Parameters
+    ----------
+    names: list
+        Check names from checks.cases.CHECKS
+
+    Returns
+    -------
+    failures: dict
+        Differences found per failed check
+    """
+    failures = dict()
+    for name in names:
+        with tempfile.TemporaryDirectory() as workdir:
+            differences = CHECKS[name](workdir)
+        print(f"{name}: {'FAILED' if differences else 'ok'}")
+        for difference in differences:
+            print(f"    {difference}")
+        if differences:
+            failures[name] = differences
+
+    return failures
+
+
+if __name__ == "__main__":
+    # Define arguments
+    args = check_parser().parse_args(sys.argv[1:])
+
+    failures = run_checks(names=args.checks or list(CHECKS.keys()))
+    if failures:
+        print(f"\nFailed checks: {list(failures.keys())}")
+        sys.exit(1)
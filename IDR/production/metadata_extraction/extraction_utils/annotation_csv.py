@@ -0,0 +1,140 @@
+import re
+
+import pandas as pd
+
+# IDR annotation columns that are also published under a mapr namespace with a shorter
+# key, e.g. "Characteristics [Cell Line]" as "Cell Line" or "Phenotype 2 Term Name"
+# as "Phenotype Term Name"
+CHARACTERISTICS_COLUMN = re.compile(r"^Characteristics \[(.+)\]$")
+PHENOTYPE_COLUMN = re.compile(r"^Phenotype \d+( Term Name| Term Accession)?$")
+WELL_POSITION = re.compile(r"^([A-Za-z]+)0*(\d+)$")
+
+
+def annotation_csv_url(annotation_file):
+    """File name and download URL of a screen's annotation CSV
+
+    Parameters
+    ----------
+    annotation_file: str
+        'Annotation File' value of screen_details.parquet, i.e. the file name followed
+        by its GitHub URL
+
+    Returns
+    -------
+    file_name: str
+        Name of the annotation CSV, e.g. idr0001-screenA-annotation.csv
+    url: str
+        Raw file URL, or None if the value holds no URL
+    """
+    file_name, _, url = annotation_file.strip().partition(" ")
+    if not url:
+        return file_name, None
+
+    # GitHub serves the raw file under raw.githubusercontent.com without /blob/
+    match = re.match(r"^https://github.com/([^/]+/[^/]+)/blob/(.+)$", url.strip())
+    if match is not None:
+        url = f"https://raw.githubusercontent.com/{match.group(1)}/{match.group(2)}"
+
+    return file_name, url
+
+
+def well_position(position):
+    """Row label and column number of a well name such as 'B7' or 'B07', or None"""
+    match = WELL_POSITION.match(position.strip())
+    if match is None:
+        return None
+
+    return match.group(1).upper(), int(match.group(2))
+
+
+def grid_well_ids(grid):
+    """Well IDs of a plate by well position
+
+    Parameters
+    ----------
+    grid: dict
+        Response of webgateway/plate/{plate_id}/
+
+    Returns
+    -------
+    dict
+        {(row_label, column): well_id}
+    """
+    well_ids = dict()
+    for row_label, row in zip(grid["rowlabels"], grid["grid"]):
+        for column, well in zip(grid["collabels"], row):
+            if well is not None:
+                well_ids[(str(row_label).upper(), int(column))] = well["wellId"]
+
+    return well_ids
+
+
+def annotation_sources(columns, keys):
+    """Annotation CSV columns feeding each map annotation key
+
+    A well's json document holds the bulk annotation, i.e. the CSV row, followed by
+    the mapr annotations, and later values win in
+    list_modifications.iterate_through_values(). The sources of a key are therefore
+    the column of the same name followed by the mapr columns in CSV order.
+
+    Parameters
+    ----------
+    columns: list
+        Header of the annotation CSV
+    keys: list
+        Map annotation keys to resolve, e.g. image attributes
+
+    Returns
+    -------
+    dict
+        {key: [(column, is_mapr)]} in increasing priority
+    """
+    sources = {key: list() for key in keys}
+    for column in columns:
+        if column in sources:
+            sources[column].append((column, False))
+
+    for column in columns:
+        characteristics = CHARACTERISTICS_COLUMN.match(column)
+        phenotype = PHENOTYPE_COLUMN.match(column)
+        if characteristics is not None:
+            key = characteristics.group(1)
+        elif phenotype is not None:
+            key = f"Phenotype{phenotype.group(1) or ''}"
+        else:
+            continue
+        if key in sources:
+            sources[key].append((column, True))
+
+    return {key: key_sources for key, key_sources in sources.items() if key_sources}
+
+
+def annotation_values_frame(chunk, sources):
+    """Map annotation values of every well in a chunk of an annotation CSV
+
+    mapr annotations only exist for non-empty values, so a mapr column overrides
+    the value of a key only where it is not empty.
+
+    Parameters
+    ----------
+    chunk: pandas.DataFrame
+        Rows of an annotation CSV read as strings with empty cells as ''
+    sources: dict
+        Output of annotation_sources()
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column per key, missing where a well has no value
+    """
+    values = dict()
+    for key, key_sources in sources.items():
+        key_values = pd.Series(None, index=chunk.index, dtype=object)
+        for column, is_mapr in key_sources:
+            if is_mapr:
+                key_values = chunk[column].where(chunk[column] != "", key_values)
+            else:
+                key_values = chunk[column].astype(object)
+        values[key] = key_values
+
+    return pd.DataFrame(values, index=chunk.index)
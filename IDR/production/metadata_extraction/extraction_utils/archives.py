@@ -0,0 +1,189 @@
+import io
+import os
+import pathlib
+import tarfile
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Archive formats for per-screen bundles of well json files and their file extensions
+ARCHIVE_FORMATS = {"tar": ".tar", "tar.zst": ".tar.zst", "zip": ".zip"}
+
+# Well json documents are stored as {well_id}.json or gzip-compressed {well_id}.json.gz
+WELL_JSON_EXTENSIONS = (".json.gz", ".json")
+
+
+def require_zstandard():
+    """Raises ImportError with installation instructions if zstandard is missing
+
+    zstandard is an optional dependency, only needed for .tar.zst bundles
+    """
+    if zstandard is None:
+        raise ImportError(
+            "Reading and writing .tar.zst bundles requires the optional zstandard "
+            "package. Install it with `conda install -c conda-forge zstandard`, or "
+            "use --bundle tar, zip or blocks instead"
+        )
+
+
+def archive_format(archive_file):
+    """Archive format of a bundle from its file name, or None for other files"""
+    name = pathlib.Path(archive_file).name
+    for format_name, extension in sorted(
+        ARCHIVE_FORMATS.items(), key=lambda item: -len(item[1])
+    ):
+        if name.endswith(extension):
+            return format_name
+
+    return None
+
+
+def screen_archive(json_metadata_dir, screen_id):
+    """Path of the bundle holding the well json files of a screen, or None
+
+    Parameters
+    ----------
+    json_metadata_dir: str or pathlib.Path
+        Directory holding {screen_id}/ directories or {screen_id}.{format} bundles
+    screen_id: int
+        ID of the screen data set
+
+    Returns
+    -------
+    pathlib.Path or None
+    """
+    for extension in ARCHIVE_FORMATS.values():
+        archive_file = pathlib.Path(json_metadata_dir, f"{screen_id}{extension}")
+        if archive_file.exists():
+            return archive_file
+
+    return None
+
+
+def screen_entry_id(entry_name):
+    """Screen ID of a json_metadata directory or bundle name, or None for other entries"""
+    screen_id = entry_name.split(".")[0]
+
+    return int(screen_id) if screen_id.isdigit() else None
+
+
+def well_entry_id(entry_name):
+    """Well ID of a well json file or bundle member name, or None for other entries"""
+    for extension in WELL_JSON_EXTENSIONS:
+        if entry_name.endswith(extension):
+            return entry_name.split("/")[-1].removesuffix(extension)
+
+    return None
+
+
+def iter_archive(archive_file):
+    """Streams the members of a bundle sequentially without unpacking to disk
+
+    Parameters
+    ----------
+    archive_file: str or pathlib.Path
+        .tar, .tar.zst or .zip bundle
+
+    Yields
+    ------
+    member_name: str
+        Path of the member inside the bundle, e.g. {plate_id}/{well_id}.json
+    data: bytes
+        Content of the member
+    """
+    format_name = archive_format(archive_file)
+
+    if format_name == "zip":
+        with zipfile.ZipFile(archive_file) as archive:
+            for member in archive.infolist():
+                if not member.is_dir():
+                    yield member.filename, archive.read(member)
+        return
+
+    with open(archive_file, "rb") as file:
+        if format_name == "tar.zst":
+            require_zstandard()
+            stream = zstandard.ZstdDecompressor().stream_reader(file)
+        elif format_name == "tar":
+            stream = file
+        else:
+            raise ValueError(f"Unknown archive format of {archive_file}")
+
+        # Stream mode reads members in order without seeking
+        with tarfile.open(fileobj=stream, mode="r|") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member).read()
+
+
+class BundleWriter:
+    """Writes members into a per-screen bundle
+
+    The bundle is written under a temporary name and moved into place by close(), so
+    that interrupted downloads never leave a truncated bundle behind.
+
+    Parameters
+    ----------
+    archive_file: str or pathlib.Path
+        .tar, .tar.zst or .zip bundle to create
+    """
+
+    def __init__(self, archive_file):
+        self.archive_file = pathlib.Path(archive_file)
+        self.format_name = archive_format(self.archive_file)
+        self.partial_file = pathlib.Path(
+            self.archive_file.parent, f".{self.archive_file.name}.partial"
+        )
+        self._file = None
+        self._stream = None
+
+        if self.format_name == "zip":
+            self._archive = zipfile.ZipFile(
+                self.partial_file, mode="w", compression=zipfile.ZIP_DEFLATED
+            )
+        elif self.format_name in ["tar", "tar.zst"]:
+            if self.format_name == "tar.zst":
+                require_zstandard()
+            self._file = open(self.partial_file, "wb")
+            self._stream = self._file
+            if self.format_name == "tar.zst":
+                self._stream = zstandard.ZstdCompressor().stream_writer(self._file)
+            self._archive = tarfile.open(fileobj=self._stream, mode="w|")
+        else:
+            raise ValueError(
+                f"Unknown archive format of {archive_file}. Choose from {list(ARCHIVE_FORMATS)}"
+            )
+
+    def add(self, member_name, data):
+        """Adds a member with the given bytes content"""
+        if self.format_name == "zip":
+            self._archive.writestr(member_name, data)
+            return
+
+        member = tarfile.TarInfo(name=member_name)
+        member.size = len(data)
+        self._archive.addfile(member, io.BytesIO(data))
+
+    def _close_streams(self):
+        self._archive.close()
+        if self._stream is not None and self._stream is not self._file:
+            self._stream.close()
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+
+    def close(self):
+        self._close_streams()
+        os.replace(self.partial_file, self.archive_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self._close_streams()
+            self.partial_file.unlink(missing_ok=True)
+            return
+        self.close()
@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+
+from extraction_utils.archives import well_entry_id
+
+# Per-screen block stores are {screen_id}.blocks directories next to the json files
+BLOCK_STORE_SUFFIX = ".blocks"
+
+# Keys of the bulk annotation that name the well itself. They are kept with the well
+# so that wells with the same annotation rows share one block. None of them is an
+# image attribute
+PER_WELL_KEYS = ["Plate", "Well", "Well Number"]
+
+
+def block_id(ns, values):
+    """Content address of an annotation block from its namespace and values"""
+    data = json.dumps([ns, values], ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def screen_block_store(json_metadata_dir, screen_id):
+    """Path of the block store holding the well annotations of a screen, or None"""
+    store_dir = pathlib.Path(json_metadata_dir, f"{screen_id}{BLOCK_STORE_SUFFIX}")
+
+    return store_dir if store_dir.exists() else None
+
+
+class BlockStoreWriter:
+    """Writes the well annotations of a screen as distinct blocks and well references
+
+    Each annotation of a well json document, i.e. its namespace and values, is a
+    block. Wells of a screen repeat the same organism, cell line or phenotype
+    blocks, which are stored once under their block_id(). The PER_WELL_KEYS values
+    of the bulk annotation are stored with the well instead, so that bulk rows that
+    only differ in the well they describe are stored once as well. The store holds
+
+        blocks.jsonl: {"id", "ns", "values"} per distinct block
+        wells.jsonl: {"plate", "well", "blocks": [block ids], "values": [[block
+            position, value position, key, value], ...]} per well
+
+    Annotation IDs and links are not kept. The store is written under a temporary
+    name and moved into place by close(). A previous store is first renamed aside and
+    only deleted once the new store is in place.
+
+    Parameters
+    ----------
+    store_dir: str or pathlib.Path
+        {screen_id}.blocks directory to create
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = pathlib.Path(store_dir)
+        self.partial_dir = pathlib.Path(
+            self.store_dir.parent, f".{self.store_dir.name}.partial"
+        )
+        self.old_dir = pathlib.Path(
+            self.store_dir.parent, f".{self.store_dir.name}.old"
+        )
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
+
+        # Restore a store that an interrupted close() renamed aside
+        if self.old_dir.exists() and not self.store_dir.exists():
+            os.replace(self.old_dir, self.store_dir)
+        shutil.rmtree(self.old_dir, ignore_errors=True)
+        pathlib.Path.mkdir(self.partial_dir, parents=True)
+
+        self._blocks = open(pathlib.Path(self.partial_dir, "blocks.jsonl"), "w")
+        self._wells = open(pathlib.Path(self.partial_dir, "wells.jsonl"), "w")
+        self._block_ids = set()
+
+    def add(self, member_name, data):
+        """Adds a well json document given as a {plate_id}/{well_id}.json member"""
+        if member_name.endswith(".gz"):
+            data = gzip.decompress(data)
+
+        well_block_ids = list()
+        well_values = list()
+        for block_position, annotation in enumerate(json.loads(data)["annotations"]):
+            values = list()
+            for value_position, value in enumerate(annotation["values"]):
+                if value[0] in PER_WELL_KEYS:
+                    well_values.append([block_position, value_position, *value])
+                else:
+                    values.append(value)
+
+            id_ = block_id(annotation["ns"], values)
+            if id_ not in self._block_ids:
+                self._block_ids.add(id_)
+                block = {"id": id_, "ns": annotation["ns"], "values": values}
+                self._blocks.write(json.dumps(block, ensure_ascii=False) + "\n")
+            well_block_ids.append(id_)
+
+        well = {
+            "plate": member_name.split("/")[-2],
+            "well": well_entry_id(member_name),
+            "blocks": well_block_ids,
+            "values": well_values,
+        }
+        self._wells.write(json.dumps(well, ensure_ascii=False) + "\n")
+
+    def _close_files(self):
+        self._blocks.close()
+        self._wells.close()
+
+    def close(self):
+        self._close_files()
+        if self.store_dir.exists():
+            os.replace(self.store_dir, self.old_dir)
+        os.replace(self.partial_dir, self.store_dir)
+        shutil.rmtree(self.old_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self._close_files()
+            shutil.rmtree(self.partial_dir, ignore_errors=True)
+            return
+        self.close()
+
+
+def read_blocks(store_dir):
+    """Distinct annotation blocks of a block store
+
+    Returns
+    -------
+    blocks: dict
+        {block id: (ns, values)}
+    """
+    blocks = dict()
+    with open(pathlib.Path(store_dir, "blocks.jsonl")) as file:
+        for line in file:
+            block = json.loads(line)
+            blocks[block["id"]] = (block["ns"], block["values"])
+
+    return blocks
+
+
+def iter_wells(store_dir):
+    """Streams (plate_id, well_id, block ids, well values) of the wells in a block store
+
+    Well values are [block position, value position, key, value] lists, see
+    BlockStoreWriter
+    """
+    with open(pathlib.Path(store_dir, "wells.jsonl")) as file:
+        for line in file:
+            well = json.loads(line)
+            yield well["plate"], well["well"], well["blocks"], well.get(
+                "values", list()
+            )
+
+
+def iter_block_store(store_dir):
+    """Streams the wells of a block store as well json members
+
+    Same interface as extraction_utils.archives.iter_archive(), so that stores can
+    be copied into other writers. Documents hold the annotation namespaces and
+    values only.
+
+    Yields
+    ------
+    member_name: str
+        {plate_id}/{well_id}.json
+    data: bytes
+        Well json document
+    """
+    blocks = read_blocks(store_dir)
+    for plate, well, well_block_ids, well_values in iter_wells(store_dir):
+        annotations = [
+            {"ns": blocks[id_][0], "values": list(blocks[id_][1])}
+            for id_ in well_block_ids
+        ]
+        # Values were removed in order, so they are inserted back in order
+        for block_position, value_position, key, value in well_values:
+            annotations[block_position]["values"].insert(value_position, [key, value])
+        yield f"{plate}/{well}.json", json.dumps(
+            {"annotations": annotations}, ensure_ascii=False
+        ).encode("utf-8")
@@ -1,3 +1,4 @@
+import functools
 import re
 
 
@@ -8,8 +9,8 @@ def clear_parentheses(channel_item):
     return channel_item.strip()
 
 
-def clean_channel(channels):
-    """Cleans metadata channels to convert to 'stain:target;stain:target' format
+def clean_channel_pairs(channels):
+    """Cleans metadata channels into stain and target pairs
     Parameters
     ----------
     channels: str
@@ -17,8 +18,8 @@ def clean_channel(channels):
 
     Returns
     -------
-    combined_sorted_stains_targets: str
-        Single string in stain:target;stain:target format sorted in alphebetical order by stain
+    stains_targets: list
+        {"stain": str, "target": str} per channel, lower case and sorted in alphebetical order by stain
     """
     stains_targets = list()
     for channel in channels.split(";"):
@@ -48,6 +49,78 @@ def clean_channel(channels):
             stains_targets.append(f"{stain_name}:{target_name}")
 
     stains_targets.sort()
-    combined_sorted_stains_targets = ";".join(stains_targets)
 
-    return combined_sorted_stains_targets.lower()
+    # Stains never contain ':' so the first ':' separates stain and target
+    return [
+        dict(zip(["stain", "target"], stain_target.lower().split(":", 1)))
+        for stain_target in stains_targets
+    ]
+
+
+# Wells of a screen repeat a few distinct Channels values, which are cleaned once each.
+# The returned lists are shared between wells and must not be modified
+cached_clean_channel_pairs = functools.lru_cache(maxsize=4096)(clean_channel_pairs)
+
+
+def clean_channel(channels):
+    """Cleans metadata channels to convert to 'stain:target;stain:target' format
+    Parameters
+    ----------
+    channels: str
+        String of stain:target
+
+    Returns
+    -------
+    combined_sorted_stains_targets: str
+        Single string in stain:target;stain:target format sorted in alphebetical order by stain
+    """
+    return join_channel_pairs(clean_channel_pairs(channels))
+
+
+def join_channel_pairs(stains_targets):
+    """Joins stain and target pairs into a single 'stain:target;stain:target' string"""
+    return ";".join(
+        f"{stain_target['stain']}:{stain_target['target']}"
+        for stain_target in stains_targets
+    )
+
+
+def count_channel_plates(channel_plates, stains_targets, plate_id):
+    """Records the plate of a well for each of its channels
+
+    Parameters
+    ----------
+    channel_plates: dict
+        Plate IDs per (stain, target) pair, updated in place
+    stains_targets: list
+        Output of clean_channel_pairs() for the well
+    plate_id: str
+        IDR plate ID of the well
+    """
+    for stain_target in stains_targets:
+        channel_plates.setdefault(
+            (stain_target["stain"], stain_target["target"]), set()
+        ).add(plate_id)
+
+
+def channel_table(channel_plates, screen_id, idr_name):
+    """Normalised channel table of a screen
+
+    Parameters
+    ----------
+    channel_plates: dict
+        Plate IDs per (stain, target) pair collected with count_channel_plates()
+    screen_id: int
+        IDR internal ID of the screen
+    idr_name: str
+        IDR study and screen name
+
+    Returns
+    -------
+    list
+        [screen_id, idr_name, channel, stain, mark, plate_count] per channel
+    """
+    return [
+        [screen_id, idr_name, f"{stain}:{mark}", stain, mark, len(plate_ids)]
+        for (stain, mark), plate_ids in sorted(channel_plates.items())
+    ]
@@ -1,20 +1,103 @@
+import os
 import pathlib
 
 
-def walk(path):
+def walk(path, extensions=None):
     """Collects paths for files in path parameter
 
+    Directories are listed with os.scandir(), whose entries know their type without
+    an additional stat() call per file. The root is resolved once and file paths are
+    joined onto it.
+
     Parameters
     ----------
     path: str or pathlib.Path() object
             Path to metadata folder containing IDR study directories
+    extensions: str or tuple
+            Only yield files ending with one of these extensions, e.g. (".json", ".json.gz")
 
     Returns
     -------
     PosixPath object
     """
-    for subdir in pathlib.Path(path).iterdir():
-        if subdir.is_dir():
-            yield from walk(subdir)
-            continue
-        yield subdir.resolve()
+    root = pathlib.Path(path).resolve()
+    for file_path in _scan(str(root), extensions):
+        yield pathlib.Path(file_path)
+
+
+def _scan(directory, extensions):
+    """Depth-first os.scandir() traversal yielding file paths as strings"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from _scan(entry.path, extensions)
+                continue
+            if extensions is None or entry.name.endswith(extensions):
+                yield entry.path
+
+
+def group_files(path, extensions=None, depth=2):
+    """Streams file paths grouped by the directories depth levels below path
+
+    With the json_metadata layout {path}/{screen_id}/{plate_id}/{well_id}.json, depth=2
+    groups the well files by screen and plate and depth=1 groups the files of a screen
+    directory by plate. Each group is listed with os.scandir() and yielded as soon as
+    it is complete, so processing a group can overlap with listing the next one.
+    Files above the group level, such as {screen_id}.tar bundles, and groups without
+    matching files, such as {screen_id}.blocks stores, are skipped.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path() object
+            Path to the folder containing the group directories
+    extensions: str or tuple
+            Only collect files ending with one of these extensions
+    depth: int
+            Number of directory levels that make up a group key
+
+    Yields
+    ------
+    group: tuple
+        (directory names, [PosixPath objects]) per group in discovery order
+    """
+    root = pathlib.Path(path).resolve()
+    for group_dir in _scan_dirs(str(root), depth):
+        files = [pathlib.Path(file_path) for file_path in _scan(group_dir, extensions)]
+        if files:
+            yield pathlib.Path(group_dir).relative_to(root).parts, files
+
+
+def _scan_dirs(directory, depth):
+    """Directory paths exactly depth levels below directory"""
+    if depth == 0:
+        yield directory
+        return
+    with os.scandir(directory) as entries:
+        sub_dirs = [entry.path for entry in entries if entry.is_dir()]
+    for sub_dir in sub_dirs:
+        yield from _scan_dirs(sub_dir, depth - 1)
+
+
+def stream_to_pool(pool, func, items, chunksize=1):
+    """Maps func over items as they are discovered
+
+    Pool.imap() feeds tasks from a background thread, so a lazy source such as
+    walk() or group_files() keeps listing while the workers process what it found.
+
+    Parameters
+    ----------
+    pool: multiprocessing.Pool or multiprocessing.pool.ThreadPool
+        Worker pool
+    func: function
+        Called with each item
+    items: iterable
+        Lazily produced work items, e.g. file paths or file groups
+    chunksize: int
+        Items sent to a worker at a time
+
+    Returns
+    -------
+    iterator
+        Results of func in discovery order
+    """
+    return pool.imap(func, items, chunksize=chunksize)
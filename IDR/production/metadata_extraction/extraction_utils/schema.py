@@ -0,0 +1,186 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Channels are stored per well as a list of stain:target pairs
+CHANNEL_TYPE = pa.list_(pa.struct([("stain", pa.string()), ("target", pa.string())]))
+
+# Image attributes repeat few unique values across many wells and are dictionary-encoded
+CATEGORY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+METADATA_SCHEMA = pa.schema(
+    [
+        ("Channels", CHANNEL_TYPE),
+        ("Organism", CATEGORY_TYPE),
+        ("Cell Line", CATEGORY_TYPE),
+        ("Organism Part", CATEGORY_TYPE),
+        ("Strain", CATEGORY_TYPE),
+        ("Gene Identifier", CATEGORY_TYPE),
+        ("Gene Symbol", CATEGORY_TYPE),
+        ("Phenotype", CATEGORY_TYPE),
+        ("Phenotype Term Name", CATEGORY_TYPE),
+        ("Compound Name", CATEGORY_TYPE),
+        ("siRNA Identifier", CATEGORY_TYPE),
+        ("plate_id", pa.int64()),
+        ("well_id", pa.int64()),
+        ("screen_id", pa.int64()),
+        ("Imaging Method", CATEGORY_TYPE),
+        ("Sample", CATEGORY_TYPE),
+    ]
+)
+
+DEFAULT_COMPRESSION = "zstd"
+DEFAULT_ROW_GROUP_SIZE = 1_000_000
+
+
+def split_channels(channels):
+    """Converts a cleaned 'stain:target;stain:target' string into stain and target pairs
+
+    Parameters
+    ----------
+    channels: str
+        Output of extraction_utils.clean_channels.clean_channel()
+
+    Returns
+    -------
+    list
+        {"stain": str, "target": str} per channel
+    """
+    channel_list = list()
+    for channel in channels.split(";"):
+        if not channel:
+            continue
+        # Placeholders such as 'Not listed' have no target
+        stain, separator, target = channel.partition(":")
+        channel_list.append({"stain": stain, "target": target if separator else None})
+
+    return channel_list
+
+
+def metadata_table(screen_results_df):
+    """Converts per-screen metadata into an Arrow table with the declared schema
+
+    Columns that are not part of METADATA_SCHEMA keep their inferred type.
+
+    Parameters
+    ----------
+    screen_results_df: pandas.DataFrame
+        Metadata per well as assembled by collect_metadata()
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    arrays = list()
+    fields = list()
+    for column in screen_results_df.columns:
+        values = screen_results_df[column]
+        if column in METADATA_SCHEMA.names:
+            field = METADATA_SCHEMA.field(column)
+            if column == "Channels":
+                values = [
+                    split_channels(channels) if isinstance(channels, str) else channels
+                    for channels in values
+                ]
+            elif pa.types.is_integer(field.type):
+                values = values.astype("int64")
+            array = pa.array(values, type=field.type, from_pandas=True)
+        else:
+            array = pa.array(values, from_pandas=True)
+            field = pa.field(column, array.type)
+        arrays.append(array)
+        fields.append(field)
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def write_metadata(
+    screen_results_df,
+    output_file,
+    compression=DEFAULT_COMPRESSION,
+    row_group_size=DEFAULT_ROW_GROUP_SIZE,
+):
+    """Writes per-screen metadata as .parquet with the declared schema
+
+    Parameters
+    ----------
+    screen_results_df: pandas.DataFrame
+        Metadata per well
+    output_file: str or pathlib.Path
+        Output .parquet file
+    compression: str
+        Parquet compression codec, e.g. zstd, snappy, gzip or none
+    row_group_size: int
+        Maximum number of rows per row group
+    """
+    pq.write_table(
+        metadata_table(screen_results_df),
+        output_file,
+        compression=compression,
+        row_group_size=row_group_size,
+    )
+
+
+def join_channels(channel_array):
+    """Converts list<struct<stain, target>> channels back into 'stain:target;...' strings"""
+    if isinstance(channel_array, pa.ChunkedArray):
+        return pa.chunked_array(
+            [join_channels(chunk) for chunk in channel_array.chunks], type=pa.string()
+        )
+
+    pairs = pc.binary_join_element_wise(
+        channel_array.flatten().field("stain"),
+        channel_array.flatten().field("target"),
+        ":",
+        null_handling="skip",
+    )
+    offsets = channel_array.offsets
+    pair_lists = pa.ListArray.from_arrays(
+        pc.subtract(offsets, offsets[0]), pairs, mask=channel_array.is_null()
+    )
+
+    return pc.binary_join(pair_lists, ";")
+
+
+def normalize_channels(table):
+    """Replaces a list typed Channels column by its string form
+
+    Statistics treat each combination of channels as one element. Tables written before
+    the declared schema already store strings and are returned unchanged.
+
+    Parameters
+    ----------
+    table: pyarrow.Table or pyarrow.RecordBatch
+        Per-screen metadata
+
+    Returns
+    -------
+    pyarrow.Table or pyarrow.RecordBatch
+    """
+    if "Channels" not in table.schema.names:
+        return table
+
+    index = table.schema.get_field_index("Channels")
+    if not pa.types.is_list(table.schema.field(index).type):
+        return table
+
+    return table.set_column(index, "Channels", join_channels(table.column(index)))
+
+
+def read_metadata(metadata_file_path, columns=None):
+    """Reads per-screen metadata into pandas with Channels as strings
+
+    Parameters
+    ----------
+    metadata_file_path: str or pathlib.Path
+        Per-screen .parquet metadata file
+    columns: list
+        Columns to read, all by default
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    table = normalize_channels(pq.read_table(metadata_file_path, columns=columns))
+
+    return table.to_pandas()
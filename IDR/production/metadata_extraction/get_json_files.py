@@ -1,14 +1,498 @@
+import gzip
 import json
 import os
 import pathlib
+import sys
 
 import pandas as pd
 import requests
 from tqdm import tqdm
 
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+sys.path.append(str(pathlib.Path(__file__).parent))
+from extraction_utils.archives import (
+    ARCHIVE_FORMATS,
+    WELL_JSON_EXTENSIONS,
+    BundleWriter,
+    iter_archive,
+    require_zstandard,
+    screen_archive,
+    screen_entry_id,
+    well_entry_id,
+)
+from extraction_utils.blocks import (
+    BLOCK_STORE_SUFFIX,
+    BlockStoreWriter,
+    iter_block_store,
+    iter_wells,
+    screen_block_store,
+)
+from extraction_utils.io import walk
+from utils import instrumentation
+from utils.args import get_json_files_parser
+from utils.transport import session_from_args
+
+# Delta sync compares plate listings and grids with the server, so cached copies of
+# them are always revalidated whatever their TTL
+DELTA_SYNC_TTLS = {"/webclient/api/plates/": 0, "/webgateway/plate/": 0}
+
+
+def load_screen_ids(ids_file):
+    """Loads IDR screen IDs from an ID listing file
+
+    Parameters
+    ----------
+    ids_file: str or pathlib.Path
+        .tsv or .parquet file with an 'id' column, as written by utils/get_ids.py
+
+    Returns
+    -------
+    screen_ids: list
+        IDR screen IDs
+    """
+    ids_file = pathlib.Path(ids_file)
+    if ids_file.suffix == ".parquet":
+        ids_df = pd.read_parquet(ids_file)
+    else:
+        ids_df = pd.read_csv(ids_file, sep="\t")
+
+    if "category" in ids_df.columns:
+        ids_df = ids_df.query("category=='Screen'")
+
+    return ids_df.id.values.tolist()
+
+
+def get_json(session, url):
+    """Requests a json document from the IDR API, counting requests and bytes
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    url: str
+        IDR API URL
+
+    Returns
+    -------
+    dict
+        Decoded json response
+    """
+    with instrumentation.stage("download"):
+        response = session.get(url)
+    instrumentation.count("requests")
+    instrumentation.count("bytes_downloaded", len(response.content))
+
+    return response.json()
+
+
+def get_body(session, url, compress=False):
+    """Requests a document from the IDR API as raw bytes, counting requests and bytes
+
+    The body is stored as received, without decoding and re-encoding it. With
+    compress, a body that the server sent gzip-encoded is kept as it was on the
+    wire and any other body is gzip-compressed.
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    url: str
+        IDR API URL
+    compress: bool
+        Return gzip-compressed bytes
+
+    Returns
+    -------
+    bytes
+        Response body
+    """
+    with instrumentation.stage("download"):
+        response = session.get(url, stream=compress)
+        response.raise_for_status()
+        passthrough = (
+            compress
+            and response.headers.get("Content-Encoding") == "gzip"
+            and hasattr(response, "raw")
+        )
+        if passthrough:
+            content = response.raw.read(decode_content=False)
+        else:
+            content = response.content
+    instrumentation.count("requests")
+    instrumentation.count("bytes_downloaded", len(content))
+
+    if compress and not passthrough:
+        with instrumentation.stage("compress"):
+            content = gzip.compress(content, compresslevel=6, mtime=0)
+
+    return content
+
+
+class DirectoryWriter:
+    """Writes well json members as loose files below a screen directory
+
+    Parameters
+    ----------
+    screen_dir: pathlib.Path
+        Directory receiving {plate_id}/{well_id}.json files
+    """
+
+    def __init__(self, screen_dir):
+        self.screen_dir = pathlib.Path(screen_dir)
+
+    def add(self, member_name, data):
+        output_file = pathlib.Path(self.screen_dir, member_name)
+        pathlib.Path.mkdir(output_file.parent, exist_ok=True, parents=True)
+        with open(output_file, "wb") as file:
+            file.write(data)
+
+    def close(self):
+        pass
+
+
+def screen_inventory(session, screen_id):
+    """Plates and wells of a screen from the plate listing and plate grids
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    screen_id: int
+        ID of the screen data set
+
+    Returns
+    -------
+    inventory: dict
+        {plate_id: {"name": plate name, "wells": {well_id: image_id}}} with string IDs
+    """
+    # Get plate ids
+    PLATES_IN_SCREEN_URL = (
+        f"https://idr.openmicroscopy.org/webclient/api/plates/?id={screen_id}"
+    )
+    all_plates = get_json(session=session, url=PLATES_IN_SCREEN_URL)["plates"]
+    study_plates = {x["id"]: x["name"] for x in all_plates}
+
+    # Get well ids
+    inventory = dict()
+    for plate in study_plates:
+        WELLS_IN_PLATES_URL = f"https://idr.openmicroscopy.org/webgateway/plate/{plate}"
+
+        # Access .json file for the plate ID. Contains well ID numbers
+        # for each well per plate.
+        all_wells = get_json(session=session, url=WELLS_IN_PLATES_URL)
+
+        wells = dict()
+        for row in range(len(all_wells["grid"])):
+            for well in all_wells["grid"][row]:
+                if well is not None:
+                    wells[str(well["wellId"])] = well.get("id")
+        inventory[str(plate)] = {"name": study_plates[plate], "wells": wells}
+
+    return inventory
+
+
+def inventory_from_files(json_metadata_dir, screen_id):
+    """Plates and wells of a downloaded screen from its json files
+
+    Used for screens downloaded before inventories were recorded. Image IDs are
+    unknown and given as None.
+
+    Parameters
+    ----------
+    json_metadata_dir: pathlib.Path
+        Directory holding {screen_id}/ directories, {screen_id}.{format} bundles or
+        {screen_id}.blocks stores
+    screen_id: int
+        ID of the screen data set
+
+    Returns
+    -------
+    inventory: dict
+        See screen_inventory(), or None if the screen is not downloaded
+    """
+    store_dir = screen_block_store(json_metadata_dir, screen_id)
+    archive_file = screen_archive(json_metadata_dir, screen_id)
+    screen_dir = pathlib.Path(json_metadata_dir, str(screen_id))
+    if store_dir is not None:
+        member_names = (
+            f"{plate}/{well}.json" for plate, well, _, _ in iter_wells(store_dir)
+        )
+    elif archive_file is not None:
+        member_names = (member_name for member_name, _ in iter_archive(archive_file))
+    elif screen_dir.exists():
+        member_names = (
+            str(path.relative_to(screen_dir.resolve()))
+            for path in walk(screen_dir, extensions=WELL_JSON_EXTENSIONS)
+        )
+    else:
+        return None
+
+    inventory = dict()
+    for member_name in member_names:
+        well = well_entry_id(member_name)
+        if well is None:
+            continue
+        plate = member_name.split("/")[-2]
+        plate_inventory = inventory.setdefault(plate, {"name": None, "wells": dict()})
+        plate_inventory["wells"][well] = None
+
+    return inventory
+
+
+def inventory_delta(previous, current):
+    """Wells to download and to remove to bring a screen up to date
+
+    A well is downloaded if it is new or if the image of the well changed. Wells of
+    a previous inventory without image IDs count as unchanged.
+
+    Only well and image IDs are compared, since the plate grids do not carry the
+    annotations. Annotations edited on an unchanged image are therefore not
+    downloaded again. Remove the well json files of a screen to refetch them.
+
+    Parameters
+    ----------
+    previous: dict
+        Inventory of the downloaded screen, see screen_inventory()
+    current: dict
+        Inventory of the screen in IDR
+
+    Returns
+    -------
+    download: list
+        (plate_id, well_id) pairs to download
+    remove: list
+        (plate_id, well_id) pairs no longer in IDR
+    """
+    download = list()
+    for plate, plate_inventory in current.items():
+        previous_wells = previous.get(plate, dict()).get("wells", dict())
+        for well, image in plate_inventory["wells"].items():
+            if well not in previous_wells or previous_wells[well] not in [None, image]:
+                download.append((plate, well))
+
+    remove = [
+        (plate, well)
+        for plate, plate_inventory in previous.items()
+        for well in plate_inventory["wells"]
+        if well not in current.get(plate, dict()).get("wells", dict())
+    ]
+
+    return download, remove
+
+
+def download_wells(session, wells, writer, compress=False):
+    """Downloads the annotation json files of wells
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    wells: iterable
+        (plate_id, well_id) pairs
+    writer: DirectoryWriter, extraction_utils.archives.BundleWriter or
+        extraction_utils.blocks.BlockStoreWriter
+        Receives {plate_id}/{well_id}.json members
+    compress: bool
+        Write gzip-compressed {plate_id}/{well_id}.json.gz members instead
+
+    Returns
+    -------
+    n_wells: int
+        Number of downloaded well json files
+    """
+    n_wells = 0
+    for plate, wellID in wells:
+        MAP_URL = f"https://idr.openmicroscopy.org/webclient/api/annotations/?type=map&well={wellID}"
+
+        # Connect to IDR API
+        well_metadata = get_body(session=session, url=MAP_URL, compress=compress)
+
+        # Save the json files per plate ID
+        extension = ".json.gz" if compress else ".json"
+        with instrumentation.stage("write"):
+            writer.add(f"{plate}/{wellID}{extension}", well_metadata)
+        instrumentation.count("files_written")
+        n_wells += 1
+
+    instrumentation.count("wells", n_wells)
+
+    return n_wells
+
+
+def screen_writer(json_metadata_dir, screen_id, bundle=None):
+    """DirectoryWriter, BundleWriter or BlockStoreWriter receiving the json files of a screen"""
+    if bundle is None:
+        return DirectoryWriter(pathlib.Path(json_metadata_dir, str(screen_id)))
+    if bundle == "blocks":
+        return BlockStoreWriter(
+            pathlib.Path(json_metadata_dir, f"{screen_id}{BLOCK_STORE_SUFFIX}")
+        )
+
+    return BundleWriter(
+        pathlib.Path(json_metadata_dir, f"{screen_id}{ARCHIVE_FORMATS[bundle]}")
+    )
+
+
+def download_screen(
+    session, screen_id, json_metadata_dir, bundle=None, inventory=None, compress=False
+):
+    """Downloads the well annotation json files of every plate in a screen
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    screen_id: int
+        ID of the screen data set
+    json_metadata_dir: pathlib.Path
+        Directory to save json files to as {screen_id}/{plate_id}/{well_id}.json
+    bundle: str
+        Archive format from extraction_utils.archives.ARCHIVE_FORMATS. If given, json
+        files are written straight into a {screen_id}.{format} bundle instead. With
+        "blocks", the distinct annotation blocks of the screen are written into a
+        {screen_id}.blocks store, see extraction_utils.blocks.BlockStoreWriter
+    inventory: dict
+        Plates and wells of the screen from screen_inventory(). Requested if not given
+    compress: bool
+        Write gzip-compressed .json.gz files
+
+    Returns
+    -------
+    n_wells: int
+        Number of downloaded well json files
+    """
+    if inventory is None:
+        inventory = screen_inventory(session=session, screen_id=screen_id)
+
+    writer = screen_writer(json_metadata_dir, screen_id, bundle=bundle)
+    n_wells = download_wells(
+        session=session,
+        wells=[
+            (plate, well)
+            for plate, plate_inventory in inventory.items()
+            for well in plate_inventory["wells"]
+        ],
+        writer=writer,
+        compress=compress,
+    )
+
+    # Move a completed bundle into place
+    writer.close()
+
+    return n_wells
+
+
+def sync_screen(
+    session, screen_id, json_metadata_dir, previous, bundle=None, compress=False
+):
+    """Downloads only the new and changed wells of a screen
+
+    Only the plate listing and plate grids are requested for unchanged screens.
+    Removed wells are deleted. A bundle or block store is rewritten with its unchanged
+    members and the downloaded wells.
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    screen_id: int
+        ID of the screen data set
+    json_metadata_dir: pathlib.Path
+        Directory holding {screen_id}/ directories, {screen_id}.{format} bundles or
+        {screen_id}.blocks stores
+    previous: dict
+        Inventory of the downloaded screen, empty for screens that are not downloaded
+    bundle: str
+        Archive format of screens that are not downloaded yet
+    compress: bool
+        Write downloaded wells as gzip-compressed .json.gz files
+
+    Returns
+    -------
+    inventory: dict
+        Current inventory of the screen, see screen_inventory()
+    changed: bool
+        Whether json files of the screen were added, replaced or removed
+    """
+    inventory = screen_inventory(session=session, screen_id=screen_id)
+    download, remove = inventory_delta(previous=previous, current=inventory)
+    instrumentation.count("wells_removed", len(remove))
+    if not download and not remove:
+        return inventory, False
+
+    store_dir = screen_block_store(json_metadata_dir, screen_id)
+    archive_file = screen_archive(json_metadata_dir, screen_id)
+    stale_wells = set(download + remove)
+    if store_dir is not None:
+        writer = BlockStoreWriter(store_dir)
+        for member_name, data in iter_block_store(store_dir):
+            well = well_entry_id(member_name)
+            if (member_name.split("/")[-2], well) not in stale_wells:
+                writer.add(member_name, data)
+    elif archive_file is not None:
+        writer = BundleWriter(archive_file)
+        for member_name, data in iter_archive(archive_file):
+            well = well_entry_id(member_name)
+            if (member_name.split("/")[-2], well) not in stale_wells:
+                writer.add(member_name, data)
+    elif previous:
+        writer = DirectoryWriter(pathlib.Path(json_metadata_dir, str(screen_id)))
+        for plate, well in stale_wells:
+            for extension in WELL_JSON_EXTENSIONS:
+                pathlib.Path(writer.screen_dir, plate, f"{well}{extension}").unlink(
+                    missing_ok=True
+                )
+    else:
+        writer = screen_writer(json_metadata_dir, screen_id, bundle=bundle)
+
+    download_wells(session=session, wells=download, writer=writer, compress=compress)
+    writer.close()
+
+    return inventory, True
+
+
+def load_inventory(inventory_file):
+    """Inventories recorded by previous downloads, or an empty dict"""
+    inventory_file = pathlib.Path(inventory_file)
+    if not inventory_file.exists():
+        return dict()
+
+    with open(inventory_file) as file:
+        return json.load(file)
+
+
+def save_inventory(inventory, inventory_file):
+    """Saves the inventory of every downloaded screen by screen ID"""
+    with open(inventory_file, "w") as file:
+        json.dump(inventory, file)
+
+
+def flag_screens(screen_ids, flagged_screens_file):
+    """Adds screens to the list of screens awaiting metadata extraction"""
+    flagged_screens_file = pathlib.Path(flagged_screens_file)
+    if flagged_screens_file.exists():
+        screen_ids = load_screen_ids(flagged_screens_file) + list(screen_ids)
+
+    pd.DataFrame({"id": sorted(set(screen_ids))}).to_csv(
+        flagged_screens_file, sep="\t", index=False
+    )
+
+
 if __name__ == "__main__":
+    # Define arguments
+    args = get_json_files_parser().parse_args(sys.argv[1:])
+
+    # Fail before downloading if the bundle format cannot be written
+    if args.bundle == "tar.zst":
+        require_zstandard()
+
+    if args.profile_dir is not None:
+        instrumentation.enable_profiling(args.profile_dir)
+
     # Initialize session
-    session = requests.Session()
+    session = session_from_args(args, ttls=DELTA_SYNC_TTLS if args.delta_sync else None)
 
     # Create http session
     INDEX_PAGE = "https://idr.openmicroscopy.org/webclient/?experimenter=-1"
@@ -20,57 +504,58 @@ if __name__ == "__main__":
             response.raise_for_status()
 
     # Load idr screen ids
-    idr_ids_file = pathlib.Path("IDR/data/idr_ids.tsv")
-    screen_ids = pd.read_csv(idr_ids_file, sep="\t").id.values.tolist()
+    screen_ids = load_screen_ids(ids_file=args.ids_file)
 
-    json_metadata_dir = pathlib.Path("IDR/data/json_metadata")
-    available_screens = os.listdir(json_metadata_dir)
-    available_screens = [int(screen_id) for screen_id in available_screens]
+    json_metadata_dir = pathlib.Path(args.output_dir)
+    pathlib.Path.mkdir(json_metadata_dir, exist_ok=True, parents=True)
+    inventory = load_inventory(args.inventory_file)
 
-    screen_ids = [id_ for id_ in screen_ids if id_ not in available_screens]
+    if args.delta_sync:
+        # Compare every screen against the inventory of its previous download
+        flagged_screens = list()
+        for screen_id in tqdm(screen_ids):
+            previous = inventory.get(str(screen_id))
+            if previous is None:
+                previous = inventory_from_files(json_metadata_dir, screen_id) or dict()
+            inventory[str(screen_id)], changed = sync_screen(
+                session=session,
+                screen_id=screen_id,
+                json_metadata_dir=json_metadata_dir,
+                previous=previous,
+                bundle=args.bundle,
+                compress=args.compress,
+            )
+            if changed:
+                flagged_screens.append(screen_id)
+    else:
+        available_screens = [
+            screen_entry_id(entry_name) for entry_name in os.listdir(json_metadata_dir)
+        ]
 
-    # Get plate ids
-    for screen_id in tqdm(screen_ids):
-        PLATES_IN_SCREEN_URL = (
-            f"https://idr.openmicroscopy.org/webclient/api/plates/?id={screen_id}"
-        )
-        all_plates = session.get(PLATES_IN_SCREEN_URL).json()["plates"]
-        study_plates = {x["id"]: x["name"] for x in all_plates}
+        screen_ids = [id_ for id_ in screen_ids if id_ not in available_screens]
 
-        # Get well ids
-        for plate in study_plates:
-            WELLS_IN_PLATES_URL = (
-                f"https://idr.openmicroscopy.org/webgateway/plate/{plate}"
+        # Download well metadata per screen
+        for screen_id in tqdm(screen_ids):
+            inventory[str(screen_id)] = screen_inventory(
+                session=session, screen_id=screen_id
+            )
+            download_screen(
+                session=session,
+                screen_id=screen_id,
+                json_metadata_dir=json_metadata_dir,
+                bundle=args.bundle,
+                inventory=inventory[str(screen_id)],
+                compress=args.compress,
             )
-            wellIDs = list()
-            plate_name = study_plates[plate]
-
-            # Access .json file for the plate ID. Contains well ID numbers
-            # for each well per plate.
-            all_wells = session.get(WELLS_IN_PLATES_URL).json()
-
-            excluded_keys = ["collabels", "rowlabels", "image_sizes"]
-            for key in excluded_keys:
-                all_wells.pop(key, None)
-            for row in range(len(all_wells["grid"])):
-                for well in all_wells["grid"][row]:
-                    if well is not None:
-                        # Append IDs to iterable lists
-                        wellIDs.append(well["wellId"])
-                    else:
-                        pass
-
-            for wellID in wellIDs:
-                MAP_URL = f"https://idr.openmicroscopy.org/webclient/api/annotations/?type=map&well={wellID}"
-
-                # Connect to IDR API
-                well_metadata = session.get(MAP_URL).json()
-
-                # Make directories for each screen ID and plate ID
-                output_dir = pathlib.Path(f"IDR/data/json_metadata/{screen_id}/{plate}")
-                pathlib.Path.mkdir(output_dir, exist_ok=True, parents=True)
-
-                # Download the json files
-                output_file = pathlib.Path(output_dir, f"{wellID}.json")
-                with open(output_file, "w", encoding="utf-8") as file:
-                    json.dump(well_metadata, file, ensure_ascii=False, indent=4)
+        flagged_screens = screen_ids
+
+    save_inventory(inventory, args.inventory_file)
+    flag_screens(flagged_screens, args.flagged_screens_file)
+    print(f"{len(flagged_screens)} screens flagged for metadata extraction.")
+
+    session.close()
+
+    metrics_file = instrumentation.write_report(
+        metrics_dir=args.metrics_dir, run_name="get_json_files"
+    )
+    print(f"Metrics report saved to {metrics_file}")
@@ -0,0 +1,313 @@
+import os
+import pathlib
+import sys
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from tqdm import tqdm
+
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+sys.path.append(str(pathlib.Path(__file__).parent))
+from get_json_files import get_json, load_screen_ids
+from utils import instrumentation
+from utils.args import get_plate_details_parser
+from utils.transport import ThreadSessions
+
+BULK_NS = "openmicroscopy.org/omero/bulk_annotations"
+CELL_LINE_NS = "openmicroscopy.org/mapr/cell_line"
+GENE_NS = "openmicroscopy.org/mapr/gene"
+PHENOTYPE_NS = "openmicroscopy.org/mapr/phenotype"
+
+PLATE_DETAILS_SCHEMA = pa.schema(
+    [
+        ("screen_id", pa.int64()),
+        ("plate_id", pa.int64()),
+        ("plate_name", pa.string()),
+        ("image_id", pa.string()),
+        ("cell_line", pa.string()),
+        ("strain", pa.string()),
+        ("gene_identifier", pa.string()),
+        ("phenotype_identifier", pa.string()),
+        ("stain", pa.list_(pa.string())),
+        ("stain_target", pa.list_(pa.string())),
+        ("pixel_size_x", pa.int64()),
+        ("pixel_size_y", pa.int64()),
+        ("imaging_method", pa.string()),
+    ]
+)
+
+
+def annotations_by_namespace(annotations):
+    """Maps each annotation namespace to its key-value pairs
+
+    Built once per response, so that every attribute is a dictionary lookup instead
+    of a scan over the annotation list. The first annotation of a namespace wins.
+
+    Parameters
+    ----------
+    annotations: list
+        "annotations" of an IDR map annotation response
+
+    Returns
+    -------
+    dict
+        {namespace: {key: value}}
+    """
+    namespaces = dict()
+    for annotation in annotations:
+        if annotation["ns"] not in namespaces:
+            namespaces[annotation["ns"]] = {
+                value[0]: value[1] for value in annotation["values"]
+            }
+
+    return namespaces
+
+
+def split_stains(channels):
+    """Unique stains and stain targets of a raw 'stain:target;stain:target' value"""
+    stain = set()
+    stain_target = set()
+    for entry in channels.split(";"):
+        stain_name, _, target = entry.partition(":")
+        stain.add(stain_name)
+        stain_target.add(target)
+
+    return sorted(stain), sorted(stain_target)
+
+
+def describe_image(session, image_id):
+    """Pulls the annotations of an image that are kept in the plate details
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    image_id: int
+        IDR image ID
+
+    Returns
+    -------
+    dict
+        cell_line, strain, gene_identifier, phenotype_identifier, stain and
+        stain_target of the image
+    """
+    MAP_URL = f"https://idr.openmicroscopy.org/webclient/api/annotations/?type=map&image={image_id}"
+    response = get_json(session=session, url=MAP_URL)
+
+    with instrumentation.stage("parse"):
+        namespaces = annotations_by_namespace(response["annotations"])
+        bulk = namespaces.get(BULK_NS, dict())
+
+        if "Channels" in bulk:
+            stain, stain_target = split_stains(bulk["Channels"])
+        else:
+            stain, stain_target = ["Not listed"], ["Not listed"]
+
+        image_details = {
+            "cell_line": namespaces.get(CELL_LINE_NS, dict()).get(
+                "Cell Line", "Not listed"
+            ),
+            "strain": bulk.get("Strain", "Not listed"),
+            "gene_identifier": namespaces.get(GENE_NS, dict()).get(
+                "Gene Identifier", "Not Listed"
+            ),
+            "phenotype_identifier": namespaces.get(PHENOTYPE_NS, dict()).get(
+                "Phenotype Term Accession", "Not Listed"
+            ),
+            "stain": stain,
+            "stain_target": stain_target,
+        }
+    instrumentation.count("images")
+
+    return image_details
+
+
+def plate_images(session, plate_id):
+    """Image IDs and pixel size of a plate from its well grid
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    plate_id: int
+        IDR plate ID
+
+    Returns
+    -------
+    image_ids: list
+        IDR image IDs of all wells in the plate, or None if the grid is unavailable
+    pixel_size: tuple
+        Width and height of the plate images, or (None, None)
+    """
+    WELLS_IMAGES_URL = f"https://idr.openmicroscopy.org/webgateway/plate/{plate_id}/"
+    grid = get_json(session=session, url=WELLS_IMAGES_URL)
+
+    try:
+        pixel_size = (grid["image_sizes"][0]["x"], grid["image_sizes"][0]["y"])
+        image_ids = [
+            image["id"] for row in grid["grid"] for image in row if image is not None
+        ]
+    except (IndexError, KeyError, TypeError):
+        return None, (None, None)
+
+    return image_ids, pixel_size
+
+
+def describe_screen(sessions, screen_id, imaging_method, pool):
+    """Pulls plate and image details of a screen
+
+    Plate grids and image annotations are requested concurrently through pool.
+
+    Parameters
+    ----------
+    sessions: utils.transport.ThreadSessions
+        Sessions providing access to IDR API, one per requesting thread
+    screen_id: int
+        ID of the screen data set
+    imaging_method: str
+        Imaging method of the screen from screen_details.parquet
+    pool: multiprocessing.pool.ThreadPool
+        Worker threads issuing the requests
+
+    Returns
+    -------
+    pyarrow.Table
+        One row per image with the columns of PLATE_DETAILS_SCHEMA
+    """
+    PLATES_URL = f"https://idr.openmicroscopy.org/webclient/api/plates/?id={screen_id}"
+    all_plates = get_json(session=sessions.get(), url=PLATES_URL)["plates"]
+    study_plates = {x["id"]: x["name"] for x in all_plates}
+
+    plate_grids = pool.map(
+        lambda plate_id: plate_images(session=sessions.get(), plate_id=plate_id),
+        study_plates,
+    )
+
+    # Flatten images of all plates so that requests are not bound by plate size
+    image_rows = list()
+    plate_results = list()
+    for plate_id, (image_ids, pixel_size) in zip(study_plates, plate_grids):
+        plate_row = {
+            "screen_id": screen_id,
+            "plate_id": plate_id,
+            "plate_name": study_plates[plate_id],
+            "pixel_size_x": pixel_size[0],
+            "pixel_size_y": pixel_size[1],
+            "imaging_method": imaging_method,
+        }
+        if image_ids is None:
+            plate_results.append(plate_row)
+            continue
+        image_rows.extend(
+            {**plate_row, "image_id": str(image_id)} for image_id in image_ids
+        )
+
+    image_details = pool.imap(
+        lambda row: describe_image(session=sessions.get(), image_id=row["image_id"]),
+        image_rows,
+        chunksize=8,
+    )
+    for row, details in zip(image_rows, image_details):
+        plate_results.append({**row, **details})
+
+    instrumentation.count("plates", len(study_plates))
+    instrumentation.count("screens")
+
+    return pa.Table.from_pylist(plate_results, schema=PLATE_DETAILS_SCHEMA)
+
+
+def write_plate_details(tables, output_file):
+    """Writes per-screen plate details to a single .parquet file as they arrive
+
+    Each screen becomes one row group. The file is written under a temporary name and
+    moved into place once all screens are written.
+
+    Parameters
+    ----------
+    tables: iterable
+        pyarrow.Table per screen with the columns of PLATE_DETAILS_SCHEMA
+    output_file: str or pathlib.Path
+        Output .parquet file
+
+    Returns
+    -------
+    n_rows: int
+        Number of written rows
+    """
+    output_file = pathlib.Path(output_file)
+    partial_file = pathlib.Path(output_file.parent, f".{output_file.name}.partial")
+
+    n_rows = 0
+    with pq.ParquetWriter(
+        partial_file, PLATE_DETAILS_SCHEMA, compression="zstd"
+    ) as writer:
+        for table in tables:
+            with instrumentation.stage("write"):
+                writer.write_table(table)
+            n_rows += table.num_rows
+    os.replace(partial_file, output_file)
+
+    return n_rows
+
+
+if __name__ == "__main__":
+    # Define arguments
+    args = get_plate_details_parser().parse_args(sys.argv[1:])
+
+    if args.profile_dir is not None:
+        instrumentation.enable_profiling(args.profile_dir)
+
+    # Worker threads request through their own sessions
+    sessions = ThreadSessions(args)
+
+    # Create http session
+    INDEX_PAGE = "https://idr.openmicroscopy.org/webclient/?experimenter=-1"
+    session = sessions.get()
+    request = requests.Request("GET", INDEX_PAGE)
+    prepped = session.prepare_request(request)
+    response = session.send(prepped)
+    if response.status_code != 200:
+        response.raise_for_status()
+
+    # Load idr screen ids and the imaging method of each screen
+    screen_ids = load_screen_ids(ids_file=args.ids_file)
+    screen_details_df = pd.read_parquet(
+        args.screen_details_file, columns=["screen_id", "Imaging Method"]
+    )
+    imaging_methods = dict(
+        zip(screen_details_df["screen_id"], screen_details_df["Imaging Method"])
+    )
+
+    output_file = pathlib.Path(args.output_file)
+    pathlib.Path.mkdir(output_file.parent, exist_ok=True, parents=True)
+
+    # Screens are described concurrently while their requests share the request pool
+    print(f"Describing {len(screen_ids)} screens with {args.threads} request threads.")
+    with sessions, ThreadPool(processes=args.threads) as request_pool, ThreadPool(
+        processes=args.screen_threads
+    ) as screen_pool:
+        screen_tables = screen_pool.imap_unordered(
+            lambda screen_id: describe_screen(
+                sessions=sessions,
+                screen_id=screen_id,
+                imaging_method=imaging_methods.get(screen_id),
+                pool=request_pool,
+            ),
+            screen_ids,
+        )
+        with instrumentation.stage("describe"):
+            n_rows = write_plate_details(
+                tables=tqdm(screen_tables, total=len(screen_ids)),
+                output_file=output_file,
+            )
+
+    metrics_file = instrumentation.write_report(
+        metrics_dir=args.metrics_dir, run_name="get_plate_details"
+    )
+    print(f"Plate details of {n_rows} images saved to {output_file}")
+    print(f"Metrics report saved to {metrics_file}")
@@ -0,0 +1,202 @@
+import multiprocessing
+import os
+import pathlib
+import sys
+
+import pandas as pd
+
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+sys.path.append(str(pathlib.Path(__file__).parent))
+from extraction_utils.annotation_csv import annotation_csv_url, grid_well_ids
+from get_json_files import get_json
+from process_json_metadata import (
+    IMAGE_ATTRIBUTES,
+    collect_metadata,
+    pull_csv_well_metadata,
+    write_channel_table,
+)
+from utils import instrumentation
+from utils.args import ingest_annotation_csv_parser
+from utils.transport import session_from_args
+
+
+def fetch_annotation_csv(session, annotation_file, annotation_dir):
+    """Local copy of a screen's annotation CSV, downloaded if it is not present
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API and GitHub
+    annotation_file: str
+        'Annotation File' value of screen_details.parquet
+    annotation_dir: pathlib.Path
+        Directory holding annotation CSVs under their IDR file names
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the annotation CSV, or None if it is neither present nor listed
+        with a URL
+    """
+    file_name, url = annotation_csv_url(annotation_file)
+    csv_file = pathlib.Path(annotation_dir, file_name)
+    if csv_file.exists():
+        return csv_file
+    if url is None:
+        return None
+
+    partial_file = pathlib.Path(annotation_dir, f".{file_name}.partial")
+    with instrumentation.stage("download"):
+        response = session.get(url, stream=True)
+        response.raise_for_status()
+        with open(partial_file, "wb") as file:
+            for chunk in response.iter_content(chunk_size=2**20):
+                file.write(chunk)
+                instrumentation.count("bytes_downloaded", len(chunk))
+    instrumentation.count("requests")
+    os.replace(partial_file, csv_file)
+
+    return csv_file
+
+
+def screen_well_ids(session, screen_id):
+    """IDR plate and well IDs of a screen by plate name and well position
+
+    Costs one request for the plate listing and one per plate grid.
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Session providing access to IDR API
+    screen_id: int
+        ID of the screen data set
+
+    Returns
+    -------
+    dict
+        {(plate_name, row_label, column): (plate_id, well_id)} in the order of the
+        plate listing and row by row within each plate grid
+    """
+    PLATES_IN_SCREEN_URL = (
+        f"https://idr.openmicroscopy.org/webclient/api/plates/?id={screen_id}"
+    )
+    all_plates = get_json(session=session, url=PLATES_IN_SCREEN_URL)["plates"]
+
+    well_ids = dict()
+    for plate in all_plates:
+        WELLS_IN_PLATES_URL = (
+            f"https://idr.openmicroscopy.org/webgateway/plate/{plate['id']}"
+        )
+        grid = get_json(session=session, url=WELLS_IN_PLATES_URL)
+        for position, well_id in grid_well_ids(grid).items():
+            well_ids[(plate["name"], *position)] = (plate["id"], well_id)
+
+    return well_ids
+
+
+def ingest_screen(args, screen_id, idr_name, imaging_method, sample, annotation_file):
+    """Extracts the metadata of a screen from its annotation CSV in a pool worker
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Arguments parsed by utils.args.ingest_annotation_csv_parser()
+    screen_id, idr_name, imaging_method, sample:
+        Arguments of process_json_metadata.collect_metadata()
+    annotation_file: str
+        'Annotation File' value of screen_details.parquet
+
+    Returns
+    -------
+    dict
+        instrumentation.snapshot() of the ingest
+    channel_rows: list
+        Channel table of the screen, empty if no annotation CSV is available
+    """
+    instrumentation.reset()
+    if args.profile_dir is not None:
+        instrumentation.enable_profiling(args.profile_dir)
+
+    with session_from_args(args) as session:
+        csv_file = fetch_annotation_csv(
+            session=session,
+            annotation_file=annotation_file,
+            annotation_dir=args.annotation_dir,
+        )
+        if csv_file is None:
+            print(f"No annotation CSV listed for screen {screen_id}, skipping.")
+            return instrumentation.snapshot(), list()
+        well_ids = screen_well_ids(session=session, screen_id=screen_id)
+
+    channel_rows = collect_metadata(
+        screen_id=screen_id,
+        idr_name=idr_name,
+        imaging_method=imaging_method,
+        sample=sample,
+        compression=args.compression,
+        row_group_size=args.row_group_size,
+        wells_metadata=pull_csv_well_metadata(
+            csv_file=csv_file,
+            well_ids=well_ids,
+            image_attributes=IMAGE_ATTRIBUTES,
+            chunksize=args.chunksize,
+        ),
+    )
+    instrumentation.dump_profiles(prefix=f"ingest_annotation_csv_{screen_id}")
+
+    return instrumentation.snapshot(), channel_rows
+
+
+if __name__ == "__main__":
+    # Define arguments
+    args = ingest_annotation_csv_parser().parse_args(sys.argv[1:])
+    if args.profile_dir is not None:
+        instrumentation.enable_profiling(args.profile_dir)
+
+    # Load screen details
+    data_dir = pathlib.Path("IDR/data")
+    screen_details_file = pathlib.Path(data_dir, "screen_details.parquet")
+    screen_details_df = pd.read_parquet(screen_details_file)[
+        ["screen_id", "idr_name", "Imaging Method", "Sample Type", "Annotation File"]
+    ].dropna(subset=["Annotation File"])
+
+    annotation_dir = pathlib.Path(args.annotation_dir)
+    pathlib.Path.mkdir(annotation_dir, exist_ok=True, parents=True)
+
+    study_metadata = [
+        (args, *metadata)
+        for metadata in screen_details_df.itertuples(index=False, name=None)
+    ]
+
+    # Construct multiprocessing Pool object
+    available_cores = len(os.sched_getaffinity(0))
+    pool = multiprocessing.Pool(processes=available_cores)
+
+    # Begin metadata collection
+    print(f"Ingesting annotation CSVs of {len(study_metadata)} screens.")
+    with instrumentation.stage("extract"):
+        worker_metrics = pool.starmap(func=ingest_screen, iterable=study_metadata)
+
+    # Close multiprocess pool
+    pool.close()
+    pool.join()
+
+    channel_rows = list()
+    for worker_snapshot, screen_channel_rows in worker_metrics:
+        instrumentation.merge(worker_snapshot)
+        channel_rows.extend(screen_channel_rows)
+
+    # Save the channel table gathered during extraction
+    write_channel_table(
+        channel_rows=channel_rows,
+        channel_table_file=pathlib.Path(data_dir, "channel_count_per_screen.tsv"),
+    )
+    metrics_file = instrumentation.write_report(
+        metrics_dir=args.metrics_dir, run_name="ingest_annotation_csv"
+    )
+
+    extract_seconds = instrumentation.snapshot()["stages"]["extract"]["seconds"]
+    print(f"\nMetadata collected. Running cost is {extract_seconds/60:.1f} min.")
+    print(f"Metrics report saved to {metrics_file}")
@@ -1,30 +1,92 @@
+import functools
+import gzip
 import json
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import pathlib
 import sys
-import time
 
 import pandas as pd
 
 # Define path to extraction_utils dir
 parent_dir = str(pathlib.Path(__file__).parents[1])
 sys.path.append(parent_dir)
-from extraction_utils.clean_channels import clean_channel
-from extraction_utils.io import walk
-from extraction_utils.list_modifications import iterate_through_values
-
-
-def pull_json_well_metadata(
-    well_metadata_file,
-    image_attributes,
-):
-    """Pull metadata from downloaded json metadata files
+from extraction_utils.annotation_csv import (
+    annotation_sources,
+    annotation_values_frame,
+    well_position,
+)
+from extraction_utils.archives import (
+    WELL_JSON_EXTENSIONS,
+    iter_archive,
+    screen_archive,
+    screen_entry_id,
+    well_entry_id,
+)
+from extraction_utils.blocks import iter_wells, read_blocks, screen_block_store
+from extraction_utils.clean_channels import (
+    cached_clean_channel_pairs,
+    channel_table,
+    count_channel_plates,
+)
+from extraction_utils.io import group_files, stream_to_pool
+from extraction_utils.list_modifications import (
+    iterate_through_values,
+    nested_list_to_dict,
+)
+from extraction_utils.schema import (
+    DEFAULT_COMPRESSION,
+    DEFAULT_ROW_GROUP_SIZE,
+    write_metadata,
+)
+from utils import instrumentation
+from utils.args import process_json_metadata_parser
+
+# Image attributes extracted per well
+IMAGE_ATTRIBUTES = [
+    "Channels",
+    "Organism",
+    "Cell Line",
+    "Organism Part",
+    "Strain",
+    "Gene Identifier",
+    "Gene Symbol",
+    "Phenotype",
+    "Phenotype Term Name",
+    "Compound Name",
+    "siRNA Identifier",
+    "plate_id",
+    "well_id",
+]
+
+# Threads per screen worker reading the loose json files of the next plate while
+# the current one is parsed
+PLATE_THREADS = 2
+
+CHANNEL_TABLE_COLUMNS = [
+    "screen_id",
+    "idr_name",
+    "channel",
+    "stain",
+    "mark",
+    "plate_count",
+]
+
+
+def parse_well_metadata(json_dict, plate_id, well_id, image_attributes):
+    """Pull metadata from a decoded well json document
 
     Parameters
     ----------
-    well_metadata_file: pathlib.Path
-        Path to json well metadata file
+    json_dict: dict
+        Decoded well annotation json document
+
+    plate_id: str
+        IDR plate ID of the well
+
+    well_id: str
+        IDR well ID
 
     image_attributes: list
         Image attribute categories
@@ -41,27 +103,55 @@ def pull_json_well_metadata(
     -------
     metadata: dict
         Metadata values for attribute in image_attributes per well
+        Channels are given as a list of {"stain": str, "target": str} pairs
     """
-    # Get plate and well IDs from file path
-    plate_id = str(well_metadata_file).split("/")[-2]
-    well_id = str(well_metadata_file).split("/")[-1].removesuffix(".json")
+    with instrumentation.stage("parse"):
+        annotations = json_dict["annotations"]
+        annotation_values = iterate_through_values(annotations=annotations)
+
+    return parse_annotation_values(
+        annotation_values=annotation_values,
+        plate_id=plate_id,
+        well_id=well_id,
+        image_attributes=image_attributes,
+    )
 
-    # Load json file as dictionary
-    with well_metadata_file.open() as data_file:
-        json_dict = json.load(data_file)
 
+def parse_annotation_values(annotation_values, plate_id, well_id, image_attributes):
+    """Pull metadata from the map annotation values of a well
+
+    Parameters
+    ----------
+    annotation_values: dict
+        Map annotation keys and values of a well, see
+        extraction_utils.list_modifications.iterate_through_values()
+
+    plate_id: str
+        IDR plate ID of the well
+
+    well_id: str
+        IDR well ID
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    Returns
+    -------
+    metadata: dict
+        Metadata values for attribute in image_attributes per well
+        Channels are given as a list of {"stain": str, "target": str} pairs
+    """
     well_results_dict = dict()
-    annotations = json_dict["annotations"]
-    annotation_values = iterate_through_values(annotations=annotations)
     # Iterate through image attributes
     for image_attribute in image_attributes:
         # Ensure that user-selected image attributes are in annotation values
         if image_attribute in annotation_values:
             # Clean channels
             if image_attribute == "Channels":
-                well_results_dict[image_attribute] = clean_channel(
-                    annotation_values[image_attribute]
-                )
+                with instrumentation.stage("clean"):
+                    well_results_dict[image_attribute] = cached_clean_channel_pairs(
+                        annotation_values[image_attribute]
+                    )
 
             elif image_attribute == "Phenotype":
                 well_results_dict[image_attribute] = annotation_values[image_attribute]
@@ -81,7 +171,309 @@ def pull_json_well_metadata(
     return well_results_dict
 
 
-def collect_metadata(screen_id, idr_name, imaging_method, sample):
+def load_well_json(data, entry_name):
+    """Decodes a stored well json document
+
+    Documents are stored as received from the IDR API, so they are first validated
+    here.
+
+    Parameters
+    ----------
+    data: bytes
+        Content of a .json or gzip-compressed .json.gz file
+    entry_name: str
+        File or bundle member name, used to detect compression and in errors
+
+    Returns
+    -------
+    dict
+        Decoded well annotation json document
+    """
+    if entry_name.endswith(".gz"):
+        data = gzip.decompress(data)
+
+    try:
+        return json.loads(data)
+    except ValueError as error:
+        raise ValueError(f"Invalid well json document {entry_name}") from error
+
+
+def pull_json_well_metadata(
+    well_metadata_file,
+    image_attributes,
+):
+    """Pull metadata from downloaded json metadata files
+
+    Parameters
+    ----------
+    well_metadata_file: pathlib.Path
+        Path to .json or .json.gz well metadata file
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    Returns
+    -------
+    metadata: dict
+        Metadata values for attribute in image_attributes per well
+    """
+    # Get plate and well IDs from file path
+    plate_id = str(well_metadata_file).split("/")[-2]
+    well_id = well_entry_id(str(well_metadata_file))
+
+    # Load json file as dictionary
+    with instrumentation.stage("parse"):
+        json_dict = load_well_json(
+            well_metadata_file.read_bytes(), entry_name=well_metadata_file.name
+        )
+    instrumentation.count("files_read")
+
+    return parse_well_metadata(
+        json_dict=json_dict,
+        plate_id=plate_id,
+        well_id=well_id,
+        image_attributes=image_attributes,
+    )
+
+
+def pull_plate_well_metadata(plate_group, image_attributes):
+    """Pull metadata from the well json files of one plate directory
+
+    Parameters
+    ----------
+    plate_group: tuple
+        (directory names, well json files) as yielded by
+        extraction_utils.io.group_files()
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    Returns
+    -------
+    metadata: list
+        Metadata dicts per well of the plate
+    """
+    _, well_metadata_files = plate_group
+
+    return [
+        pull_json_well_metadata(
+            well_metadata_file=well_metadata_file, image_attributes=image_attributes
+        )
+        for well_metadata_file in well_metadata_files
+    ]
+
+
+def pull_loose_well_metadata(screen_dir, image_attributes, threads=PLATE_THREADS):
+    """Stream metadata from the loose well json files of a screen directory
+
+    Plate directories are listed with extraction_utils.io.group_files() and handed
+    to a thread pool as they are found, so listing and reading the files of the
+    next plates overlaps with parsing the current one. Wells keep the order of
+    the directory listing.
+
+    Parameters
+    ----------
+    screen_dir: pathlib.Path
+        {screen_id}/ directory holding {plate_id}/{well_id}.json files
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    threads: int
+        Number of plates read concurrently
+
+    Yields
+    ------
+    metadata: dict
+        Metadata values for attribute in image_attributes per well
+    """
+    pull_plate = functools.partial(
+        pull_plate_well_metadata, image_attributes=image_attributes
+    )
+    plate_groups = group_files(screen_dir, extensions=WELL_JSON_EXTENSIONS, depth=1)
+    with ThreadPool(processes=threads) as pool:
+        for plate_wells in stream_to_pool(pool, pull_plate, plate_groups):
+            yield from plate_wells
+
+
+def pull_archive_well_metadata(archive_file, image_attributes):
+    """Pull metadata from the well json members of a per-screen bundle
+
+    Members are streamed sequentially without unpacking the bundle to disk.
+
+    Parameters
+    ----------
+    archive_file: pathlib.Path
+        .tar, .tar.zst or .zip bundle with {plate_id}/{well_id}.json or .json.gz
+        members
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    Yields
+    ------
+    metadata: dict
+        Metadata values for attribute in image_attributes per well
+    """
+    for member_name, data in iter_archive(archive_file):
+        well_id = well_entry_id(member_name)
+        if well_id is None:
+            continue
+        plate_id = member_name.split("/")[-2]
+
+        with instrumentation.stage("parse"):
+            json_dict = load_well_json(data, entry_name=member_name)
+
+        yield parse_well_metadata(
+            json_dict=json_dict,
+            plate_id=plate_id,
+            well_id=well_id,
+            image_attributes=image_attributes,
+        )
+
+
+def pull_block_store_well_metadata(store_dir, image_attributes):
+    """Pull metadata from the block store of a screen
+
+    Every distinct annotation block is converted into annotation values once, and
+    reduced to the keys in image_attributes, so that wells whose blocks hold the same
+    attribute values share their parsed metadata.
+
+    Parameters
+    ----------
+    store_dir: pathlib.Path
+        {screen_id}.blocks directory, see extraction_utils.blocks.BlockStoreWriter
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    Yields
+    ------
+    metadata: dict
+        Metadata values for attribute in image_attributes per well
+    """
+    attribute_keys = set(image_attributes)
+    with instrumentation.stage("parse"):
+        # Index of the distinct attribute values of each block, None for blocks
+        # without image attributes
+        block_indices = dict()
+        distinct_values = dict()
+        for id_, (_, values) in read_blocks(store_dir).items():
+            attribute_values = {
+                key: value
+                for key, value in nested_list_to_dict(values).items()
+                if key in attribute_keys
+            }
+            if attribute_values:
+                block_indices[id_] = distinct_values.setdefault(
+                    tuple(attribute_values.items()), len(distinct_values)
+                )
+            else:
+                block_indices[id_] = None
+        values_list = [dict(items) for items in distinct_values]
+    instrumentation.count("blocks", len(block_indices))
+
+    well_metadata = dict()
+    # Well values hold the PER_WELL_KEYS, which are not image attributes
+    for plate_id, well_id, well_block_ids, _ in iter_wells(store_dir):
+        key = tuple(
+            block_indices[id_]
+            for id_ in well_block_ids
+            if block_indices[id_] is not None
+        )
+        if key not in well_metadata:
+            # Later blocks take precedence as in iterate_through_values()
+            annotation_values = dict()
+            for index in key:
+                annotation_values.update(values_list[index])
+            well_metadata[key] = parse_annotation_values(
+                annotation_values=annotation_values,
+                plate_id=plate_id,
+                well_id=well_id,
+                image_attributes=image_attributes,
+            )
+            instrumentation.count("wells_parsed")
+
+        yield {**well_metadata[key], "plate_id": plate_id, "well_id": well_id}
+
+
+def pull_csv_well_metadata(csv_file, well_ids, image_attributes, chunksize=100_000):
+    """Pull metadata from a screen's IDR annotation CSV
+
+    The CSV holds one row per well with the values that the well json documents
+    publish as bulk and mapr annotations. It is read in chunks of rows.
+
+    Wells are yielded in the order of well_ids, i.e. plate by plate in the order of
+    the plate listing and row by row within a plate grid, the order in which the well
+    json files are downloaded. Like their json documents, wells without a CSV row
+    have every attribute 'Not listed'.
+
+    Parameters
+    ----------
+    csv_file: pathlib.Path
+        Annotation CSV of the screen, optionally compressed (e.g. .csv.gz)
+
+    well_ids: dict
+        {(plate_name, row_label, column): (plate_id, well_id)} for the wells of the
+        screen. Rows of wells that are not listed are skipped
+
+    image_attributes: list
+        Image attribute categories, see parse_well_metadata()
+
+    chunksize: int
+        Rows read at a time
+
+    Yields
+    ------
+    metadata: dict
+        Metadata values for attribute in image_attributes per well
+    """
+    # Annotation values of each resolved well, later rows of a well win
+    well_values = dict()
+    chunks = pd.read_csv(
+        csv_file, dtype=str, keep_default_na=False, chunksize=chunksize
+    )
+    for chunk in chunks:
+        with instrumentation.stage("parse"):
+            sources = annotation_sources(chunk.columns, keys=image_attributes)
+            values_df = annotation_values_frame(chunk, sources=sources)
+            positions = [well_position(well) for well in chunk["Well"]]
+
+        for plate_name, position, values in zip(
+            chunk["Plate"], positions, values_df.to_dict("records")
+        ):
+            ids = None if position is None else well_ids.get((plate_name, *position))
+            if ids is None:
+                instrumentation.count("unresolved_wells")
+                continue
+
+            well_values[ids] = {
+                key: value for key, value in values.items() if pd.notna(value)
+            }
+
+    for plate_id, well_id in well_ids.values():
+        annotation_values = well_values.get((plate_id, well_id))
+        if annotation_values is None:
+            instrumentation.count("unlisted_wells")
+            annotation_values = dict()
+
+        yield parse_annotation_values(
+            annotation_values=annotation_values,
+            plate_id=plate_id,
+            well_id=well_id,
+            image_attributes=image_attributes,
+        )
+
+
+def collect_metadata(
+    screen_id,
+    idr_name,
+    imaging_method,
+    sample,
+    compression=DEFAULT_COMPRESSION,
+    row_group_size=DEFAULT_ROW_GROUP_SIZE,
+    wells_metadata=None,
+):
     """Extract metadata per well from downloaded IDR json annotation files.
 
     Parameters
@@ -98,14 +490,28 @@ def collect_metadata(screen_id, idr_name, imaging_method, sample):
     sample: str
     Denotes cell or tissue.
 
+    compression: str
+    Parquet compression codec of the output file
+
+    row_group_size: int
+    Maximum number of wells per Parquet row group
+
+    wells_metadata: iterable
+    Metadata dicts per well with IMAGE_ATTRIBUTES as keys, e.g. from
+    pull_csv_well_metadata(). Read from the
+    downloaded json files by default
+
     Returns
     -------
-    Saves extracted metadata as .parquet file
+    Saves extracted metadata as .parquet file with the schema declared in
+    extraction_utils.schema
+
+    channel_rows: list
+    Channel table of the screen, see extraction_utils.clean_channels.channel_table()
     """
     # Make metadata directory
     metadata_dir = pathlib.Path("IDR/data/metadata")
-    if metadata_dir.exists() == False:
-        pathlib.mkdir(metadata_dir)
+    pathlib.Path.mkdir(metadata_dir, exist_ok=True, parents=True)
 
     # Get study and screen names
     split_idr_name = idr_name.split("/")
@@ -118,35 +524,43 @@ def collect_metadata(screen_id, idr_name, imaging_method, sample):
     pathlib.Path.mkdir(study_dir, exist_ok=True)
     pathlib.Path.mkdir(screen_dir, exist_ok=True)
 
-    # Create iterable list of json metadata files per screen
-    json_metadata_screen_dir = pathlib.Path(f"IDR/data/json_metadata/{screen_id}")
-    json_metadata_files = list(walk(json_metadata_screen_dir))
-
-    image_attributes = [
-        "Channels",
-        "Organism",
-        "Cell Line",
-        "Organism Part",
-        "Strain",
-        "Gene Identifier",
-        "Gene Symbol",
-        "Phenotype",
-        "Phenotype Term Name",
-        "Compound Name",
-        "siRNA Identifier",
-        "plate_id",
-        "well_id",
-    ]
+    image_attributes = IMAGE_ATTRIBUTES
 
     # Collect data
     screen_results_dict = {
         image_attribute: list() for image_attribute in image_attributes
     }
-    # Iterate through all well json metadata files
-    for well_json_metadata in json_metadata_files:
-        well_results_dict = pull_json_well_metadata(
-            well_metadata_file=well_json_metadata, image_attributes=image_attributes
+    # Stream well json documents from a block store, a screen bundle or loose files,
+    # unless the wells are supplied by another source
+    json_metadata_dir = pathlib.Path("IDR/data/json_metadata")
+    store_dir = screen_block_store(json_metadata_dir, screen_id)
+    archive_file = screen_archive(json_metadata_dir, screen_id)
+    if wells_metadata is None and store_dir is not None:
+        wells_metadata = pull_block_store_well_metadata(
+            store_dir=store_dir, image_attributes=image_attributes
         )
+    elif wells_metadata is None and archive_file is not None:
+        wells_metadata = pull_archive_well_metadata(
+            archive_file=archive_file, image_attributes=image_attributes
+        )
+        instrumentation.count("archives_read")
+    elif wells_metadata is None:
+        wells_metadata = pull_loose_well_metadata(
+            screen_dir=pathlib.Path(json_metadata_dir, str(screen_id)),
+            image_attributes=image_attributes,
+        )
+
+    # Plates per channel, aggregated while the wells are parsed
+    channel_plates = dict()
+
+    # Iterate through all well json metadata documents
+    for well_results_dict in wells_metadata:
+        if isinstance(well_results_dict["Channels"], list):
+            count_channel_plates(
+                channel_plates,
+                stains_targets=well_results_dict["Channels"],
+                plate_id=well_results_dict["plate_id"],
+            )
         # Add metadata values per well to final results dictionary
         for image_attribute in well_results_dict.keys():
             screen_results_dict[image_attribute].append(
@@ -174,10 +588,87 @@ def collect_metadata(screen_id, idr_name, imaging_method, sample):
     output_file = pathlib.Path(
         screen_dir, f"{study_name}_{screen_name}_{screen_id}.parquet"
     )
-    screen_results_df.to_parquet(output_file)
+    with instrumentation.stage("write"):
+        write_metadata(
+            screen_results_df,
+            output_file,
+            compression=compression,
+            row_group_size=row_group_size,
+        )
+    instrumentation.count("wells", len(screen_results_df.index))
+    instrumentation.count("files_written")
+
+    return channel_table(channel_plates, screen_id=screen_id, idr_name=idr_name)
+
+
+def collect_metadata_instrumented(
+    screen_id,
+    idr_name,
+    imaging_method,
+    sample,
+    compression=DEFAULT_COMPRESSION,
+    row_group_size=DEFAULT_ROW_GROUP_SIZE,
+    profile_dir=None,
+):
+    """Runs collect_metadata() in a pool worker and returns the worker's metrics
+
+    Parameters
+    ----------
+    screen_id, idr_name, imaging_method, sample, compression, row_group_size:
+        Arguments of collect_metadata()
+    profile_dir: str or pathlib.Path
+        Directory for per-stage cProfile dumps of this screen, or None
+
+    Returns
+    -------
+    dict
+        instrumentation.snapshot() of the collection
+    channel_rows: list
+        Channel table of the screen returned by collect_metadata()
+    """
+    instrumentation.reset()
+    if profile_dir is not None:
+        instrumentation.enable_profiling(profile_dir)
+
+    channel_rows = collect_metadata(
+        screen_id=screen_id,
+        idr_name=idr_name,
+        imaging_method=imaging_method,
+        sample=sample,
+        compression=compression,
+        row_group_size=row_group_size,
+    )
+    instrumentation.dump_profiles(prefix=f"process_json_metadata_{screen_id}")
+
+    return instrumentation.snapshot(), channel_rows
+
+
+def write_channel_table(channel_rows, channel_table_file):
+    """Writes the channel table, keeping rows of screens that were not extracted
+
+    Parameters
+    ----------
+    channel_rows: list
+        Channel tables of the extracted screens
+    channel_table_file: pathlib.Path
+        Tab separated channel table
+    """
+    channel_df = pd.DataFrame(data=channel_rows, columns=CHANNEL_TABLE_COLUMNS)
+    if channel_table_file.exists():
+        previous_df = pd.read_csv(channel_table_file, sep="\t")
+        previous_df = previous_df[~previous_df.screen_id.isin(channel_df.screen_id)]
+        channel_df = pd.concat([previous_df, channel_df], ignore_index=True)
+
+    channel_df.sort_values(["screen_id", "channel"]).to_csv(
+        channel_table_file, sep="\t", index=False
+    )
 
 
 if __name__ == "__main__":
+    # Define arguments
+    args = process_json_metadata_parser().parse_args(sys.argv[1:])
+    if args.profile_dir is not None:
+        instrumentation.enable_profiling(args.profile_dir)
 
     # Load screen details
     data_dir = pathlib.Path("IDR/data")
@@ -192,27 +683,62 @@ if __name__ == "__main__":
     json_metadata_dir = pathlib.Path("IDR/data/json_metadata")
     available_screens = list()
     for screen_path in json_metadata_dir.iterdir():
-        split_path = str(screen_path).split("/")
-        available_screens.append(int(split_path[-1]))
+        # Screens are stored as {screen_id}/ directories or {screen_id}.{format} bundles
+        screen_id = screen_entry_id(screen_path.name)
+        if screen_id is not None:
+            available_screens.append(screen_id)
 
     # Get external metadata not found in well.json files
     study_metadata = list(screen_details_df.itertuples(index=False, name=None))
 
     # Remove screens that are not downloaded
     study_metadata = [
-        metadata for metadata in study_metadata if metadata[0] in available_screens
+        (*metadata, args.compression, args.row_group_size, args.profile_dir)
+        for metadata in study_metadata
+        if metadata[0] in available_screens
     ]
 
+    # Restrict to the screens that changed since their last extraction
+    flagged_screens_file = pathlib.Path(args.flagged_screens_file)
+    if args.flagged_only:
+        flagged_screens = list()
+        if flagged_screens_file.exists():
+            flagged_screens = pd.read_csv(flagged_screens_file, sep="\t").id.tolist()
+        study_metadata = [
+            metadata for metadata in study_metadata if metadata[0] in flagged_screens
+        ]
+
     # Construct multiprocessing Pool object
     available_cores = len(os.sched_getaffinity(0))
     pool = multiprocessing.Pool(processes=available_cores)
 
     # Begin metadata collection
-    start = time.time()
     print(f"Extracting metadata from {len(study_metadata)} screens.")
-    pool.starmap(func=collect_metadata, iterable=study_metadata)
+    with instrumentation.stage("extract"):
+        worker_metrics = pool.starmap(
+            func=collect_metadata_instrumented, iterable=study_metadata
+        )
 
     # Close multiprocess pool
     pool.close()
     pool.join()
-    print(f"\nMetadata collected. Running cost is {(time.time()-start)/60:.1f} min.")
+
+    channel_rows = list()
+    for worker_snapshot, screen_channel_rows in worker_metrics:
+        instrumentation.merge(worker_snapshot)
+        channel_rows.extend(screen_channel_rows)
+
+    # Save the channel table gathered during extraction
+    write_channel_table(
+        channel_rows=channel_rows,
+        channel_table_file=pathlib.Path(data_dir, "channel_count_per_screen.tsv"),
+    )
+    if args.flagged_only:
+        flagged_screens_file.unlink(missing_ok=True)
+    metrics_file = instrumentation.write_report(
+        metrics_dir=args.metrics_dir, run_name="process_json_metadata"
+    )
+
+    extract_seconds = instrumentation.snapshot()["stages"]["extract"]["seconds"]
+    print(f"\nMetadata collected. Running cost is {extract_seconds/60:.1f} min.")
+    print(f"Metrics report saved to {metrics_file}")
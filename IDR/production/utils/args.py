@@ -1,6 +1,5 @@
 import argparse
 
-
 help_opt = (
     ("--help", "-h"),
     {"action": "help", "help": "Print this help message and exit"},
@@ -19,5 +18,586 @@ def collect_screen_metadata_parser():
         required=True,
         choices=["downloaded_json"],
     )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_transport_args(parser)
+
+    return parser
+
+
+def add_transport_args(parser):
+    """Adds arguments selecting how the IDR API is accessed
+
+    Parameters
+    ----------
+    parser: argparse.ArgumentParser
+        Parser to extend
+
+    Returns
+    -------
+    parser: argparse.ArgumentParser
+        The input parser with a "Transport Arguments" group
+    """
+    transport_args = parser.add_argument_group("Transport Arguments")
+    transport_args.add_argument(
+        "--transport",
+        dest="transport",
+        help="How to access the IDR API: live network access, recording responses into a fixture archive, replaying a fixture archive or generating a synthetic databank",
+        default="live",
+        choices=["live", "record", "replay", "synthetic"],
+    )
+    transport_args.add_argument(
+        "--fixture-archive",
+        dest="fixture_archive",
+        help="Zip archive of recorded responses (record and replay transports)",
+        default=None,
+    )
+    transport_args.add_argument(
+        "--latency",
+        dest="latency",
+        help="Seconds added to each replay or synthetic request",
+        type=float,
+        default=0.0,
+    )
+    transport_args.add_argument(
+        "--synthetic-screens",
+        dest="synthetic_screens",
+        help="Number of screens in the synthetic databank",
+        type=int,
+        default=3,
+    )
+    transport_args.add_argument(
+        "--synthetic-plates",
+        dest="synthetic_plates",
+        help="Number of plates per screen in the synthetic databank",
+        type=int,
+        default=2,
+    )
+    transport_args.add_argument(
+        "--synthetic-wells",
+        dest="synthetic_wells",
+        help="Number of wells per plate in the synthetic databank",
+        type=int,
+        default=96,
+    )
+    transport_args.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Directory of a persistent cache of IDR API responses. Disabled by default",
+        default=None,
+    )
+    transport_args.add_argument(
+        "--cache-max-mb",
+        dest="cache_max_mb",
+        help="Size bound of the response cache in MiB",
+        type=float,
+        default=2048,
+    )
+    transport_args.add_argument(
+        "--cache-ttl",
+        dest="cache_ttls",
+        help="Seconds to serve cached responses of a URL path prefix without revalidation, e.g. /webgateway/plate/=86400. Can be repeated",
+        action="append",
+        default=None,
+    )
+
+    return parser
+
+
+def transport_argv(args):
+    """Converts parsed transport arguments back to command line arguments
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Arguments parsed by a parser extended with add_transport_args()
+
+    Returns
+    -------
+    argv: list
+        Command line arguments for forwarding to a subprocess
+    """
+    argv = [
+        "--transport",
+        args.transport,
+        "--latency",
+        str(args.latency),
+        "--synthetic-screens",
+        str(args.synthetic_screens),
+        "--synthetic-plates",
+        str(args.synthetic_plates),
+        "--synthetic-wells",
+        str(args.synthetic_wells),
+    ]
+    if args.fixture_archive is not None:
+        argv.extend(["--fixture-archive", str(args.fixture_archive)])
+    if args.cache_dir is not None:
+        argv.extend(
+            [
+                "--cache-dir",
+                str(args.cache_dir),
+                "--cache-max-mb",
+                str(args.cache_max_mb),
+            ]
+        )
+        for cache_ttl in args.cache_ttls or list():
+            argv.extend(["--cache-ttl", cache_ttl])
+
+    return argv
+
+
+def add_instrumentation_args(parser):
+    """Adds arguments controlling the metrics report and stage profiling
+
+    Parameters
+    ----------
+    parser: argparse.ArgumentParser
+        Parser to extend
+
+    Returns
+    -------
+    parser: argparse.ArgumentParser
+        The input parser with an "Instrumentation Arguments" group
+    """
+    instrumentation_args = parser.add_argument_group("Instrumentation Arguments")
+    instrumentation_args.add_argument(
+        "--metrics-dir",
+        dest="metrics_dir",
+        help="Directory to write the .json metrics report of the run to",
+        default="IDR/data/metrics",
+    )
+    instrumentation_args.add_argument(
+        "--profile-dir",
+        dest="profile_dir",
+        help="Write a cProfile .prof file per pipeline stage to this directory",
+        default=None,
+    )
+
+    return parser
+
+
+def get_ids_parser():
+    parser = argparse.ArgumentParser(
+        description="Collecting IDR screen and project IDs", add_help=False
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "-d",
+        dest="data_dir",
+        help="Directory to save ID and screen detail files to",
+        default="IDR/data",
+    )
+    opt_args.add_argument(
+        "--threads",
+        dest="threads",
+        help="Concurrent IDR API requests for listing pages and screen details",
+        type=int,
+        default=8,
+    )
+    opt_args.add_argument(
+        "--page-size",
+        dest="page_size",
+        help="Objects requested per listing page. The IDR API caps pages at its maxLimit",
+        type=int,
+        default=500,
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_transport_args(parser)
+
+    return parser
+
+
+def get_json_files_parser():
+    parser = argparse.ArgumentParser(
+        description="Downloading IDR well annotation JSON files", add_help=False
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "-i",
+        dest="ids_file",
+        help="File of IDR IDs to download (.tsv or .parquet with an 'id' column)",
+        default="IDR/data/idr_ids.tsv",
+    )
+    opt_args.add_argument(
+        "-o",
+        dest="output_dir",
+        help="Directory to save well annotation JSON files to",
+        default="IDR/data/json_metadata",
+    )
+    opt_args.add_argument(
+        "--bundle",
+        dest="bundle",
+        help="Write each screen into a single archive instead of loose JSON files. tar.zst requires the optional zstandard package. blocks stores each distinct annotation block of a screen once, with wells referencing their blocks",
+        default=None,
+        choices=["tar", "tar.zst", "zip", "blocks"],
+    )
+    opt_args.add_argument(
+        "--compress",
+        dest="compress",
+        help="Store well json files gzip-compressed as .json.gz. Bodies the server sends gzip-encoded are stored as received",
+        action="store_true",
+    )
+    opt_args.add_argument(
+        "--delta-sync",
+        dest="delta_sync",
+        help="Compare the plate listings and plate grids of all screens against the inventory and only download new wells and wells whose image changed. Annotations edited on an unchanged image are not detected. Cached plate listings and plate grids are revalidated with the server regardless of --cache-ttl",
+        action="store_true",
+    )
+    opt_args.add_argument(
+        "--inventory",
+        dest="inventory_file",
+        help="JSON inventory of the plates and wells of downloaded screens",
+        default="IDR/data/json_metadata_inventory.json",
+    )
+    opt_args.add_argument(
+        "--flagged-screens",
+        dest="flagged_screens_file",
+        help="File listing the screens whose json files changed and that await metadata extraction",
+        default="IDR/data/flagged_screen_ids.tsv",
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_transport_args(parser)
+    add_instrumentation_args(parser)
+
+    return parser
+
+
+def get_plate_details_parser():
+    parser = argparse.ArgumentParser(
+        description="Collecting plate and image details of IDR screens", add_help=False
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "-i",
+        dest="ids_file",
+        help="File of IDR IDs to describe (.tsv or .parquet with an 'id' column)",
+        default="IDR/data/idr_screen_ids.parquet",
+    )
+    opt_args.add_argument(
+        "-s",
+        dest="screen_details_file",
+        help="Screen details .parquet file providing the imaging method per screen",
+        default="IDR/data/screen_details.parquet",
+    )
+    opt_args.add_argument(
+        "-o",
+        dest="output_file",
+        help="Output .parquet file of plate and image details",
+        default="IDR/data/plate_details_per_screen.parquet",
+    )
+    opt_args.add_argument(
+        "--threads",
+        dest="threads",
+        help="Concurrent IDR API requests",
+        type=int,
+        default=16,
+    )
+    opt_args.add_argument(
+        "--screen-threads",
+        dest="screen_threads",
+        help="Screens described at the same time",
+        type=int,
+        default=4,
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_transport_args(parser)
+    add_instrumentation_args(parser)
+
+    return parser
+
+
+def process_json_metadata_parser():
+    parser = argparse.ArgumentParser(
+        description="Extracting per-screen metadata from downloaded IDR json files",
+        add_help=False,
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "--compression",
+        dest="compression",
+        help="Parquet compression codec of the per-screen metadata files",
+        default="zstd",
+        choices=["zstd", "snappy", "gzip", "brotli", "lz4", "none"],
+    )
+    opt_args.add_argument(
+        "--row-group-size",
+        dest="row_group_size",
+        help="Maximum number of wells per Parquet row group",
+        type=int,
+        default=1_000_000,
+    )
+    opt_args.add_argument(
+        "--flagged-only",
+        dest="flagged_only",
+        help="Only extract the screens flagged by get_json_files.py and clear the flags afterwards",
+        action="store_true",
+    )
+    opt_args.add_argument(
+        "--flagged-screens",
+        dest="flagged_screens_file",
+        help="File listing the screens flagged for metadata extraction",
+        default="IDR/data/flagged_screen_ids.tsv",
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_instrumentation_args(parser)
+
+    return parser
+
+
+def ingest_annotation_csv_parser():
+    parser = argparse.ArgumentParser(
+        description="Extracting per-screen metadata from IDR annotation CSVs",
+        add_help=False,
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "-a",
+        dest="annotation_dir",
+        help="Directory of annotation CSVs. Missing files are downloaded to it",
+        default="IDR/data/annotation_csv",
+    )
+    opt_args.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        help="Annotation CSV rows read at a time",
+        type=int,
+        default=100_000,
+    )
+    opt_args.add_argument(
+        "--compression",
+        dest="compression",
+        help="Parquet compression codec of the per-screen metadata files",
+        default="zstd",
+        choices=["zstd", "snappy", "gzip", "brotli", "lz4", "none"],
+    )
+    opt_args.add_argument(
+        "--row-group-size",
+        dest="row_group_size",
+        help="Maximum number of wells per Parquet row group",
+        type=int,
+        default=1_000_000,
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_transport_args(parser)
+    add_instrumentation_args(parser)
+
+    return parser
+
+
+def compute_statistics_parser():
+    parser = argparse.ArgumentParser(
+        description="Computing diversity statistics of IDR image attributes",
+        add_help=False,
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "--databank-mode",
+        dest="databank_mode",
+        help="Merge the element counts of the per-screen pass in memory, stream record batches into running count tables, estimate statistics from mergeable sketches or update persisted count tables with the screens that changed since the last run. All modes but in_memory read the metadata a second time",
+        default="in_memory",
+        choices=["in_memory", "streaming", "sketch", "incremental"],
+    )
+    opt_args.add_argument(
+        "--databank-state",
+        dest="databank_state_dir",
+        help="Directory holding the databank count tables in incremental mode",
+        default="IDR/data/statistics/databank_state",
+    )
+    opt_args.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        help="Rows per record batch in streaming and sketch mode",
+        type=int,
+        default=65_536,
+    )
+    opt_args.add_argument(
+        "--sketch-precision",
+        dest="sketch_precision",
+        help="HyperLogLog precision p in sketch mode. Richness has a relative standard error of 1.04/sqrt(2^p)",
+        type=int,
+        default=14,
+    )
+    opt_args.add_argument(
+        "--top-k",
+        dest="top_k",
+        help="Heavy hitters tracked per attribute in sketch mode",
+        type=int,
+        default=1_000,
+    )
+    opt_args.add_argument(
+        "--processes",
+        dest="processes",
+        help="Worker processes computing the per-screen statistics and sketching screens in sketch mode",
+        type=int,
+        default=1,
+    )
+    opt_args.add_argument(
+        "--bootstrap",
+        dest="bootstrap",
+        help="Multinomial bootstrap replicates per screen and attribute for confidence intervals. 0 disables the bootstrap",
+        type=int,
+        default=0,
+    )
+    opt_args.add_argument(
+        "--confidence",
+        dest="confidence",
+        help="Confidence level of the bootstrap intervals",
+        type=float,
+        default=0.95,
+    )
+    opt_args.add_argument(
+        "--seed",
+        dest="seed",
+        help="Seed of the bootstrap",
+        type=int,
+        default=0,
+    )
+    opt_args.add_argument(
+        "--no-hierarchy",
+        dest="hierarchy",
+        help="Skip the plate, screen, study and databank level statistics",
+        action="store_false",
+    )
+    opt_args.add_argument(
+        "--no-rarefaction",
+        dest="rarefaction",
+        help="Skip the rarefied study statistics",
+        action="store_false",
+    )
+    opt_args.add_argument(
+        "--rarefaction-depth",
+        dest="rarefaction_depth",
+        help="Wells per screen at which rarefied richness and Shannon Index are compared. Defaults to the smallest screen",
+        type=int,
+        default=None,
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+    add_instrumentation_args(parser)
+
+    return parser
+
+
+def synthetic_metadata_parser():
+    parser = argparse.ArgumentParser(
+        description="Generating synthetic IDR-scale metadata for benchmarking",
+        add_help=False,
+    )
+    req_args = parser.add_argument_group("Required Arguments")
+    req_args.add_argument(
+        "-o",
+        dest="output_dir",
+        help="REQUIRED: Directory to write the synthetic metadata and json_metadata trees to",
+        required=True,
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "-s",
+        dest="scale",
+        help="Size of the synthetic databank relative to the real one",
+        type=float,
+        default=1.0,
+    )
+    opt_args.add_argument(
+        "-f",
+        dest="output_format",
+        help="Write per-screen .parquet files, well annotation .json trees or both",
+        default="parquet",
+        choices=["parquet", "json", "both"],
+    )
+    opt_args.add_argument(
+        "--seed", dest="seed", help="Random seed", type=int, default=0
+    )
+    opt_args.add_argument(
+        "--elements-and-counts",
+        dest="elements_and_counts_file",
+        help="unique_elements_and_counts.parquet used to calibrate attribute distributions",
+        default="IDR/data/statistics/unique_elements_and_counts.parquet",
+    )
+    opt_args.add_argument(
+        "--json-screens",
+        dest="json_screens",
+        help="Number of screens in the .json tree",
+        type=int,
+        default=3,
+    )
+    opt_args.add_argument(
+        "--json-plates",
+        dest="json_plates",
+        help="Number of plates per screen in the .json tree",
+        type=int,
+        default=2,
+    )
+    opt_args.add_argument(
+        "--json-wells",
+        dest="json_wells",
+        help="Number of wells per plate in the .json tree",
+        type=int,
+        default=384,
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+
+    return parser
+
+
+def benchmark_parser():
+    parser = argparse.ArgumentParser(
+        description="Running and comparing pipeline benchmarks", add_help=False
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(
+        "-r",
+        dest="results_dir",
+        help="Directory holding the benchmark result history",
+        default="IDR/data/benchmarks",
+    )
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and save timings")
+    run_parser.add_argument(
+        "benchmarks",
+        help="Benchmarks to run. Defaults to all benchmarks",
+        nargs="*",
+    )
+    run_parser.add_argument(
+        "-n",
+        dest="repeat",
+        help="Number of timed calls per benchmark",
+        type=int,
+        default=5,
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two runs. Defaults to the two most recent runs"
+    )
+    compare_parser.add_argument(
+        "--baseline", dest="baseline", help="Results file of the reference run"
+    )
+    compare_parser.add_argument(
+        "--candidate", dest="candidate", help="Results file of the run to check"
+    )
+    compare_parser.add_argument(
+        "-t",
+        dest="threshold",
+        help="Relative slowdown flagged as a regression",
+        type=float,
+        default=0.1,
+    )
+
+    return parser
+
+
+def check_parser():
+    parser = argparse.ArgumentParser(
+        description="Regression checks of pipeline stages on synthetic inputs",
+        add_help=False,
+    )
+    parser.add_argument(
+        "checks",
+        help="Checks to run. Defaults to all checks",
+        nargs="*",
+    )
+    opt_args = parser.add_argument_group("Optional Arguments")
+    opt_args.add_argument(*help_opt[0], **help_opt[1])
 
     return parser
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import pathlib
+import sys
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# Define path to extraction_utils directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+from metadata_extraction.extraction_utils.io import walk
+from metadata_extraction.extraction_utils.schema import normalize_channels
+from utils import instrumentation
+
+DEFAULT_CACHE_DIR = "IDR/data/cache"
+
+# Schema metadata key recording the source files a cached table was built from
+SOURCES_KEY = b"cache_sources"
+
+
+def source_fingerprint(source_files):
+    """Path, modification time and size of each source file
+
+    Parameters
+    ----------
+    source_files: list
+        Parquet files a cached table is built from
+
+    Returns
+    -------
+    list
+        [path, mtime_ns, size] per source file, sorted by path
+    """
+    fingerprint = list()
+    for source_file in source_files:
+        stat = os.stat(source_file)
+        fingerprint.append([str(source_file), stat.st_mtime_ns, stat.st_size])
+
+    return sorted(fingerprint)
+
+
+def cached_sources(cache_file):
+    """Source fingerprint recorded in a cache file, or None if it is missing or unreadable"""
+    try:
+        with pa.memory_map(str(cache_file)) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or dict()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+    if SOURCES_KEY not in metadata:
+        return None
+
+    return json.loads(metadata[SOURCES_KEY])
+
+
+def write_cache(table, cache_file, fingerprint):
+    """Writes a table as uncompressed Feather with its source fingerprint
+
+    The file is written under a temporary name and moved into place, so that
+    processes mapping a previous version keep a consistent view.
+    """
+    cache_file = pathlib.Path(cache_file)
+    pathlib.Path.mkdir(cache_file.parent, exist_ok=True, parents=True)
+    partial_file = pathlib.Path(cache_file.parent, f".{cache_file.name}.partial")
+
+    metadata = dict(table.schema.metadata or dict())
+    metadata[SOURCES_KEY] = json.dumps(fingerprint).encode("utf-8")
+
+    # The IPC file format holds a single dictionary per column
+    table = table.unify_dictionaries().replace_schema_metadata(metadata)
+    feather.write_feather(table, partial_file, compression="uncompressed")
+    os.replace(partial_file, cache_file)
+
+
+def cached_table(source_files, cache_file, build=None, columns=None):
+    """Memory-mapped table of one or more Parquet files
+
+    The table is built from the sources and saved as uncompressed Feather on the first
+    call, and whenever a source file is added, removed or modified. Later calls map the
+    Feather file without decompressing or copying it, and processes mapping the same
+    file share its pages.
+
+    Parameters
+    ----------
+    source_files: list
+        Parquet files of the table
+    cache_file: str or pathlib.Path
+        Feather file holding the table
+    build: callable
+        Builds the pyarrow.Table from source_files. Reads and concatenates the files by
+        default
+    columns: list
+        Columns to return, all by default
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    fingerprint = source_fingerprint(source_files)
+    if cached_sources(cache_file) != fingerprint:
+        instrumentation.count("table_cache_misses")
+        with instrumentation.stage("cache_build"):
+            if build is None:
+                table = pa.concat_tables(
+                    [pq.read_table(source_file) for source_file in source_files],
+                    promote_options="permissive",
+                )
+            else:
+                table = build(source_files)
+            write_cache(table, cache_file, fingerprint)
+    else:
+        instrumentation.count("table_cache_hits")
+
+    return feather.read_table(str(cache_file), columns=columns, memory_map=True)
+
+
+def cache_file_name(source_file):
+    """Feather file name of a source file, keyed on a hash of its resolved path
+
+    e.g. IDR/data/statistics/databank_diversity.parquet as
+    databank_diversity-<hash>.feather, so that files of the same name in different
+    directories have separate copies.
+    """
+    source_file = pathlib.Path(source_file)
+    path_hash = hashlib.blake2b(
+        str(source_file.resolve()).encode("utf-8"), digest_size=8
+    ).hexdigest()
+
+    return f"{source_file.name.split('.')[0]}-{path_hash}.feather"
+
+
+def read_cached(source_file, cache_dir=DEFAULT_CACHE_DIR, columns=None):
+    """Reads a Parquet file into pandas through a memory-mapped Feather copy
+
+    Parameters
+    ----------
+    source_file: str or pathlib.Path
+        Parquet file, e.g. IDR/data/statistics/databank_diversity.parquet
+    cache_dir: str or pathlib.Path
+        Directory holding the Feather copies
+    columns: list
+        Columns to read, all by default
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    cache_file = pathlib.Path(cache_dir, cache_file_name(source_file))
+
+    return cached_table([source_file], cache_file, columns=columns).to_pandas()
+
+
+def consolidated_metadata_table(metadata_files):
+    """Concatenates per-screen metadata with Channels as 'stain:target;...' strings"""
+    return pa.concat_tables(
+        [
+            normalize_channels(pq.read_table(metadata_file))
+            for metadata_file in metadata_files
+        ],
+        promote_options="permissive",
+    )
+
+
+def cached_metadata(
+    metadata_dir="IDR/data/metadata", cache_dir=DEFAULT_CACHE_DIR, columns=None
+):
+    """Metadata of every screen as a single memory-mapped table
+
+    Parameters
+    ----------
+    metadata_dir: str or pathlib.Path
+        Directory holding the per-screen .parquet metadata files
+    cache_dir: str or pathlib.Path
+        Directory holding the Feather copy
+    columns: list
+        Columns to read, all by default
+
+    Returns
+    -------
+    pyarrow.Table
+        Metadata of all wells, see consolidated_metadata_table()
+    """
+    return cached_table(
+        list(walk(metadata_dir, extensions=".parquet")),
+        pathlib.Path(cache_dir, "metadata.feather"),
+        build=consolidated_metadata_table,
+        columns=columns,
+    )
@@ -0,0 +1,192 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+DIVERSITY_STATS = ["S", "H", "NME", "J", "E", "GC"]
+
+
+def ragged_offsets(lengths):
+    """Group boundaries of a ragged array from the number of elements per group"""
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def grouped_diversity(counts, offsets, use_numba=True):
+    """Diversity statistics for many groups of element counts at once
+
+    Groups are stored as a ragged array, i.e. the counts of group g are
+    counts[offsets[g]:offsets[g + 1]]. Results are identical to
+    utils.statistics.stats_pipeline() applied to each group separately, with NaN in
+    place of None for NME and J of groups with a single element.
+
+    Parameters
+    ----------
+    counts: numpy.ndarray
+        Positive instance counts of the unique elements of all groups
+    offsets: numpy.ndarray
+        Start of each group in counts, followed by len(counts)
+    use_numba: bool
+        Use the compiled kernel if numba is installed, otherwise NumPy
+
+    Returns
+    -------
+    stats: dict
+        Array with one value per group for each of S, H, NME, J, E and GC
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    if use_numba and numba is not None:
+        # Logarithms stay in NumPy, whose vectorised log may differ from the scalar
+        # log of compiled code in the last bit
+        group = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        totals = np.bincount(group, weights=counts, minlength=len(offsets) - 1)
+        p = counts / totals[group]
+        s, h, nme, e, gc = _grouped_diversity_kernel(
+            counts, offsets, totals, p, -p * np.log(p)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            j = np.where(s > 1, h / np.log(s), np.nan)
+
+        return {"S": s, "H": h, "NME": nme, "J": j, "E": e, "GC": gc}
+
+    return grouped_diversity_numpy(counts, offsets)
+
+
+def grouped_diversity_numpy(counts, offsets):
+    """NumPy implementation of grouped_diversity()"""
+    n_groups = len(offsets) - 1
+    s = np.diff(offsets)
+    group = np.repeat(np.arange(n_groups), s)
+
+    totals = np.bincount(group, weights=counts, minlength=n_groups)
+    p = counts / totals[group]
+    h_values = -p * np.log(p)
+
+    h = np.bincount(group, weights=h_values, minlength=n_groups)
+    e = (1 / np.bincount(group, weights=p**2, minlength=n_groups)) / s
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        j = np.where(s > 1, h / np.log(s), np.nan)
+
+    # Sort within groups to find the median and maximum -p*ln(p) values
+    starts = offsets[:-1]
+    sorted_h_values = h_values[np.lexsort((h_values, group))]
+    nonempty = s > 0
+    lower = np.where(nonempty, starts + (s - 1) // 2, 0)
+    upper = np.where(nonempty, starts + s // 2, 0)
+    last = np.where(nonempty, offsets[1:] - 1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        nme = np.where(
+            s > 1,
+            (sorted_h_values[lower] + sorted_h_values[upper])
+            / 2
+            / sorted_h_values[last],
+            np.nan,
+        )
+
+    # Gini coefficient from the ranks of the sorted counts within each group
+    sorted_counts = counts[np.lexsort((counts, group))]
+    rank = np.arange(len(counts)) - starts[group] + 1
+    total_difference = np.bincount(
+        group, weights=sorted_counts * (2 * rank - s[group] - 1), minlength=n_groups
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gc = total_difference / (s * totals)
+
+    h = np.where(s == 1, 0.0, h)
+
+    return {"S": s, "H": h, "NME": nme, "J": j, "E": e, "GC": gc}
+
+
+def _grouped_diversity_loop(counts, offsets, totals, p, h_values):
+    """Single pass over all groups of grouped_diversity(), compiled by numba
+
+    Sums run over the elements of a group in the same order as np.bincount() in
+    grouped_diversity_numpy(), so both implementations give identical results.
+    """
+    n_groups = len(offsets) - 1
+    s = np.empty(n_groups, dtype=np.int64)
+    h = np.empty(n_groups)
+    nme = np.empty(n_groups)
+    e = np.empty(n_groups)
+    gc = np.empty(n_groups)
+
+    for g in range(n_groups):
+        start = offsets[g]
+        end = offsets[g + 1]
+        n = end - start
+        s[g] = n
+
+        h_sum = 0.0
+        dominance = 0.0
+        for i in range(start, end):
+            h_sum += h_values[i]
+            dominance += p[i] ** 2
+        e[g] = (1 / dominance) / n
+
+        if n > 1:
+            h[g] = h_sum
+            sorted_h_values = np.sort(h_values[start:end])
+            nme[g] = (
+                (sorted_h_values[(n - 1) // 2] + sorted_h_values[n // 2])
+                / 2
+                / sorted_h_values[n - 1]
+            )
+        else:
+            h[g] = 0.0
+            nme[g] = np.nan
+
+        sorted_counts = np.sort(counts[start:end])
+        total_difference = 0.0
+        for i in range(n):
+            total_difference += sorted_counts[i] * (2 * (i + 1) - n - 1)
+        gc[g] = total_difference / (n * totals[g])
+
+    return s, h, nme, e, gc
+
+
+if numba is not None:
+    _grouped_diversity_kernel = numba.njit(cache=True, nogil=True)(
+        _grouped_diversity_loop
+    )
+
+
+def bootstrap_diversity(counts, n_replicates, rng):
+    """Diversity statistics of multinomial bootstrap replicates of a count vector
+
+    All replicates are drawn as a single n_replicates x S matrix. Elements that are not
+    drawn in a replicate do not count towards its richness.
+
+    Parameters
+    ----------
+    counts: numpy.ndarray
+        Instance counts of the unique elements of an image attribute
+    n_replicates: int
+        Number of bootstrap replicates
+    rng: numpy.random.Generator
+        Random number generator
+
+    Returns
+    -------
+    stats: dict
+        Array with one value per replicate for each of S, H, NME, J, E and GC
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    replicates = rng.multinomial(counts.sum(), counts / counts.sum(), size=n_replicates)
+
+    drawn = replicates > 0
+    return grouped_diversity(
+        counts=replicates[drawn], offsets=ragged_offsets(drawn.sum(axis=1))
+    )
+
+
+def confidence_interval(replicate_values, confidence=0.95):
+    """Percentile bootstrap confidence interval, ignoring undefined replicates"""
+    tail = (1 - confidence) / 2 * 100
+    if np.all(np.isnan(replicate_values)):
+        return np.nan, np.nan
+
+    return tuple(np.nanpercentile(replicate_values, [tail, 100 - tail]))
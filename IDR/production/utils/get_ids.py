@@ -1,7 +1,16 @@
+import json
 import pathlib
-import requests
+import sys
+from multiprocessing.pool import ThreadPool
+
 import pandas as pd
 
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+from utils.args import get_ids_parser
+from utils.transport import ThreadSessions
+
 
 def get_id_from_json(json):
     """Clean json details in preparation for IDR screen detail storage
@@ -33,6 +42,166 @@ def get_id_from_json(json):
     return (id_, name_, title_, description_, split_detail)
 
 
+def get_listing_page(session, index_url, offset, limit, headers=None):
+    """Requests a single page of an IDR API listing
+
+    Parameters
+    ----------
+    session: Requests.session()
+        Requests session providing access to IDR API
+    index_url: str
+        Listing endpoint, e.g. https://idr.openmicroscopy.org/api/v0/m/screens/
+    offset: int
+        Index of the first listed object
+    limit: int
+        Number of listed objects per page
+    headers: dict
+        Additional request headers, e.g. conditional request headers
+
+    Returns
+    -------
+    requests.Response
+        Response with status 200, or 304 for an unchanged conditional request
+    """
+    response = session.get(
+        index_url, params={"offset": offset, "limit": limit}, headers=headers
+    )
+    if response.status_code not in [200, 304]:
+        response.raise_for_status()
+
+    return response
+
+
+def conditional_headers(validators):
+    """If-None-Match and If-Modified-Since headers revalidating a stored page"""
+    headers = dict()
+    if validators.get("etag") is not None:
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified") is not None:
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    return headers
+
+
+def fetch_listing(sessions, index_url, pool, snapshot=None, page_size=500):
+    """Collects all objects of a paginated IDR API listing
+
+    The first page reports the total count and the page size the server allows
+    (at most meta.maxLimit). All remaining pages are then requested concurrently, one
+    request per page.
+
+    If a snapshot of a previous listing is given, every page is requested
+    conditionally and pages answered with 304 Not Modified are taken from the
+    snapshot. A 304 carries no total count, so pages are requested up to one page past
+    the last known object, which reveals objects appended after a full last page.
+    Pages are added while a changed page reports a larger total count.
+
+    Parameters
+    ----------
+    sessions: utils.transport.ThreadSessions
+        Sessions providing access to IDR API, one per requesting thread
+    index_url: str
+        Listing endpoint, e.g. https://idr.openmicroscopy.org/api/v0/m/screens/
+    pool: multiprocessing.pool.ThreadPool
+        Worker threads requesting pages
+    snapshot: dict
+        Listing returned by a previous call, or None
+    page_size: int
+        Objects requested per page, capped by the server at meta.maxLimit
+
+    Returns
+    -------
+    listing: dict
+        "url", "page_size", "limit", "total_count", the "etag" and "last_modified"
+        validators of each page under "pages" and the listed objects under "data"
+    """
+    # Snapshots of another page size, or saved without per page validators, are
+    # refetched in full
+    if snapshot is not None and (
+        snapshot.get("page_size") != page_size or "pages" not in snapshot
+    ):
+        snapshot = None
+
+    def fetch_page(page_number, limit):
+        offset = page_number * limit
+        validators = dict()
+        if (
+            snapshot is not None
+            and snapshot["limit"] == limit
+            and page_number < len(snapshot["pages"])
+        ):
+            validators = snapshot["pages"][page_number]
+
+        response = get_listing_page(
+            session=sessions.get(),
+            index_url=index_url,
+            offset=offset,
+            limit=limit,
+            headers=conditional_headers(validators),
+        )
+        if response.status_code == 304:
+            return validators, snapshot["data"][offset : offset + limit], None
+
+        page_json = response.json()
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+        return validators, page_json["data"], page_json["meta"]
+
+    pages = [fetch_page(0, page_size)]
+    meta = pages[0][2]
+    if meta is None:
+        limit = snapshot["limit"]
+        total_count = snapshot["total_count"]
+        n_pages = total_count // limit + 1
+    else:
+        limit = min(meta["limit"], meta["maxLimit"])
+        total_count = meta["totalCount"]
+        n_pages = -(-total_count // limit)
+
+    while len(pages) < n_pages:
+        new_pages = pool.map(
+            lambda page_number: fetch_page(page_number, limit),
+            range(len(pages), n_pages),
+        )
+        pages.extend(new_pages)
+
+        # Changed pages report the current total count
+        reported_counts = [
+            page_meta["totalCount"] for _, _, page_meta in new_pages if page_meta
+        ]
+        if reported_counts:
+            total_count = max(reported_counts)
+            n_pages = max(n_pages, -(-total_count // limit))
+
+    return {
+        "url": index_url,
+        "page_size": page_size,
+        "limit": limit,
+        "total_count": total_count,
+        "pages": [validators for validators, _, _ in pages],
+        "data": [item for _, page_data, _ in pages for item in page_data],
+    }
+
+
+def load_snapshot(snapshot_file):
+    """Listings saved by a previous run, or an empty dict"""
+    snapshot_file = pathlib.Path(snapshot_file)
+    if not snapshot_file.exists():
+        return dict()
+
+    with open(snapshot_file) as file:
+        return json.load(file)
+
+
+def save_snapshot(snapshot, snapshot_file):
+    """Saves listings for conditional refresh in the next run"""
+    with open(snapshot_file, "w") as file:
+        json.dump(snapshot, file)
+
+
 def extract_study_info(session, screen_id):
     """Pull metadata info per screen, given screen id
 
@@ -70,53 +239,59 @@ def extract_study_info(session, screen_id):
 
 
 if __name__ == "__main__":
-    data_dir = pathlib.Path("IDR/data")
-
-    # Load all screens
-    SCREEN_INDEX_PAGE = "https://idr.openmicroscopy.org/api/v0/m/screens/"
-
-    with requests.Session() as screen_session:
-        request = requests.Request("GET", SCREEN_INDEX_PAGE)
-        prepped = screen_session.prepare_request(request)
-        response = screen_session.send(prepped)
-        if response.status_code != 200:
-            response.raise_for_status()
+    # Define arguments
+    args = get_ids_parser().parse_args(sys.argv[1:])
 
-    screen_info = screen_session.get(SCREEN_INDEX_PAGE).json()
+    data_dir = pathlib.Path(args.data_dir)
+    pathlib.Path.mkdir(data_dir, exist_ok=True, parents=True)
 
-    # Load all projects
+    SCREEN_INDEX_PAGE = "https://idr.openmicroscopy.org/api/v0/m/screens/"
     PROJECT_INDEX_PAGE = "https://idr.openmicroscopy.org/api/v0/m/projects/"
 
-    with requests.Session() as project_session:
-        request = requests.Request("GET", PROJECT_INDEX_PAGE)
-        prepped = project_session.prepare_request(request)
-        response = project_session.send(prepped)
-        if response.status_code != 200:
-            response.raise_for_status()
+    snapshot_file = pathlib.Path(data_dir, "idr_listing_snapshot.json")
+    snapshot = load_snapshot(snapshot_file)
 
-    project_info = project_session.get(PROJECT_INDEX_PAGE).json()
+    # Worker threads request through their own sessions
+    with ThreadSessions(args) as sessions, ThreadPool(processes=args.threads) as pool:
+        # Load all screens and projects
+        listings = {
+            name: fetch_listing(
+                sessions=sessions,
+                index_url=index_url,
+                pool=pool,
+                snapshot=snapshot.get(name),
+                page_size=args.page_size,
+            )
+            for name, index_url in [
+                ("screens", SCREEN_INDEX_PAGE),
+                ("projects", PROJECT_INDEX_PAGE),
+            ]
+        }
+        save_snapshot(listings, snapshot_file)
 
-    screen_df = pd.DataFrame(
-        [get_id_from_json(x) for x in screen_info["data"]],
-        columns=["id", "name", "title", "description", "category"],
-    )
+        screen_df = pd.DataFrame(
+            [get_id_from_json(x) for x in listings["screens"]["data"]],
+            columns=["id", "name", "title", "description", "category"],
+        )
 
-    project_df = pd.DataFrame(
-        [get_id_from_json(x) for x in project_info["data"]],
-        columns=["id", "name", "title", "description", "category"],
-    )
+        project_df = pd.DataFrame(
+            [get_id_from_json(x) for x in listings["projects"]["data"]],
+            columns=["id", "name", "title", "description", "category"],
+        )
+
+        id_df = pd.concat([screen_df, project_df], axis="rows").reset_index(drop=True)
 
-    id_df = pd.concat([screen_df, project_df], axis="rows").reset_index(drop=True)
-
-    # Extract summary details for all screens
-    screen_ids = id_df.query("category=='Screen'").id.tolist()
-    screen_details_df = pd.concat(
-        [
-            extract_study_info(session=requests.Session(), screen_id=x)
-            for x in screen_ids
-        ],
-        axis="rows",
-    ).reset_index(drop=True)
+        # Extract summary details for all screens
+        screen_ids = id_df.query("category=='Screen'").id.tolist()
+        screen_details_df = pd.concat(
+            pool.map(
+                lambda screen_id: extract_study_info(
+                    session=sessions.get(), screen_id=screen_id
+                ),
+                screen_ids,
+            ),
+            axis="rows",
+        ).reset_index(drop=True)
 
     # Output idr_ids as parquet file
     output_file = pathlib.Path(data_dir, "idr_screen_ids.parquet")
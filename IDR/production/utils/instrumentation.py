@@ -0,0 +1,174 @@
+import collections
+import contextlib
+import cProfile
+import datetime
+import json
+import pathlib
+import platform
+import resource
+import sys
+import threading
+import time
+
+# Per-process metrics registry. Pool workers return snapshot() so the parent can merge() them
+_lock = threading.Lock()
+_timers = collections.defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+_counters = collections.Counter()
+_peak_rss_mb = {"self": 0.0}
+_profiling = {"dir": None, "active": False}
+_profilers = dict()
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size of this process (or its reaped children) in MiB"""
+    max_rss = resource.getrusage(who).ru_maxrss
+
+    # ru_maxrss is reported in bytes on macOS and in KiB elsewhere
+    if sys.platform == "darwin":
+        return max_rss / 2**20
+    return max_rss / 2**10
+
+
+def enable_profiling(profile_dir):
+    """Dump a cProfile .prof file per stage into profile_dir
+
+    Profiles accumulate across calls of a stage and are written by dump_profiles()
+    or write_report().
+    They can be inspected with pstats or snakeviz, or converted for flame graph tools.
+    Nested stages are covered by the profile of the outermost stage.
+
+    Parameters
+    ----------
+    profile_dir: str or pathlib.Path
+        Output directory for {run_name}_{stage}.prof files
+    """
+    _profiling["dir"] = pathlib.Path(profile_dir)
+    pathlib.Path.mkdir(_profiling["dir"], exist_ok=True, parents=True)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times a pipeline stage, samples peak RSS and optionally profiles it
+
+    Parameters
+    ----------
+    name: str
+        Stage name, e.g. download, parse, clean, write, count or stats
+    """
+    profiler = None
+    with _lock:
+        if _profiling["dir"] is not None and not _profiling["active"]:
+            _profiling["active"] = True
+            profiler = _profilers.setdefault(name, cProfile.Profile())
+
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+
+        with _lock:
+            _timers[name]["calls"] += 1
+            _timers[name]["seconds"] += seconds
+            _peak_rss_mb["self"] = max(_peak_rss_mb["self"], peak_rss_mb())
+            if profiler is not None:
+                _profiling["active"] = False
+
+
+def count(name, n=1):
+    """Increments a counter, e.g. wells, requests, bytes or files"""
+    with _lock:
+        _counters[name] += n
+
+
+def snapshot():
+    """Metrics collected in this process
+
+    Returns
+    -------
+    dict
+        Stage timers, counters and peak RSS
+    """
+    with _lock:
+        return {
+            "stages": {name: dict(timer) for name, timer in _timers.items()},
+            "counters": dict(_counters),
+            "peak_rss_mb": max(_peak_rss_mb["self"], peak_rss_mb()),
+        }
+
+
+def merge(worker_snapshot):
+    """Adds the metrics of a worker process snapshot to this process"""
+    with _lock:
+        for name, timer in worker_snapshot["stages"].items():
+            _timers[name]["calls"] += timer["calls"]
+            _timers[name]["seconds"] += timer["seconds"]
+        _counters.update(worker_snapshot["counters"])
+        _peak_rss_mb.setdefault("workers", 0.0)
+        _peak_rss_mb["workers"] = max(
+            _peak_rss_mb["workers"], worker_snapshot["peak_rss_mb"]
+        )
+
+
+def reset():
+    """Clears all metrics and profiles collected in this process"""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _profilers.clear()
+        _peak_rss_mb.clear()
+        _peak_rss_mb["self"] = 0.0
+
+
+def dump_profiles(prefix):
+    """Writes the accumulated stage profiles as {prefix}_{stage}.prof files"""
+    if _profiling["dir"] is None:
+        return
+
+    with _lock:
+        for name, profiler in _profilers.items():
+            profiler.dump_stats(
+                pathlib.Path(_profiling["dir"], f"{prefix}_{name}.prof")
+            )
+
+
+def write_report(metrics_dir, run_name):
+    """Writes the metrics of this run as a machine-readable .json report
+
+    Stage seconds are inclusive of nested stages and summed across worker processes.
+
+    Parameters
+    ----------
+    metrics_dir: str or pathlib.Path
+        Directory for metrics reports
+    run_name: str
+        Name of the pipeline step, used as the report file prefix
+
+    Returns
+    -------
+    output_file: pathlib.Path
+        Path of the written report
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    report = {
+        "run": run_name,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "argv": sys.argv,
+        **snapshot(),
+        "peak_rss_mb_workers": _peak_rss_mb.get("workers"),
+        "peak_rss_mb_children": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+    pathlib.Path.mkdir(pathlib.Path(metrics_dir), exist_ok=True, parents=True)
+    dump_profiles(prefix=run_name)
+
+    output_file = pathlib.Path(metrics_dir, f"{run_name}_{timestamp}.json")
+    with open(output_file, "w") as file:
+        json.dump(report, file, indent=4)
+
+    return output_file
@@ -0,0 +1,183 @@
+import pathlib
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import scipy.sparse
+
+from utils.diversity import DIVERSITY_STATS, grouped_diversity
+
+
+def attribute_file_name(attribute, extension=".npz"):
+    """File name of an attribute's count matrix, e.g. 'Gene Identifier' as gene_identifier.npz"""
+    return f"{re.sub(r'[^0-9a-z]+', '_', attribute.lower()).strip('_')}{extension}"
+
+
+def sorted_codes(dictionary_array):
+    """Codes of a dictionary array into its distinct values in sorted order
+
+    Parameters
+    ----------
+    dictionary_array: pyarrow.DictionaryArray
+
+    Returns
+    -------
+    codes: numpy.ndarray
+        Position of each value in values
+    values: numpy.ndarray
+        Sorted distinct values of the array
+    """
+    present, codes = np.unique(
+        dictionary_array.indices.to_numpy(zero_copy_only=False), return_inverse=True
+    )
+    values = dictionary_array.dictionary.to_numpy(zero_copy_only=False)[present]
+    order = np.argsort(values, kind="stable")
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+
+    return ranks[codes], values[order]
+
+
+def screen_element_matrices(elements_and_counts):
+    """Screens by elements count matrix of each image attribute
+
+    The matrices are built from the dictionary indices of the Arrow columns, without
+    converting the table to pandas.
+
+    Parameters
+    ----------
+    elements_and_counts: pyarrow.Table
+        Long format element counts with Screen, Attribute, Element and Count columns,
+        as saved to unique_elements_and_counts.parquet
+
+    Returns
+    -------
+    matrices: dict
+        {attribute: (matrix, screens, elements)} with the scipy.sparse.csr_matrix of
+        counts and the screen and element of each row and column. Rows hold the
+        elements of a screen in column order
+    """
+    elements_and_counts = elements_and_counts.select(
+        ["Screen", "Attribute", "Element", "Count"]
+    ).unify_dictionaries()
+    screens = elements_and_counts.column("Screen").combine_chunks()
+    attributes = elements_and_counts.column("Attribute").combine_chunks()
+    elements = pc.dictionary_encode(elements_and_counts.column("Element"))
+    elements = elements.combine_chunks()
+    counts = elements_and_counts.column("Count").to_numpy()
+
+    # Attributes in order of first appearance
+    attribute_codes = attributes.indices.to_numpy(zero_copy_only=False)
+    present, first_rows = np.unique(attribute_codes, return_index=True)
+    present = present[np.argsort(first_rows)]
+
+    matrices = dict()
+    for attribute_code in present:
+        rows = np.flatnonzero(attribute_codes == attribute_code)
+        row_codes, attribute_screens = sorted_codes(screens.take(pa.array(rows)))
+        column_codes, attribute_elements = sorted_codes(elements.take(pa.array(rows)))
+        matrix = scipy.sparse.csr_matrix(
+            (counts[rows], (row_codes, column_codes)),
+            shape=(len(attribute_screens), len(attribute_elements)),
+        )
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        matrices[attributes.dictionary[attribute_code].as_py()] = (
+            matrix,
+            attribute_screens,
+            attribute_elements,
+        )
+
+    return matrices
+
+
+def save_count_matrix(matrix, screens, elements, output_file):
+    """Saves a count matrix with its row and column vocabularies as .npz
+
+    The file holds the arrays of scipy.sparse.save_npz(), so that
+    scipy.sparse.load_npz() reads the matrix alone, plus 'screens' and 'elements',
+    which numpy.load() returns as the row and column vocabularies.
+    """
+    matrix = matrix.tocsr()
+    np.savez_compressed(
+        output_file,
+        format=np.array("csr"),
+        shape=np.array(matrix.shape),
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        screens=np.asarray(screens).astype(str),
+        elements=np.asarray(elements).astype(str),
+    )
+
+
+def save_count_matrices(matrices, output_dir):
+    """Saves the output of screen_element_matrices() as one .npz file per attribute
+
+    Returns
+    -------
+    dict
+        {attribute: output file}
+    """
+    pathlib.Path.mkdir(pathlib.Path(output_dir), exist_ok=True, parents=True)
+
+    output_files = dict()
+    for attribute, (matrix, screens, elements) in matrices.items():
+        output_file = pathlib.Path(output_dir, attribute_file_name(attribute))
+        save_count_matrix(matrix, screens, elements, output_file)
+        output_files[attribute] = output_file
+
+    return output_files
+
+
+def matrix_diversity(matrix, use_numba=True):
+    """Diversity statistics of every row of a count matrix
+
+    The stored counts of row r are data[indptr[r]:indptr[r + 1]] of the CSR matrix,
+    i.e. the ragged layout of utils.diversity.grouped_diversity(), so all rows are
+    computed at once without densifying the matrix.
+
+    Parameters
+    ----------
+    matrix: scipy.sparse matrix
+        Element counts with one row per group, e.g. per screen
+    use_numba: bool
+        See grouped_diversity()
+
+    Returns
+    -------
+    stats: dict
+        Array with one value per row for each of S, H, NME, J, E and GC
+    """
+    matrix = scipy.sparse.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+
+    return grouped_diversity(
+        counts=matrix.data, offsets=matrix.indptr, use_numba=use_numba
+    )
+
+
+def matrix_stats(matrices):
+    """Screen diversity statistics of each attribute from screen_element_matrices()
+
+    Returns
+    -------
+    pandas.DataFrame
+        Screen, Attribute and DIVERSITY_STATS per screen and attribute
+    """
+    stats_dfs = list()
+    for attribute, (matrix, screens, _) in matrices.items():
+        stats = matrix_diversity(matrix)
+        stats_dfs.append(
+            pd.DataFrame(
+                {
+                    "Screen": screens,
+                    "Attribute": attribute,
+                    **{stat: stats[stat] for stat in DIVERSITY_STATS},
+                }
+            )
+        )
+
+    return pd.concat(stats_dfs, ignore_index=True)
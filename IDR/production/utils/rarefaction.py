@@ -0,0 +1,87 @@
+import numpy as np
+from scipy.special import gammaln
+
+
+def log_binomial(n, k):
+    """Natural logarithm of the binomial coefficient C(n, k), -inf where k > n"""
+    n = np.asarray(n, dtype=np.float64)
+    k = np.asarray(k, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        log_c = gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+
+    return np.where((k >= 0) & (k <= n), log_c, -np.inf)
+
+
+def expected_richness(counts, depth):
+    """Expected richness of a random subsample of depth instances without replacement
+
+    E[S_n] = sum_i 1 - C(N - N_i, n) / C(N, n) (Hurlbert 1971)
+
+    Parameters
+    ----------
+    counts: numpy.ndarray
+        Instance counts N_i of the unique elements of an image attribute
+    depth: int
+        Subsample size n, at most the total number of instances N
+
+    Returns
+    -------
+    float
+        Expected number of unique elements in the subsample
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if depth > total:
+        return np.nan
+
+    absent = np.exp(log_binomial(total - counts, depth) - log_binomial(total, depth))
+
+    return np.sum(1 - absent)
+
+
+def expected_shannon(counts, depth):
+    """Expected Shannon Index of a random subsample of depth instances without replacement
+
+    The subsample count of an element with N_i instances is hypergeometric, so
+    E[H_n] = -sum_i sum_k P(X_i = k) (k / n) ln(k / n).
+    Elements sharing a count share the inner sum, which is evaluated once per distinct
+    count over a ragged array of k = 1..min(N_i, n).
+
+    Parameters
+    ----------
+    counts: numpy.ndarray
+        Instance counts N_i of the unique elements of an image attribute
+    depth: int
+        Subsample size n, at most the total number of instances N
+
+    Returns
+    -------
+    float
+        Expected Shannon Index of the subsample
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum()
+    if depth > total:
+        return np.nan
+
+    distinct_counts, multiplicities = np.unique(counts, return_counts=True)
+    n_terms = np.minimum(distinct_counts, depth)
+
+    # Ragged array of k = 1..min(N_i, n) for every distinct count N_i
+    group = np.repeat(np.arange(len(distinct_counts)), n_terms)
+    starts = np.concatenate([[0], np.cumsum(n_terms)[:-1]])
+    k = np.arange(len(group)) - starts[group] + 1
+    n_i = distinct_counts[group]
+
+    log_pmf = (
+        log_binomial(n_i, k)
+        + log_binomial(total - n_i, depth - k)
+        - log_binomial(total, depth)
+    )
+    p = k / depth
+    h_terms = np.exp(log_pmf) * -p * np.log(p)
+
+    return np.sum(
+        multiplicities
+        * np.bincount(group, weights=h_terms, minlength=len(distinct_counts))
+    )
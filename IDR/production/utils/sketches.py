@@ -0,0 +1,373 @@
+import numpy as np
+import pandas as pd
+
+# HyperLogLog register count is 2**precision. The relative standard error of the
+# richness estimate is 1.04 / sqrt(2**precision), e.g. 0.81% at the default precision of 14
+DEFAULT_PRECISION = 14
+DEFAULT_TOP_K = 1_000
+
+
+def hash_values(values):
+    """Stable 64-bit hashes of attribute elements
+
+    Hashes are identical across processes and runs, so sketches built by different
+    workers can be merged.
+
+    Parameters
+    ----------
+    values: array-like
+        Attribute elements. Missing values hash to a common value
+
+    Returns
+    -------
+    numpy.ndarray
+        uint64 hash per value
+    """
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def bit_length(values):
+    """Number of significant bits of each uint64 value, 0 for 0"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+
+    # frexp() is exact here since both 32-bit halves fit into a float64 mantissa
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class HyperLogLog:
+    """HyperLogLog estimator of the number of distinct elements
+
+    Parameters
+    ----------
+    precision: int
+        Number of hash bits used to select a register, between 4 and 18
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype=np.uint8)
+
+    @property
+    def relative_standard_error(self):
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def update(self, values):
+        """Adds attribute elements to the sketch"""
+        hashes = hash_values(values)
+        if len(hashes) == 0:
+            return
+
+        remaining_bits = 64 - self.precision
+        index = (hashes >> np.uint64(remaining_bits)).astype(np.intp)
+        remainder = hashes & np.uint64(2**remaining_bits - 1)
+
+        # Position of the leftmost 1-bit within the remaining bits
+        rank = (remaining_bits - bit_length(remainder) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """Combines the sketch with a sketch of the same precision built elsewhere"""
+        if other.precision != self.precision:
+            raise ValueError("Only sketches of the same precision can be merged")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+        return self
+
+    def estimate(self):
+        """Estimated number of distinct elements added to the sketch"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m**2 / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+
+        # Linear counting is more accurate while many registers are still empty
+        empty_registers = np.count_nonzero(self.registers == 0)
+        if raw_estimate <= 2.5 * m and empty_registers > 0:
+            return m * np.log(m / empty_registers)
+
+        return raw_estimate
+
+
+class SpaceSaving:
+    """Mergeable Space-Saving summary of the k most frequent elements
+
+    Every tracked element has a count that never underestimates its true count and an
+    error such that count - error never overestimates it.
+    Untracked elements occur at most floor times.
+
+    Parameters
+    ----------
+    k: int
+        Number of tracked elements
+    """
+
+    def __init__(self, k=DEFAULT_TOP_K):
+        self.k = k
+        self.counts = dict()
+        self.errors = dict()
+        self.floor = 0
+
+    def update(self, values, counts):
+        """Adds exact counts of attribute elements, e.g. from one record batch"""
+        summary = SpaceSaving(k=self.k)
+        counts = np.asarray(counts)
+        if len(counts) > self.k:
+            # Exact counts of the batch beyond the k-th element bound the untracked elements
+            order = np.argsort(-counts, kind="stable")
+            summary.floor = int(counts[order[self.k]])
+            order = order[: self.k]
+        else:
+            order = np.arange(len(counts))
+
+        for index in order:
+            summary.counts[values[index]] = int(counts[index])
+            summary.errors[values[index]] = 0
+
+        return self.merge(summary)
+
+    def merge(self, other):
+        """Combines the summary with a summary built elsewhere"""
+        counts = dict()
+        errors = dict()
+        for element in self.counts.keys() | other.counts.keys():
+            counts[element] = self.counts.get(element, self.floor) + other.counts.get(
+                element, other.floor
+            )
+            errors[element] = self.errors.get(element, self.floor) + other.errors.get(
+                element, other.floor
+            )
+
+        floor = self.floor + other.floor
+        if len(counts) > self.k:
+            ranked = sorted(counts, key=counts.get, reverse=True)
+            floor = max(floor, counts[ranked[self.k]])
+            counts = {element: counts[element] for element in ranked[: self.k]}
+            errors = {element: errors[element] for element in ranked[: self.k]}
+
+        self.counts, self.errors, self.floor = counts, errors, floor
+
+        return self
+
+    def top_k(self):
+        """Tracked elements ranked by count
+
+        Returns
+        -------
+        pandas.DataFrame
+            Element, upper bound Count and Error per tracked element
+        """
+        top_k_df = pd.DataFrame(
+            {
+                "Element": list(self.counts.keys()),
+                "Count": list(self.counts.values()),
+                "Error": list(self.errors.values()),
+            }
+        )
+
+        return top_k_df.sort_values("Count", ascending=False, ignore_index=True)
+
+
+class AttributeSketch:
+    """Constant memory summary of the elements of one image attribute
+
+    Parameters
+    ----------
+    precision: int
+        HyperLogLog precision
+    k: int
+        Number of elements tracked by the Space-Saving summary
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, k=DEFAULT_TOP_K):
+        self.total = 0
+        self.richness = HyperLogLog(precision=precision)
+        self.heavy_hitters = SpaceSaving(k=k)
+
+    def update(self, values, counts):
+        """Adds unique attribute elements and their counts"""
+        self.total += int(np.sum(counts))
+        self.richness.update(values)
+        self.heavy_hitters.update(values, counts)
+
+        return self
+
+    def merge(self, other):
+        """Combines the sketch with a sketch built elsewhere, e.g. of another screen"""
+        self.total += other.total
+        self.richness.merge(other.richness)
+        self.heavy_hitters.merge(other.heavy_hitters)
+
+        return self
+
+
+def grouped_frequencies(sketch):
+    """Approximate abundance distribution of a sketched attribute
+
+    Tracked elements contribute their guaranteed counts (count - error). The remaining
+    instances are spread evenly over the estimated number of untracked elements.
+
+    Parameters
+    ----------
+    sketch: AttributeSketch
+        Sketch of an image attribute
+
+    Returns
+    -------
+    counts: numpy.ndarray
+        Distinct element counts
+    multiplicities: numpy.ndarray
+        Number of elements sharing each count
+    tail: tuple
+        Instances, estimated number of elements and per element upper bound of the
+        untracked tail
+    """
+    heavy_hitters = sketch.heavy_hitters
+    tracked = np.array(
+        [
+            heavy_hitters.counts[element] - heavy_hitters.errors[element]
+            for element in heavy_hitters.counts
+        ],
+        dtype=float,
+    )
+    tracked = tracked[tracked > 0]
+
+    s = max(int(round(sketch.richness.estimate())), len(tracked))
+    tail_instances = sketch.total - tracked.sum()
+    tail_richness = s - len(tracked)
+    if tail_instances > 0:
+        tail_richness = max(tail_richness, 1)
+
+    counts = tracked
+    multiplicities = np.ones(len(tracked))
+    if tail_richness > 0 and tail_instances > 0:
+        counts = np.append(counts, tail_instances / tail_richness)
+        multiplicities = np.append(multiplicities, tail_richness)
+
+    return counts, multiplicities, (tail_instances, tail_richness, heavy_hitters.floor)
+
+
+def grouped_shannon(counts, multiplicities):
+    """Shannon Index of an abundance distribution given as counts with multiplicities"""
+    p = counts / np.sum(counts * multiplicities)
+
+    return max(0.0, -np.sum(multiplicities * p * np.log(p)))
+
+
+def tail_shannon_bounds(tail_instances, tail_richness, floor):
+    """Shannon summands of the untracked tail, in absolute instance units
+
+    The tail contributes most when its instances are spread evenly over the
+    estimated number of elements. It contributes least when packed into as few elements
+    as the Space-Saving floor allows.
+
+    Returns
+    -------
+    low: tuple
+        Counts and multiplicities of the least even tail
+    high: tuple
+        Counts and multiplicities of the most even tail
+    """
+    if tail_instances <= 0:
+        empty = (np.array([]), np.array([]))
+        return empty, empty
+
+    high = (np.array([tail_instances / tail_richness]), np.array([tail_richness]))
+
+    floor = max(floor, tail_instances / tail_richness)
+    full_elements, remainder = divmod(tail_instances, floor)
+    low_counts = [floor] if full_elements > 0 else list()
+    low_multiplicities = [full_elements] if full_elements > 0 else list()
+    if remainder > 0:
+        low_counts.append(remainder)
+        low_multiplicities.append(1)
+    low = (np.array(low_counts), np.array(low_multiplicities))
+
+    return low, high
+
+
+def sketch_stats(sketch):
+    """Approximate diversity statistics of a sketched image attribute
+
+    Error bounds
+    ------------
+    S is the HyperLogLog estimate with a relative standard error of
+    1.04 / sqrt(2**precision), reported as S_RSE.
+    H, NME, J, E and GC are computed from the tracked counts plus an evenly spread tail.
+    The even tail maximises the tail's contribution to H, while packing the tail into
+    elements of at most floor instances minimises it. These two extremes are reported
+    as H_low and H_high and bound H up to the error of the richness estimate.
+    TopK_Coverage is the fraction of instances held by tracked elements. When all
+    elements are tracked the statistics are exact.
+
+    Parameters
+    ----------
+    sketch: AttributeSketch
+        Sketch of an image attribute
+
+    Returns
+    -------
+    stats: list
+        S, H, NME, J, E, GC, S_RSE, H_low, H_high and TopK_Coverage
+    """
+    counts, multiplicities, tail = grouped_frequencies(sketch)
+    s = int(np.sum(multiplicities))
+    total = np.sum(counts * multiplicities)
+    p = counts / total
+
+    if s == 1:
+        h = 0
+        nme = None
+        j = None
+    else:
+        h = grouped_shannon(counts, multiplicities)
+
+        # Median of the -p*ln(p) summands, with each count repeated by its multiplicity
+        h_values = -p * np.log(p)
+        order = np.argsort(h_values)
+        positions = np.cumsum(multiplicities[order])
+        middle = np.searchsorted(positions, [(s - 1) // 2, s // 2], side="right")
+        nme = np.mean(h_values[order][middle]) / h_values.max()
+        j = h / np.log(s)
+
+    e = (1 / np.sum(multiplicities * p**2)) / s
+
+    # Gini coefficient over the sorted counts, where each group of equal counts
+    # occupies consecutive ranks
+    order = np.argsort(counts)
+    sorted_counts = counts[order]
+    sorted_multiplicities = multiplicities[order]
+    preceding = np.cumsum(sorted_multiplicities) - sorted_multiplicities
+    total_difference = np.sum(
+        sorted_counts
+        * sorted_multiplicities
+        * (2 * preceding + sorted_multiplicities - s)
+    )
+    gc = total_difference / (s**2 * (total / s))
+
+    # Bounds on H from the least and most even tail
+    tracked = counts[: len(counts) - (1 if tail[0] > 0 else 0)]
+    bounds = list()
+    for tail_counts, tail_multiplicities in tail_shannon_bounds(*tail):
+        bounds.append(
+            grouped_shannon(
+                np.append(tracked, tail_counts),
+                np.append(np.ones(len(tracked)), tail_multiplicities),
+            )
+        )
+    h_low, h_high = bounds
+    coverage = tracked.sum() / total
+
+    return [
+        s,
+        h,
+        nme,
+        j,
+        e,
+        gc,
+        sketch.richness.relative_standard_error,
+        h_low,
+        h_high,
+        coverage,
+    ]
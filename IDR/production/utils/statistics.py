@@ -1,8 +1,17 @@
+import collections
+import functools
+import json
+import multiprocessing
+import os
 import pathlib
+import shutil
 import sys
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from numpy import log as ln
 from scipy import ndimage
 
@@ -10,6 +19,70 @@ from scipy import ndimage
 parent_dir = str(pathlib.Path(__file__).parents[1])
 sys.path.append(parent_dir)
 from metadata_extraction.extraction_utils.io import walk
+from metadata_extraction.extraction_utils.schema import (
+    normalize_channels,
+    read_metadata,
+)
+from utils import instrumentation
+from utils.diversity import (
+    DIVERSITY_STATS,
+    bootstrap_diversity,
+    confidence_interval,
+    grouped_diversity,
+    ragged_offsets,
+)
+from utils.matrices import attribute_file_name, matrix_stats
+from utils.rarefaction import expected_richness, expected_shannon
+from utils.sketches import (
+    DEFAULT_PRECISION,
+    DEFAULT_TOP_K,
+    AttributeSketch,
+    sketch_stats,
+)
+
+# Long format element counts, one row per screen, attribute and unique element
+ELEMENT_COUNTS_SCHEMA = pa.schema(
+    [
+        ("Study", pa.dictionary(pa.int32(), pa.string())),
+        ("Screen", pa.dictionary(pa.int32(), pa.string())),
+        ("Attribute", pa.dictionary(pa.int32(), pa.string())),
+        ("Element", pa.string()),
+        ("Count", pa.int64()),
+    ]
+)
+SKETCH_STAT_COLUMNS = ["S_RSE", "H_low", "H_high", "TopK_Coverage"]
+BOOTSTRAP_COLUMNS = [
+    "Study_Name",
+    "Screen",
+    "Attribute",
+    "Statistic",
+    "Estimate",
+    "CI_Lower",
+    "CI_Upper",
+]
+# Aggregation levels from finest to coarsest with the keys identifying a group
+HIERARCHY_LEVELS = {
+    "plate": ["Study_Name", "Screen", "Plate"],
+    "screen": ["Study_Name", "Screen"],
+    "study": ["Study_Name"],
+    "databank": [],
+}
+RAREFACTION_COLUMNS = [
+    "Study_Name",
+    "Screen",
+    "Attribute",
+    "Depth",
+    "Wells",
+    "S_Rarefied",
+    "H_Rarefied",
+]
+
+
+def parse_metadata_file_name(metadata_file_path):
+    """Study name and screen ID from a {study_name}_{screen}_{screen_id}.parquet file name"""
+    parsed_data_path = pathlib.Path(metadata_file_path).name.split(".")[0].split("_")
+
+    return parsed_data_path[0], parsed_data_path[-1]
 
 
 def get_unique_entries(metadata_df, attribute):
@@ -212,34 +285,607 @@ def stats_pipeline(attribute_elements):
     return s, h, nme, j, e, gc
 
 
-def collect_study_stats(
+def read_screen_table(metadata_file_path):
+    """Reads a per-screen metadata file as an Arrow table with Channels as strings"""
+    with instrumentation.stage("read"):
+        metadata_table = normalize_channels(pq.read_table(metadata_file_path))
+    instrumentation.count("files_read")
+    instrumentation.count("wells", metadata_table.num_rows)
+
+    return metadata_table
+
+
+def element_strings(values):
+    """Elements as strings, with missing values as 'None' as str() renders them"""
+    return pc.fill_null(pc.cast(values, pa.string()), "None")
+
+
+def screen_element_counts(metadata_file_path, na_cols, study_name, screen_id):
+    """Instance counts of the unique elements of each image attribute of a single file
+
+    See count_screen_elements()
+    """
+    return count_screen_elements(
+        read_screen_table(metadata_file_path),
+        na_cols=na_cols,
+        study_name=study_name,
+        screen_id=screen_id,
+    )
+
+
+def count_screen_elements(metadata_table, na_cols, study_name, screen_id):
+    """Instance counts of the unique elements of each image attribute as an Arrow table
+
+    Elements of an attribute are counted with pyarrow.compute.value_counts() and kept
+    in columns, so no Python object is created per element. Elements are cast to
+    strings, see element_strings().
+
+    Parameters
+    ----------
+    metadata_table: pyarrow.Table
+        Metadata of a screen, see read_screen_table()
+    na_cols: list
+        Image attributes excluded from statistical calculations
+    study_name: str
+        Study of the screen
+    screen_id: str
+        ID of the screen
+
+    Returns
+    -------
+    element_counts: pyarrow.Table
+        Rows of ELEMENT_COUNTS_SCHEMA with the elements of each attribute in one run
+    """
+    attribute_names = [
+        name for name in metadata_table.column_names if name not in na_cols
+    ]
+
+    elements = list()
+    counts = list()
+    with instrumentation.stage("count"):
+        for attribute in attribute_names:
+            value_counts = pc.value_counts(metadata_table.column(attribute))
+            elements.append(element_strings(value_counts.field("values")))
+            counts.append(value_counts.field("counts"))
+
+    n_rows = sum(len(attribute_counts) for attribute_counts in counts)
+    attribute_indices = np.repeat(
+        np.arange(len(attribute_names), dtype=np.int32),
+        [len(attribute_counts) for attribute_counts in counts],
+    )
+    constant_indices = pa.array(np.zeros(n_rows, dtype=np.int32))
+
+    return pa.Table.from_arrays(
+        [
+            pa.DictionaryArray.from_arrays(constant_indices, [study_name]),
+            pa.DictionaryArray.from_arrays(constant_indices, [str(screen_id)]),
+            pa.DictionaryArray.from_arrays(attribute_indices, attribute_names),
+            pa.concat_arrays(elements) if elements else pa.array([], pa.string()),
+            pa.concat_arrays(counts) if counts else pa.array([], pa.int64()),
+        ],
+        schema=ELEMENT_COUNTS_SCHEMA,
+    )
+
+
+def element_attribute_offsets(element_counts):
+    """Attributes of a screen's element counts and the start of each in its rows
+
+    Parameters
+    ----------
+    element_counts: pyarrow.Table
+        Output of count_screen_elements()
+
+    Returns
+    -------
+    attributes: list
+        Attribute names
+    offsets: numpy.ndarray
+        Start of each attribute's elements, followed by the number of rows
+    """
+    attribute_column = element_counts.column("Attribute").combine_chunks()
+    attributes = attribute_column.dictionary.to_pylist()
+    group_sizes = np.bincount(
+        attribute_column.indices.to_numpy(), minlength=len(attributes)
+    )
+
+    return attributes, ragged_offsets(group_sizes)
+
+
+def element_attribute_counts(element_counts):
+    """numpy.ndarray of element counts per attribute of count_screen_elements() output"""
+    attributes, offsets = element_attribute_offsets(element_counts)
+    counts = element_counts.column("Count").to_numpy()
+
+    return {
+        attribute: counts[offsets[index] : offsets[index + 1]]
+        for index, attribute in enumerate(attributes)
+    }
+
+
+def individual_study_stats(element_counts, matrices):
+    """Diversity statistics of each screen and attribute from the count matrices
+
+    The statistics of all screens are computed row-wise from the matrices of
+    utils.matrices.screen_element_matrices() and listed in the order of the screens
+    and attributes in element_counts.
+
+    Parameters
+    ----------
+    element_counts: pyarrow.Table
+        Concatenated output of count_screen_elements()
+    matrices: dict
+        Output of screen_element_matrices() for element_counts
+
+    Returns
+    -------
+    stats_df: pandas dataframe
+        Study_Name, Attribute, S, H, NME, J, E and GC per screen and attribute
+    """
+    with instrumentation.stage("stats"):
+        stats_df = matrix_stats(matrices)
+
+    screen_attributes = (
+        element_counts.select(["Screen", "Study", "Attribute"])
+        .unify_dictionaries()
+        .group_by(["Screen", "Study", "Attribute"], use_threads=False)
+        .aggregate([])
+        .to_pandas()
+        .astype(str)
+    )
+
+    return screen_attributes.merge(stats_df, on=["Screen", "Attribute"]).rename(
+        columns={"Study": "Study_Name"}
+    )[["Study_Name", "Attribute", *DIVERSITY_STATS]]
+
+
+def bootstrap_screen_stats(
+    attribute_counts, study_name, screen_id, n_replicates=200, confidence=0.95, seed=0
+):
+    """Bootstrap confidence intervals from the element counts of a screen
+
+    Parameters
+    ----------
+    attribute_counts: dict
+        numpy.ndarray of element counts per image attribute
+    study_name: str
+        Study of the screen
+    screen_id: str
+        ID of the screen
+    n_replicates: int
+        Number of multinomial bootstrap replicates per image attribute
+    confidence: float
+        Confidence level of the percentile intervals
+    seed: int
+        Seed combined with the screen ID, so that results do not depend on the
+        order in which screens are processed
+
+    Returns
+    -------
+    results_list: list
+        Study name, screen, attribute, statistic, point estimate and interval bounds
+    """
+    rng = np.random.default_rng([seed, int(screen_id)])
+
+    # Point estimates for all attributes of the file in one call
+    with instrumentation.stage("stats"):
+        estimates = grouped_diversity(
+            counts=np.concatenate(list(attribute_counts.values())),
+            offsets=ragged_offsets(
+                [len(counts) for counts in attribute_counts.values()]
+            ),
+        )
+
+    results_list = list()
+    for index, (attribute, counts) in enumerate(attribute_counts.items()):
+        with instrumentation.stage("bootstrap"):
+            replicates = bootstrap_diversity(
+                counts=counts, n_replicates=n_replicates, rng=rng
+            )
+
+        for stat in DIVERSITY_STATS:
+            results_list.append(
+                [
+                    study_name,
+                    screen_id,
+                    attribute,
+                    stat,
+                    estimates[stat][index],
+                    *confidence_interval(replicates[stat], confidence=confidence),
+                ]
+            )
+
+    return results_list
+
+
+def rarefy_screen_stats(attribute_counts, study_name, screen_id, depth):
+    """Rarefied richness and Shannon Index from the element counts of a screen
+
+    Parameters
+    ----------
+    attribute_counts: dict
+        numpy.ndarray of element counts per image attribute
+    study_name: str
+        Study of the screen
+    screen_id: str
+        ID of the screen
+    depth: int
+        Number of wells subsampled without replacement. Screens with fewer wells get NaN
+
+    Returns
+    -------
+    results_list: list
+        Study name, screen, attribute, depth, wells and rarefied S and H
+    """
+    results_list = list()
+    for attribute, counts in attribute_counts.items():
+        with instrumentation.stage("rarefaction"):
+            s = expected_richness(counts=counts, depth=depth)
+            h = expected_shannon(counts=counts, depth=depth)
+
+        results_list.append(
+            [study_name, screen_id, attribute, depth, int(counts.sum()), s, h]
+        )
+
+    return results_list
+
+
+def smallest_screen(metadata_files):
+    """Well count of the smallest screen, read from the Parquet footers"""
+    return min(
+        pq.ParquetFile(metadata_file).metadata.num_rows
+        for metadata_file in metadata_files
+    )
+
+
+def plate_element_counts(metadata_table, na_cols, plate_column="plate_id"):
+    """Instance counts of unique elements per image attribute and plate of a screen
+
+    Parameters
+    ----------
+    metadata_table: pyarrow.Table
+        Metadata of a screen, see read_screen_table()
+    na_cols: list
+        Image attributes excluded from statistical calculations
+    plate_column: str
+        Column identifying the plate of each well
+
+    Returns
+    -------
+    plate_counts: pyarrow.Table
+        Attribute, Plate, Element and Count per unique element, ordered by attribute
+        and plate so that the elements of each group are consecutive rows
+    """
+    attribute_names = [
+        name for name in metadata_table.column_names if name not in na_cols
+    ]
+    plates = pc.cast(metadata_table.column(plate_column), pa.string())
+
+    attribute_tables = list()
+    for attribute in attribute_names:
+        attribute_counts = (
+            pa.table(
+                {
+                    "Plate": plates,
+                    "Element": element_strings(metadata_table.column(attribute)),
+                }
+            )
+            .group_by(["Plate", "Element"])
+            .aggregate([([], "count_all")])
+            .sort_by([("Plate", "ascending"), ("Element", "ascending")])
+        )
+        attribute_tables.append(
+            pa.table(
+                {
+                    "Attribute": pa.array(
+                        [attribute] * attribute_counts.num_rows, pa.string()
+                    ).dictionary_encode(),
+                    "Plate": attribute_counts.column("Plate"),
+                    "Element": attribute_counts.column("Element"),
+                    "Count": attribute_counts.column("count_all"),
+                }
+            )
+        )
+
+    return pa.concat_tables(attribute_tables)
+
+
+def run_offsets(*key_arrays):
+    """Start of each run of equal keys in rows ordered by key, followed by the row count"""
+    n_rows = len(key_arrays[0])
+    changes = np.zeros(max(n_rows - 1, 0), dtype=bool)
+    for keys in key_arrays:
+        keys = np.asarray(keys)
+        changes |= keys[1:] != keys[:-1]
+
+    return np.concatenate([[0], np.flatnonzero(changes) + 1, [n_rows]]).astype(np.int64)
+
+
+def stats_frame(keys, counts, offsets):
+    """Diversity statistics per group of consecutive counts with the keys of each group"""
+    stats = grouped_diversity(counts=counts, offsets=offsets)
+    stats_df = pd.DataFrame(keys)
+    for stat in DIVERSITY_STATS:
+        stats_df[stat] = stats[stat]
+
+    return stats_df
+
+
+def screen_hierarchy_stats(
+    metadata_table, element_counts, na_cols, plate_column="plate_id"
+):
+    """Plate and screen level diversity statistics of a single screen
+
+    Parameters
+    ----------
+    metadata_table: pyarrow.Table
+        Metadata of a screen, see read_screen_table()
+    element_counts: pyarrow.Table
+        Element counts of the screen, see count_screen_elements()
+    na_cols: list
+        Image attributes excluded from statistical calculations. Must contain plate_column
+    plate_column: str
+        Column identifying the plate of each well
+
+    Returns
+    -------
+    stats_df: pandas dataframe
+        Level, Study_Name, Screen, Plate, Attribute and statistics per group
+    """
+    study_name = element_counts.column("Study").combine_chunks().dictionary[0].as_py()
+    screen_id = element_counts.column("Screen").combine_chunks().dictionary[0].as_py()
+
+    with instrumentation.stage("count"):
+        plate_counts = plate_element_counts(
+            metadata_table, na_cols=na_cols, plate_column=plate_column
+        )
+
+    with instrumentation.stage("stats"):
+        attribute_names = pc.cast(plate_counts.column("Attribute"), pa.string())
+        plate_names = plate_counts.column("Plate").to_numpy()
+        offsets = run_offsets(attribute_names.to_numpy(), plate_names)
+        plate_stats = stats_frame(
+            {
+                "Level": "plate",
+                "Study_Name": study_name,
+                "Screen": screen_id,
+                "Plate": plate_names[offsets[:-1]],
+                "Attribute": attribute_names.to_numpy()[offsets[:-1]],
+            },
+            counts=plate_counts.column("Count").to_numpy(),
+            offsets=offsets,
+        )
+
+        attributes, offsets = element_attribute_offsets(element_counts)
+        screen_stats = stats_frame(
+            {
+                "Level": "screen",
+                "Study_Name": study_name,
+                "Screen": screen_id,
+                "Plate": "",
+                "Attribute": attributes,
+            },
+            counts=element_counts.column("Count").to_numpy(),
+            offsets=offsets,
+        )
+
+    return pd.concat([plate_stats, screen_stats], ignore_index=True)
+
+
+def rollup_stats(element_counts, level):
+    """Diversity statistics of study or databank groups from screen element counts
+
+    Parameters
+    ----------
+    element_counts: pyarrow.Table
+        Concatenated output of count_screen_elements() for all screens
+    level: str
+        study or databank
+
+    Returns
+    -------
+    stats_df: pandas dataframe
+        Level, Study_Name, Screen, Plate, Attribute and statistics per group
+    """
+    keys = ["Study", "Attribute"] if level == "study" else ["Attribute"]
+    merged_counts = (
+        pa.table(
+            {
+                **{
+                    key: pc.cast(element_counts.column(key), pa.string())
+                    for key in keys
+                },
+                "Element": element_counts.column("Element"),
+                "Count": element_counts.column("Count"),
+            }
+        )
+        .group_by(keys + ["Element"])
+        .aggregate([("Count", "sum")])
+        .sort_by([(key, "ascending") for key in keys + ["Element"]])
+    )
+
+    key_values = {key: merged_counts.column(key).to_numpy() for key in keys}
+    offsets = run_offsets(*key_values.values())
+    return stats_frame(
+        {
+            "Level": level,
+            "Study_Name": key_values["Study"][offsets[:-1]] if level == "study" else "",
+            "Screen": "",
+            "Plate": "",
+            "Attribute": key_values["Attribute"][offsets[:-1]],
+        },
+        counts=merged_counts.column("Count_sum").to_numpy(),
+        offsets=offsets,
+    )
+
+
+def databank_stats(element_counts, hierarchical_df=None):
+    """Databank statistics per attribute merged from the screen element counts
+
+    Parameters
+    ----------
+    element_counts: pyarrow.Table
+        Concatenated output of count_screen_elements() for all screens
+    hierarchical_df: pandas dataframe
+        Output of hierarchical_stats(), whose databank rows are reused if given
+
+    Returns
+    -------
+    stat_results_df: pandas dataframe
+        Attribute, S, H, NME, J, E and GC across the databank sorted by Attribute
+    """
+    if hierarchical_df is None:
+        with instrumentation.stage("stats"):
+            stat_results_df = rollup_stats(element_counts, level="databank")
+    else:
+        stat_results_df = hierarchical_df[hierarchical_df["Level"] == "databank"]
+
+    return stat_results_df[["Attribute", *DIVERSITY_STATS]].reset_index(drop=True)
+
+
+def hierarchical_stats(screen_stats, element_counts):
+    """Combines per-screen plate and screen level statistics with study and databank
+    level statistics
+
+    Parameters
+    ----------
+    screen_stats: list
+        Output of screen_hierarchy_stats() per screen
+    element_counts: pyarrow.Table
+        Concatenated output of count_screen_elements() for all screens
+
+    Returns
+    -------
+    hierarchical_df: pandas dataframe
+        Level, Study_Name, Screen, Plate, Attribute and statistics per group, ordered
+        by level from plate to databank and by group keys within a level. Keys that do
+        not apply to a level are empty
+    """
+    with instrumentation.stage("stats"):
+        hierarchical_df = pd.concat(
+            [
+                *screen_stats,
+                rollup_stats(element_counts, level="study"),
+                rollup_stats(element_counts, level="databank"),
+            ],
+            ignore_index=True,
+        )
+
+    hierarchical_df["Level"] = pd.Categorical(
+        hierarchical_df["Level"], categories=list(HIERARCHY_LEVELS), ordered=True
+    )
+    hierarchical_df = hierarchical_df.sort_values(
+        ["Level", *HIERARCHY_LEVELS["plate"], "Attribute"], kind="stable"
+    ).reset_index(drop=True)
+    hierarchical_df["Level"] = hierarchical_df["Level"].astype(str)
+
+    return hierarchical_df[
+        ["Level", *HIERARCHY_LEVELS["plate"], "Attribute", *DIVERSITY_STATS]
+    ]
+
+
+def screen_statistics(
     metadata_file_path,
-    results_list,
     na_cols,
-    study_name,
-    screen_id,
+    plate_column="plate_id",
+    rarefaction_depth=None,
+    n_replicates=0,
+    confidence=0.95,
+    seed=0,
 ):
-    """Collecting statistics within a single file
+    """Every per-screen statistic of 1.compute_statistics.py from one read of a file
 
     Parameters
     ----------
     metadata_file_path: PosixPath object
         Path to single study .parquet metadata file
-    results_list: list
-        Outside instantiated list to append study statistics
+    na_cols: list
+        Image attributes excluded from statistical calculations. Must contain plate_column
+    plate_column: str
+        Column identifying the plate of each well, or None to skip the plate and
+        screen level statistics
+    rarefaction_depth: int
+        Common subsample depth in wells, or None to skip rarefaction
+    n_replicates: int
+        Bootstrap replicates per image attribute, 0 skips the bootstrap
+    confidence: float
+        Confidence level of the bootstrap intervals
+    seed: int
+        Base seed of the bootstrap
+
+    Returns
+    -------
+    dict
+        element_counts (pyarrow.Table), hierarchy_stats (pandas dataframe or
+        None), rarefied and bootstrap (lists of rows)
+    """
+    study_name, screen_id = parse_metadata_file_name(metadata_file_path)
+    metadata_table = read_screen_table(metadata_file_path)
+    with instrumentation.stage("count"):
+        element_counts = count_screen_elements(
+            metadata_table, na_cols=na_cols, study_name=study_name, screen_id=screen_id
+        )
+
+    results = {
+        "element_counts": element_counts,
+        "hierarchy_stats": None,
+        "rarefied": list(),
+        "bootstrap": list(),
+    }
+    if plate_column is not None:
+        results["hierarchy_stats"] = screen_hierarchy_stats(
+            metadata_table, element_counts, na_cols=na_cols, plate_column=plate_column
+        )
+
+    attribute_counts = element_attribute_counts(element_counts)
+    if rarefaction_depth is not None:
+        results["rarefied"] = rarefy_screen_stats(
+            attribute_counts,
+            study_name=study_name,
+            screen_id=screen_id,
+            depth=rarefaction_depth,
+        )
+    if n_replicates > 0:
+        with instrumentation.stage("bootstrap_studies"):
+            results["bootstrap"] = bootstrap_screen_stats(
+                attribute_counts,
+                study_name=study_name,
+                screen_id=screen_id,
+                n_replicates=n_replicates,
+                confidence=confidence,
+                seed=seed,
+            )
+
+    return results
+
+
+def count_databank_elements(metadata_directory, na_cols):
+    """Counts unique elements per image attribute across a databank held in memory
+
+    Parameters
+    ----------
+    metadata_directory: PosixPath object
+        Path to the metadata directory containing subdirectories for studies and screens
     na_cols: list
         Image attributes excluded from statistical calculations
 
     Returns
     -------
-    results_list: list
-        The input results list appended with statistics from the metadata_file_path study
+    databank_elements: dict
+        Unique entries and counts (dict) per image attribute
     """
-    # Read parquet into pandas df
-    metadata_df = pd.read_parquet(metadata_file_path)
+    # Open and concatenate study metadata dataframes from .parquet files
+    with instrumentation.stage("read"):
+        databank_metadata = pd.concat(
+            [
+                read_metadata(study_metadata_file)
+                for study_metadata_file in walk(
+                    metadata_directory, extensions=".parquet"
+                )
+            ]
+        )
 
-    # Extract metadata from file name and dataframe
-    attribute_names = metadata_df.columns.to_list()
+    # Get image_attribute names
+    attribute_names = databank_metadata.columns.to_list()
 
     # Remove irrelevant attributes
     for attribute in na_cols:
@@ -248,27 +894,428 @@ def collect_study_stats(
         else:
             pass
 
-    attribute_elements_all = dict()
-    # Get unique entries for each attribute
+    databank_elements = dict()
     for attribute in attribute_names:
-        attribute_elements = get_unique_entries(
-            metadata_df=metadata_df, attribute=attribute
+        with instrumentation.stage("count"):
+            databank_elements[attribute] = get_unique_entries(
+                metadata_df=databank_metadata, attribute=attribute
+            )
+
+    return databank_elements
+
+
+def stream_databank_elements(metadata_directory, na_cols, batch_size=65_536):
+    """Counts unique elements per image attribute by streaming record batches
+
+    Only one record batch and the running count tables are held in memory, so memory
+    is bounded by the number of unique elements rather than the number of rows.
+
+    Parameters
+    ----------
+    metadata_directory: PosixPath object
+        Path to the metadata directory containing subdirectories for studies and screens
+    na_cols: list
+        Image attributes excluded from statistical calculations
+    batch_size: int
+        Maximum number of rows per record batch
+
+    Returns
+    -------
+    databank_elements: dict
+        Unique entries and counts (dict) per image attribute
+    """
+    databank_elements = dict()
+    for study_metadata_file in walk(metadata_directory, extensions=".parquet"):
+        metadata_file = pq.ParquetFile(study_metadata_file)
+        attribute_names = [
+            name for name in metadata_file.schema_arrow.names if name not in na_cols
+        ]
+        instrumentation.count("files_read")
+
+        for batch in metadata_file.iter_batches(
+            batch_size=batch_size, columns=attribute_names
+        ):
+            batch = normalize_channels(batch)
+            instrumentation.count("wells", batch.num_rows)
+            with instrumentation.stage("count"):
+                for attribute in attribute_names:
+                    attribute_elements = databank_elements.setdefault(
+                        attribute, collections.Counter()
+                    )
+                    value_counts = pc.value_counts(batch.column(attribute))
+                    attribute_elements.update(
+                        dict(
+                            zip(
+                                value_counts.field("values").to_pylist(),
+                                value_counts.field("counts").to_pylist(),
+                            )
+                        )
+                    )
+
+    return databank_elements
+
+
+def sketch_screen(
+    study_metadata_file,
+    na_cols,
+    batch_size=65_536,
+    precision=DEFAULT_PRECISION,
+    top_k=DEFAULT_TOP_K,
+):
+    """Builds constant memory sketches per image attribute of a single screen
+
+    Parameters
+    ----------
+    study_metadata_file: PosixPath object
+        Path to single screen .parquet metadata file
+    na_cols: list
+        Image attributes excluded from statistical calculations
+    batch_size: int
+        Maximum number of rows per record batch
+    precision: int
+        HyperLogLog precision
+    top_k: int
+        Number of heavy hitters tracked per attribute
+
+    Returns
+    -------
+    screen_sketches: dict
+        utils.sketches.AttributeSketch per image attribute
+    """
+    metadata_file = pq.ParquetFile(study_metadata_file)
+    attribute_names = [
+        name for name in metadata_file.schema_arrow.names if name not in na_cols
+    ]
+
+    screen_sketches = {
+        attribute: AttributeSketch(precision=precision, k=top_k)
+        for attribute in attribute_names
+    }
+    for batch in metadata_file.iter_batches(
+        batch_size=batch_size, columns=attribute_names
+    ):
+        batch = normalize_channels(batch)
+        for attribute in attribute_names:
+            value_counts = pc.value_counts(batch.column(attribute))
+            screen_sketches[attribute].update(
+                values=value_counts.field("values").to_pylist(),
+                counts=value_counts.field("counts").to_numpy(),
+            )
+
+    return screen_sketches
+
+
+def sketch_databank(
+    metadata_directory,
+    na_cols,
+    batch_size=65_536,
+    precision=DEFAULT_PRECISION,
+    top_k=DEFAULT_TOP_K,
+    processes=1,
+):
+    """Sketches every screen, in parallel if requested, and merges the sketches
+
+    Parameters
+    ----------
+    metadata_directory: PosixPath object
+        Path to the metadata directory containing subdirectories for studies and screens
+    na_cols: list
+        Image attributes excluded from statistical calculations
+    batch_size: int
+        Maximum number of rows per record batch
+    precision: int
+        HyperLogLog precision
+    top_k: int
+        Number of heavy hitters tracked per attribute
+    processes: int
+        Number of worker processes sketching screens
+
+    Returns
+    -------
+    databank_sketches: dict
+        Merged utils.sketches.AttributeSketch per image attribute
+    """
+    sketch = functools.partial(
+        sketch_screen,
+        na_cols=na_cols,
+        batch_size=batch_size,
+        precision=precision,
+        top_k=top_k,
+    )
+    metadata_files = list(walk(metadata_directory, extensions=".parquet"))
+    instrumentation.count("files_read", len(metadata_files))
+
+    databank_sketches = dict()
+    with instrumentation.stage("count"):
+        if processes > 1:
+            with multiprocessing.Pool(processes=processes) as pool:
+                screens_sketches = pool.imap(sketch, metadata_files)
+                for screen_sketches in screens_sketches:
+                    merge_sketches(databank_sketches, screen_sketches)
+        else:
+            for metadata_file in metadata_files:
+                merge_sketches(databank_sketches, sketch(metadata_file))
+
+    return databank_sketches
+
+
+def merge_sketches(databank_sketches, screen_sketches):
+    """Merges the attribute sketches of a screen into the databank sketches"""
+    for attribute, attribute_sketch in screen_sketches.items():
+        if attribute in databank_sketches:
+            databank_sketches[attribute].merge(attribute_sketch)
+        else:
+            databank_sketches[attribute] = attribute_sketch
+
+    return databank_sketches
+
+
+def load_databank_state(state_dir, na_cols):
+    """Manifest of the screens and count tables of a databank state
+
+    A state counted with other excluded attributes, or saved by an older version, is
+    discarded. Files that the manifest does not reference, e.g. left behind by an
+    interrupted update, are deleted.
+
+    Parameters
+    ----------
+    state_dir: str or pathlib.Path
+        Directory holding the databank count tables, see update_databank_state()
+    na_cols: list
+        Image attributes excluded from statistical calculations
+
+    Returns
+    -------
+    state: dict
+        {"na_cols": sorted na_cols, "generation": number of the last update,
+        "screens": {metadata file: fingerprint}, "screen_files": {metadata file:
+        file name}, "count_files": {attribute: file name}, "stats_file": file name}
+    """
+    state_file = pathlib.Path(state_dir, "state.json")
+    if state_file.exists():
+        with open(state_file) as file:
+            state = json.load(file)
+        if state["na_cols"] == sorted(na_cols) and "generation" in state:
+            referenced_files = {
+                "screens": set(state["screen_files"].values()),
+                "counts": set(state["count_files"].values()),
+            }
+            for subdirectory, file_names in referenced_files.items():
+                directory = pathlib.Path(state_dir, subdirectory)
+                if not directory.exists():
+                    continue
+                for entry in os.scandir(directory):
+                    if entry.name not in file_names:
+                        os.unlink(entry.path)
+            for stats_file in pathlib.Path(state_dir).glob("stats*.parquet"):
+                if stats_file.name != state["stats_file"]:
+                    stats_file.unlink()
+
+            return state
+
+    for subdirectory in ["counts", "screens"]:
+        shutil.rmtree(pathlib.Path(state_dir, subdirectory), ignore_errors=True)
+    for stats_file in pathlib.Path(state_dir).glob("stats*.parquet"):
+        stats_file.unlink()
+
+    return {
+        "na_cols": sorted(na_cols),
+        "generation": 0,
+        "screens": dict(),
+        "screen_files": dict(),
+        "count_files": dict(),
+        "stats_file": None,
+    }
+
+
+def update_databank_state(metadata_directory, na_cols, state_dir):
+    """Updates persisted databank count tables with the screens that changed
+
+    The state directory holds
+
+        counts/{attribute}.{generation}.parquet: Element and Count across the databank
+        screens/{screen_id}.{generation}.parquet: element counts a screen
+            contributed, see screen_element_counts()
+        stats.{generation}.parquet: databank statistics per attribute
+        state.json: path, modification time and size of each counted metadata file
+            and the names of the current files
+
+    Counts of removed and modified screens are subtracted and counts of new and
+    modified screens are added. Only the count tables and statistics of attributes
+    touched by these screens are read and recomputed, so an update costs time in
+    proportion to the change. Delete the directory to recount from scratch.
+
+    Files of an update are written under names of its generation, and state.json is
+    replaced atomically once they are complete. The files it supersedes are deleted
+    afterwards, so an interrupted update leaves the previous state intact.
+
+    Parameters
+    ----------
+    metadata_directory: PosixPath object
+        Path to the metadata directory containing subdirectories for studies and screens
+    na_cols: list
+        Image attributes excluded from statistical calculations
+    state_dir: str or pathlib.Path
+        Directory holding the databank count tables
+
+    Returns
+    -------
+    stat_results_df: pandas dataframe
+        Attribute, S, H, NME, J, E and GC across the databank sorted by Attribute.
+        NME and J are None for attributes with a single element, as in
+        stats_pipeline()
+    """
+    state = load_databank_state(state_dir, na_cols)
+    counts_dir = pathlib.Path(state_dir, "counts")
+    screens_dir = pathlib.Path(state_dir, "screens")
+    pathlib.Path.mkdir(counts_dir, exist_ok=True, parents=True)
+    pathlib.Path.mkdir(screens_dir, exist_ok=True)
+
+    generation = state["generation"] + 1
+    # Files superseded by this update, deleted once state.json refers to its files
+    stale_files = list()
+
+    metadata_directory = pathlib.Path(metadata_directory).resolve()
+    current_screens = dict()
+    for metadata_file in walk(metadata_directory, extensions=".parquet"):
+        stat = os.stat(metadata_file)
+        current_screens[str(metadata_file.relative_to(metadata_directory))] = {
+            "screen_id": parse_metadata_file_name(metadata_file)[1],
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+
+    # Counts to subtract for removed and modified screens, and to add for new ones
+    deltas = list()
+    for name, screen in list(state["screens"].items()):
+        if current_screens.get(name) == screen:
+            continue
+        screen_file = pathlib.Path(screens_dir, state["screen_files"].pop(name))
+        screen_counts = pd.read_parquet(
+            screen_file, columns=["Attribute", "Element", "Count"]
         )
+        screen_counts["Count"] = -screen_counts["Count"]
+        deltas.append(screen_counts)
+        stale_files.append(screen_file)
+        del state["screens"][name]
+        instrumentation.count("screens_subtracted")
 
-        # Collect statistics for each attribute
-        s, h, nme, j, e, gc = stats_pipeline(attribute_elements=attribute_elements)
+    for name, screen in current_screens.items():
+        if name in state["screens"]:
+            continue
+        study_name, screen_id = parse_metadata_file_name(name)
+        element_counts = screen_element_counts(
+            pathlib.Path(metadata_directory, name),
+            na_cols=na_cols,
+            study_name=study_name,
+            screen_id=screen_id,
+        )
+        screen_file_name = f"{screen['screen_id']}.{generation}.parquet"
+        pq.write_table(element_counts, pathlib.Path(screens_dir, screen_file_name))
+        deltas.append(
+            element_counts.select(["Attribute", "Element", "Count"]).to_pandas()
+        )
+        state["screens"][name] = screen
+        state["screen_files"][name] = screen_file_name
+        instrumentation.count("screens_added")
 
-        # Append stats to attribute_results
-        results_list.append([study_name, attribute, s, h, nme, j, e, gc])
+    if state["stats_file"] is not None:
+        stat_results_df = (
+            pd.read_parquet(pathlib.Path(state_dir, state["stats_file"]))
+            .set_index("Attribute")
+            .astype("float64")
+        )
+    else:
+        stat_results_df = pd.DataFrame(
+            columns=DIVERSITY_STATS, index=pd.Index(list(), name="Attribute")
+        )
+
+    if deltas:
+        delta_df = pd.concat(deltas, ignore_index=True)
+        delta_df["Attribute"] = delta_df["Attribute"].astype(str)
+        for attribute, attribute_df in delta_df.groupby("Attribute", sort=False):
+            # A replaced screen leaves attributes whose counts it did not change as is
+            attribute_delta = attribute_df.groupby("Element")["Count"].sum()
+            attribute_delta = attribute_delta[attribute_delta != 0]
+            if attribute_delta.empty:
+                continue
+
+            counts_file_name = state["count_files"].pop(attribute, None)
+            if counts_file_name is not None:
+                counts_file = pathlib.Path(counts_dir, counts_file_name)
+                counts = pd.read_parquet(counts_file).set_index("Element")["Count"]
+                stale_files.append(counts_file)
+            else:
+                counts = pd.Series(
+                    dtype="int64", index=pd.Index(list(), name="Element")
+                )
+
+            with instrumentation.stage("count"):
+                counts = counts.add(attribute_delta, fill_value=0).astype("int64")
+                counts = counts[counts > 0]
+
+            if counts.empty:
+                stat_results_df = stat_results_df.drop(index=attribute, errors="ignore")
+                continue
+            counts_file_name = attribute_file_name(
+                attribute, extension=f".{generation}.parquet"
+            )
+            counts.rename("Count").rename_axis("Element").reset_index().to_parquet(
+                pathlib.Path(counts_dir, counts_file_name)
+            )
+            state["count_files"][attribute] = counts_file_name
+
+            with instrumentation.stage("stats"):
+                stats = grouped_diversity(
+                    counts=counts.to_numpy(), offsets=ragged_offsets([len(counts)])
+                )
+            stat_results_df.loc[attribute, DIVERSITY_STATS] = [
+                stats[stat][0] for stat in DIVERSITY_STATS
+            ]
+            instrumentation.count("attributes_updated")
+
+    stat_results_df = (
+        stat_results_df.sort_index()
+        .astype(
+            {stat: "int64" if stat == "S" else "float64" for stat in DIVERSITY_STATS}
+        )
+        .reset_index()
+    )
+    # Evenness is undefined for a single element, None as in stats_pipeline()
+    for stat in ["NME", "J"]:
+        stat_results_df[stat] = (
+            stat_results_df[stat].astype(object).where(stat_results_df["S"] != 1, None)
+        )
 
-        attribute_elements_all[attribute] = attribute_elements
+    stats_file_name = f"stats.{generation}.parquet"
+    stat_results_df.to_parquet(pathlib.Path(state_dir, stats_file_name))
+    if state["stats_file"] is not None:
+        stale_files.append(pathlib.Path(state_dir, state["stats_file"]))
+    state["stats_file"] = stats_file_name
+    state["generation"] = generation
 
-    final_dict = {screen_id: attribute_elements_all}
+    state_file = pathlib.Path(state_dir, "state.json")
+    partial_file = pathlib.Path(state_dir, ".state.json.partial")
+    with open(partial_file, "w") as file:
+        json.dump(state, file)
+    os.replace(partial_file, state_file)
 
-    return results_list, final_dict
+    for stale_file in stale_files:
+        stale_file.unlink(missing_ok=True)
 
+    return stat_results_df
 
-def collect_databank_stats(metadata_directory, na_cols):
+
+def collect_databank_stats(
+    metadata_directory,
+    na_cols,
+    mode="in_memory",
+    batch_size=65_536,
+    precision=DEFAULT_PRECISION,
+    top_k=DEFAULT_TOP_K,
+    processes=1,
+    state_dir=None,
+):
     """Statistics pipeline for computation across a databank
 
     Parameters
@@ -277,39 +1324,80 @@ def collect_databank_stats(metadata_directory, na_cols):
         Path to the metadata directory containing subdirectories for studies and screens
     na_cols: list
         Image attributes excluded from statistical calculations
+    mode: str
+        in_memory concatenates every screen's dataframe before counting, streaming
+        updates running count tables from record batches of each file and sketch
+        estimates the statistics from mergeable constant memory sketches. incremental
+        updates count tables persisted in state_dir with the screens that changed
+    batch_size: int
+        Maximum number of rows per record batch in streaming and sketch mode
+    precision: int
+        HyperLogLog precision in sketch mode
+    top_k: int
+        Number of heavy hitters tracked per attribute in sketch mode
+    processes: int
+        Number of worker processes sketching screens in sketch mode
+    state_dir: str or pathlib.Path
+        Directory holding the databank count tables in incremental mode, see
+        update_databank_state()
 
     Returns
     -------
     stat_results_df: pandas dataframe
         Contains all statistics for each image attribute not in na_cols calculated across all studies
+        In sketch mode the error bounds described in utils.sketches.sketch_stats() are added
     """
-    # Open and concatenate study metadata dataframes from .parquet files
-    databank_metadata = pd.concat(
-        [
-            pd.read_parquet(study_metadata_file)
-            for study_metadata_file in walk(metadata_directory)
-        ]
-    )
+    if mode == "sketch":
+        databank_sketches = sketch_databank(
+            metadata_directory=metadata_directory,
+            na_cols=na_cols,
+            batch_size=batch_size,
+            precision=precision,
+            top_k=top_k,
+            processes=processes,
+        )
 
-    # Get image_attribute names
-    attribute_names = databank_metadata.columns.to_list()
+        stat_results_list = list()
+        for attribute, attribute_sketch in databank_sketches.items():
+            with instrumentation.stage("stats"):
+                stat_results_list.append([attribute, *sketch_stats(attribute_sketch)])
 
-    # Remove irrelevant attributes
-    for attribute in na_cols:
-        if attribute in attribute_names:
-            attribute_names.remove(attribute)
-        else:
-            pass
+        return pd.DataFrame(
+            data=stat_results_list,
+            columns=["Attribute", "S", "H", "NME", "J", "E", "GC"]
+            + SKETCH_STAT_COLUMNS,
+        )
 
-    stat_results_list = list()
-    # Collect statistics for each attribute
-    for attribute in attribute_names:
-        attribute_elements = get_unique_entries(
-            metadata_df=databank_metadata, attribute=attribute
+    if mode == "incremental":
+        if state_dir is None:
+            raise ValueError("Incremental databank statistics require a state_dir")
+
+        return update_databank_state(
+            metadata_directory=metadata_directory,
+            na_cols=na_cols,
+            state_dir=state_dir,
+        )
+
+    if mode == "streaming":
+        databank_elements = stream_databank_elements(
+            metadata_directory=metadata_directory,
+            na_cols=na_cols,
+            batch_size=batch_size,
+        )
+    elif mode == "in_memory":
+        databank_elements = count_databank_elements(
+            metadata_directory=metadata_directory, na_cols=na_cols
         )
+    else:
+        raise ValueError(f"Unknown databank statistics mode {mode}")
 
-        # Collect statistics for each attribute
-        s, h, nme, j, e, gc = stats_pipeline(attribute_elements=attribute_elements)
+    stat_results_list = list()
+    # Collect statistics for each attribute
+    for attribute, attribute_elements in databank_elements.items():
+        with instrumentation.stage("stats"):
+            s, h, nme, j, e, gc = stats_pipeline(
+                attribute_elements=dict(attribute_elements)
+            )
 
         # Append stats to attribute_results
         stat_results_list.append([attribute, s, h, nme, j, e, gc])
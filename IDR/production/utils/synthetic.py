@@ -0,0 +1,827 @@
+import json
+import math
+import pathlib
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+from metadata_extraction.extraction_utils.schema import write_metadata
+
+# Layout of the synthetic databank. IDs are derived arithmetically so that any
+# screen, plate or well can be generated on demand without holding the databank in memory.
+SCREEN_ID_OFFSET = 1
+PLATE_ID_OFFSET = 1_000_000
+WELL_ID_OFFSET = 100_000_000
+GRID_COLUMNS = 24
+
+# Attributes that are constant within a screen and attributes that vary per well
+SCREEN_LEVEL_ATTRIBUTES = ["Organism", "Cell Line", "Strain", "Channels"]
+WELL_LEVEL_ATTRIBUTES = [
+    "Gene Identifier",
+    "Gene Symbol",
+    "Phenotype",
+    "Phenotype Term Name",
+    "Compound Name",
+    "siRNA Identifier",
+]
+
+# Number of unique elements per attribute pool
+DEFAULT_POOL_SIZES = {
+    "Organism": 10,
+    "Cell Line": 160,
+    "Strain": 4_500,
+    "Channels": 45,
+    "Gene Identifier": 54_000,
+    "Gene Symbol": 36_000,
+    "Phenotype": 180,
+    "Phenotype Term Name": 110,
+    "Compound Name": 35_000,
+    "siRNA Identifier": 79_000,
+}
+
+IMAGING_METHODS = [
+    "fluorescence microscopy",
+    "spinning disk confocal microscopy",
+    "confocal microscopy",
+    "bright-field microscopy",
+    "phase contrast microscopy",
+]
+
+
+def zipf_cum_weights(pool_size, exponent=1.0):
+    """Cumulative Zipf weights for drawing ranked elements with random.choices()
+
+    Parameters
+    ----------
+    pool_size: int
+        Number of unique elements in the pool
+    exponent: float
+        Zipf exponent. Larger values concentrate draws on the top ranked elements
+
+    Returns
+    -------
+    cum_weights: list
+        Cumulative weights for ranks 1..pool_size
+    """
+    cum_weights = list()
+    total = 0.0
+    for rank in range(1, pool_size + 1):
+        total += 1.0 / rank**exponent
+        cum_weights.append(total)
+
+    return cum_weights
+
+
+def element_name(attribute, rank):
+    """Deterministic element name for a ranked element of an image attribute
+
+    Parameters
+    ----------
+    attribute: str
+        Image attribute name
+    rank: int
+        Rank of the element within the attribute pool (0 is the most common)
+
+    Returns
+    -------
+    str
+        Synthetic element value
+    """
+    if attribute == "Channels":
+        return f"stain{rank}:target{rank};dapi:dna"
+    if attribute == "Gene Identifier":
+        return f"ENSG{rank:011d}"
+    if attribute == "siRNA Identifier":
+        return f"{100000 + rank}"
+
+    prefix = attribute.lower().replace(" ", "_")
+    return f"{prefix}_{rank}"
+
+
+class SyntheticLayout:
+    """Deterministic screen/plate/well layout of a synthetic IDR databank
+
+    Parameters
+    ----------
+    n_screens: int
+        Number of screens in the databank
+    plates_per_screen: int
+        Number of plates in each screen
+    wells_per_plate: int
+        Number of wells in each plate
+    seed: int
+        Seed for the element draws
+    pool_sizes: dict
+        Unique elements per attribute. Defaults to DEFAULT_POOL_SIZES
+    zipf_exponents: dict
+        Zipf exponent per attribute. Attributes not listed use 1.0
+    element_names: dict
+        Real element names per attribute, ordered by rank. Ranks beyond the listed
+        names fall back to element_name()
+    """
+
+    def __init__(
+        self,
+        n_screens=3,
+        plates_per_screen=2,
+        wells_per_plate=96,
+        seed=0,
+        pool_sizes=None,
+        zipf_exponents=None,
+        element_names=None,
+    ):
+        self.n_screens = n_screens
+        self.plates_per_screen = plates_per_screen
+        self.wells_per_plate = wells_per_plate
+        self.seed = seed
+        self.pool_sizes = dict(DEFAULT_POOL_SIZES, **(pool_sizes or dict()))
+        self.element_names = element_names or dict()
+        zipf_exponents = zipf_exponents or dict()
+        self.cum_weights = {
+            attribute: zipf_cum_weights(
+                pool_size=pool_size, exponent=zipf_exponents.get(attribute, 1.0)
+            )
+            for attribute, pool_size in self.pool_sizes.items()
+        }
+
+    # IDs
+    def screen_ids(self):
+        return [SCREEN_ID_OFFSET + index for index in range(self.n_screens)]
+
+    def plate_ids(self, screen_id):
+        screen_index = screen_id - SCREEN_ID_OFFSET
+        first_plate = PLATE_ID_OFFSET + screen_index * self.plates_per_screen
+        return list(range(first_plate, first_plate + self.plates_per_screen))
+
+    def well_ids(self, plate_id):
+        plate_index = plate_id - PLATE_ID_OFFSET
+        first_well = WELL_ID_OFFSET + plate_index * self.wells_per_plate
+        return list(range(first_well, first_well + self.wells_per_plate))
+
+    def screen_of_plate(self, plate_id):
+        return SCREEN_ID_OFFSET + (plate_id - PLATE_ID_OFFSET) // self.plates_per_screen
+
+    def plate_of_well(self, well_id):
+        return PLATE_ID_OFFSET + (well_id - WELL_ID_OFFSET) // self.wells_per_plate
+
+    def has_screen(self, screen_id):
+        return 0 <= screen_id - SCREEN_ID_OFFSET < self.n_screens
+
+    def has_plate(self, plate_id):
+        return self.has_screen(self.screen_of_plate(plate_id)) and (
+            plate_id >= PLATE_ID_OFFSET
+        )
+
+    def has_well(self, well_id):
+        return well_id >= WELL_ID_OFFSET and self.has_plate(self.plate_of_well(well_id))
+
+    # Names
+    def study_name(self, screen_id):
+        return f"idr{screen_id:04d}-synthetic-screen"
+
+    def idr_name(self, screen_id):
+        return f"{self.study_name(screen_id)}/screenA"
+
+    def plate_name(self, plate_id):
+        return f"plate_{plate_id}"
+
+    @staticmethod
+    def well_position(index):
+        row = chr(ord("A") + index // GRID_COLUMNS)
+        return f"{row}{index % GRID_COLUMNS + 1}"
+
+    # Element draws
+    def draw(self, attribute, key):
+        """Draw a Zipf distributed element of an attribute for a screen or well key"""
+        # Seeding with a string is stable across processes, unlike hash()
+        rng = random.Random(f"{self.seed}:{attribute}:{key}")
+        rank = rng.choices(
+            range(self.pool_sizes[attribute]), cum_weights=self.cum_weights[attribute]
+        )[0]
+        return self.element(attribute=attribute, rank=rank)
+
+    def element(self, attribute, rank):
+        names = self.element_names.get(attribute, list())
+        if rank < len(names):
+            return names[rank]
+
+        return element_name(attribute=attribute, rank=rank)
+
+    def imaging_method(self, screen_id):
+        return IMAGING_METHODS[screen_id % len(IMAGING_METHODS)]
+
+    def well_attributes(self, well_id):
+        """Image attribute values for a single well
+
+        Parameters
+        ----------
+        well_id: int
+            Synthetic well ID
+
+        Returns
+        -------
+        attributes: dict
+            Image attribute name as key and element as value
+        """
+        screen_id = self.screen_of_plate(self.plate_of_well(well_id))
+        attributes = {
+            attribute: self.draw(attribute=attribute, key=("screen", screen_id))
+            for attribute in SCREEN_LEVEL_ATTRIBUTES
+        }
+        for attribute in WELL_LEVEL_ATTRIBUTES:
+            attributes[attribute] = self.draw(
+                attribute=attribute, key=("well", well_id)
+            )
+
+        return attributes
+
+
+def well_annotations(layout, well_id):
+    """Build an IDR style map annotation response for a synthetic well
+
+    Parameters
+    ----------
+    layout: SyntheticLayout
+        Synthetic databank layout
+    well_id: int
+        Synthetic well ID
+
+    Returns
+    -------
+    dict
+        Response body of webclient/api/annotations/?type=map&well={well_id}
+    """
+    plate_id = layout.plate_of_well(well_id)
+    attributes = layout.well_attributes(well_id)
+    well_index = (well_id - WELL_ID_OFFSET) % layout.wells_per_plate
+
+    bulk_values = [
+        ["Plate", layout.plate_name(plate_id)],
+        ["Well", layout.well_position(well_index)],
+        ["Characteristics [Organism]", attributes["Organism"]],
+        ["Characteristics [Cell Line]", attributes["Cell Line"]],
+        ["Channels", attributes["Channels"]],
+        ["Strain", attributes["Strain"]],
+        ["Compound Name", attributes["Compound Name"]],
+        ["siRNA Identifier", attributes["siRNA Identifier"]],
+    ]
+    mapr_values = {
+        "openmicroscopy.org/mapr/organism": [["Organism", attributes["Organism"]]],
+        "openmicroscopy.org/mapr/cell_line": [["Cell Line", attributes["Cell Line"]]],
+        "openmicroscopy.org/mapr/gene": [
+            ["Gene Identifier", attributes["Gene Identifier"]],
+            ["Gene Symbol", attributes["Gene Symbol"]],
+        ],
+        "openmicroscopy.org/mapr/phenotype": [
+            ["Phenotype", attributes["Phenotype"]],
+            ["Phenotype Term Name", attributes["Phenotype Term Name"]],
+        ],
+    }
+
+    annotations = [
+        {
+            "id": well_id,
+            "ns": "openmicroscopy.org/omero/bulk_annotations",
+            "values": bulk_values,
+            "link": {"parent": {"id": well_id, "class": "WellI"}},
+        }
+    ]
+    for offset, (ns, values) in enumerate(mapr_values.items(), 1):
+        annotations.append(
+            {
+                "id": well_id * 10 + offset,
+                "ns": ns,
+                "values": values,
+                "link": {"parent": {"id": well_id, "class": "WellI"}},
+            }
+        )
+
+    return {"annotations": annotations, "experimenters": list()}
+
+
+def screen_annotations(layout, screen_id):
+    """Build an IDR style study info annotation response for a synthetic screen
+
+    Parameters
+    ----------
+    layout: SyntheticLayout
+        Synthetic databank layout
+    screen_id: int
+        Synthetic screen ID
+
+    Returns
+    -------
+    dict
+        Response body of webclient/api/annotations/?type=map&screen={screen_id}
+    """
+    study_name = layout.study_name(screen_id)
+    values = [
+        ["Sample Type", "cell"],
+        ["Organism", layout.draw(attribute="Organism", key=("screen", screen_id))],
+        ["Study Type", "high content screen"],
+        ["Screen Type", "primary screen"],
+        ["Imaging Method", layout.imaging_method(screen_id)],
+        [
+            "Annotation File",
+            f"{study_name}-screenA-annotation.csv "
+            f"https://github.com/IDR/idr-metadata/blob/HEAD/{study_name}/screenA/"
+            f"{study_name}-screenA-annotation.csv",
+        ],
+    ]
+    annotation = {
+        "id": screen_id,
+        "ns": "idr.openmicroscopy.org/study/info",
+        "date": "2019-06-04T10:43:11+01:00",
+        "values": values,
+        "link": {
+            "parent": {
+                "id": screen_id,
+                "class": "ScreenI",
+                "name": layout.idr_name(screen_id),
+            }
+        },
+    }
+
+    return {"annotations": [annotation], "experimenters": list()}
+
+
+def annotation_csv(layout, screen_id):
+    """Build the IDR annotation CSV of a synthetic screen
+
+    Rows carry the same values as well_annotations(), with the columns from which
+    IDR derives the mapr annotations.
+
+    Parameters
+    ----------
+    layout: SyntheticLayout
+        Synthetic databank layout
+    screen_id: int
+        Synthetic screen ID
+
+    Returns
+    -------
+    str
+        CSV text with one row per well
+    """
+    rows = list()
+    for plate_id in layout.plate_ids(screen_id):
+        for well_index, well_id in enumerate(layout.well_ids(plate_id)):
+            attributes = layout.well_attributes(well_id)
+            rows.append(
+                {
+                    "Plate": layout.plate_name(plate_id),
+                    "Well": layout.well_position(well_index),
+                    "Characteristics [Organism]": attributes["Organism"],
+                    "Characteristics [Cell Line]": attributes["Cell Line"],
+                    "Channels": attributes["Channels"],
+                    "Strain": attributes["Strain"],
+                    "Gene Identifier": attributes["Gene Identifier"],
+                    "Gene Symbol": attributes["Gene Symbol"],
+                    "Phenotype 1": attributes["Phenotype"],
+                    "Phenotype 1 Term Name": attributes["Phenotype Term Name"],
+                    "Compound Name": attributes["Compound Name"],
+                    "siRNA Identifier": attributes["siRNA Identifier"],
+                }
+            )
+
+    return pd.DataFrame(rows).to_csv(index=False)
+
+
+def screen_listing(layout, offset=0, limit=200):
+    """Build a page of the api/v0/m/screens/ listing for a synthetic databank"""
+    # Pages are capped at maxLimit like the IDR API
+    limit = min(limit, 500)
+    screen_ids = layout.screen_ids()
+    data = [
+        {
+            "@id": screen_id,
+            "Name": layout.idr_name(screen_id),
+            "Description": (
+                f"Publication Title\nSynthetic screen {screen_id}\n\n"
+                f"Screen Description\nSynthetic screen {screen_id} for benchmarking."
+            ),
+        }
+        for screen_id in screen_ids[offset : offset + limit]
+    ]
+    meta = {
+        "offset": offset,
+        "limit": limit,
+        "maxLimit": 500,
+        "totalCount": len(screen_ids),
+    }
+
+    return {"data": data, "meta": meta}
+
+
+def plate_listing(layout, screen_id):
+    """Build the webclient/api/plates/?id={screen_id} response for a synthetic screen"""
+    return {
+        "plates": [
+            {"id": plate_id, "name": layout.plate_name(plate_id), "childCount": 1}
+            for plate_id in layout.plate_ids(screen_id)
+        ]
+    }
+
+
+def plate_grid(layout, plate_id):
+    """Build the webgateway/plate/{plate_id}/ well grid for a synthetic plate"""
+    well_ids = layout.well_ids(plate_id)
+    grid = [
+        [
+            {
+                "wellId": well_id,
+                "id": well_id,
+                "field": 0,
+                "thumb_url": f"/webgateway/render_thumbnail/{well_id}/",
+            }
+            for well_id in well_ids[row_start : row_start + GRID_COLUMNS]
+        ]
+        for row_start in range(0, len(well_ids), GRID_COLUMNS)
+    ]
+
+    return {
+        "grid": grid,
+        "collabels": list(range(1, GRID_COLUMNS + 1)),
+        "rowlabels": [chr(ord("A") + row) for row in range(len(grid))],
+        "image_sizes": [{"x": 1344, "y": 1024}],
+    }
+
+
+# Calibration source and the per-screen metadata columns written by collect_metadata()
+ELEMENTS_AND_COUNTS_FILE = pathlib.Path(
+    "IDR/data/statistics/unique_elements_and_counts.parquet"
+)
+METADATA_ATTRIBUTES = [
+    "Channels",
+    "Organism",
+    "Cell Line",
+    "Organism Part",
+    "Strain",
+    "Gene Identifier",
+    "Gene Symbol",
+    "Phenotype",
+    "Phenotype Term Name",
+    "Compound Name",
+    "siRNA Identifier",
+]
+
+
+def fit_zipf_exponent(counts):
+    """Fits the exponent of a Zipf law to element counts
+
+    Parameters
+    ----------
+    counts: numpy.ndarray
+        Instance counts of the unique elements of an image attribute
+
+    Returns
+    -------
+    float
+        Negative slope of log(count) against log(rank)
+    """
+    if len(counts) < 2:
+        return 1.0
+
+    ranked_counts = np.sort(counts)[::-1]
+    ranks = np.arange(1, len(ranked_counts) + 1)
+    slope = np.polyfit(np.log(ranks), np.log(ranked_counts), deg=1)[0]
+
+    return float(-slope)
+
+
+def attribute_profiles(elements_and_counts_file=ELEMENTS_AND_COUNTS_FILE):
+    """Fits databank and per-screen cardinality profiles to the real IDR element counts
+
+    Parameters
+    ----------
+    elements_and_counts_file: str or pathlib.Path
+        unique_elements_and_counts.parquet written by 1.compute_statistics.py
+
+    Returns
+    -------
+    attribute_profile: dict
+        Per attribute pool size, Zipf exponent and element names ordered by rank
+    screen_profiles: list
+        Per real screen, the well count and the richness of each attribute
+    """
+    elements_and_counts_df = pd.read_parquet(elements_and_counts_file)
+
+    attribute_profile = dict()
+    for attribute, attribute_df in elements_and_counts_df.groupby("Attribute"):
+        databank_counts = (
+            attribute_df.groupby("Element")["Count"].sum().sort_values(ascending=False)
+        )
+        attribute_profile[attribute] = {
+            "pool_size": len(databank_counts),
+            "zipf_exponent": fit_zipf_exponent(databank_counts.to_numpy()),
+            "element_names": databank_counts.index.tolist(),
+        }
+
+    screen_profiles = list()
+    for screen, screen_df in elements_and_counts_df.groupby("Screen"):
+        attribute_counts = screen_df.groupby("Attribute")["Count"]
+        screen_profiles.append(
+            {
+                "n_wells": int(attribute_counts.sum().max()),
+                "richness": attribute_counts.size().to_dict(),
+            }
+        )
+
+    return attribute_profile, screen_profiles
+
+
+def layout_from_profiles(
+    attribute_profile, n_screens, plates_per_screen, wells_per_plate, scale=1.0, seed=0
+):
+    """Builds a SyntheticLayout whose element pools follow the fitted attribute profiles
+
+    Parameters
+    ----------
+    attribute_profile: dict
+        Attribute profiles returned by attribute_profiles()
+    n_screens: int
+        Number of screens in the databank
+    plates_per_screen: int
+        Number of plates in each screen
+    wells_per_plate: int
+        Number of wells in each plate
+    scale: float
+        Multiplier applied to the pool size of each attribute
+    seed: int
+        Seed for the element draws
+
+    Returns
+    -------
+    SyntheticLayout
+    """
+    return SyntheticLayout(
+        n_screens=n_screens,
+        plates_per_screen=plates_per_screen,
+        wells_per_plate=wells_per_plate,
+        seed=seed,
+        pool_sizes={
+            attribute: max(1, math.ceil(profile["pool_size"] * scale))
+            for attribute, profile in attribute_profile.items()
+        },
+        zipf_exponents={
+            attribute: profile["zipf_exponent"]
+            for attribute, profile in attribute_profile.items()
+        },
+        element_names={
+            attribute: profile["element_names"]
+            for attribute, profile in attribute_profile.items()
+        },
+    )
+
+
+def draw_screen_ranks(rng, cdf, richness):
+    """Draws distinct element ranks for one screen, favouring databank-wide common elements
+
+    Parameters
+    ----------
+    rng: numpy.random.Generator
+        Random number generator
+    cdf: numpy.ndarray
+        Cumulative Zipf probabilities of the attribute pool
+    richness: int
+        Number of distinct elements to draw
+
+    Returns
+    -------
+    ranks: numpy.ndarray
+        Distinct ranks within the attribute pool
+    """
+    pool_size = len(cdf)
+    richness = min(richness, pool_size)
+
+    # Draw with replacement until enough distinct ranks are found
+    ranks = np.empty(0, dtype=np.int64)
+    for _ in range(8):
+        missing = richness - len(ranks)
+        if missing <= 0:
+            break
+        draws = np.searchsorted(cdf, rng.random(2 * missing), side="right")
+        ranks = pd.unique(np.concatenate([ranks, np.minimum(draws, pool_size - 1)]))
+
+    # Fill any remainder from the long tail
+    if len(ranks) < richness:
+        unused = np.setdiff1d(np.arange(pool_size), ranks, assume_unique=True)
+        fill = rng.choice(unused, size=richness - len(ranks), replace=False)
+        ranks = np.concatenate([ranks, fill])
+
+    return ranks[:richness]
+
+
+def generate_screen_metadata(
+    attribute_profile, screen_profile, screen_id, pool_sizes, rng, wells_per_plate=384
+):
+    """Generates a per-screen metadata table shaped like the output of collect_metadata()
+
+    Parameters
+    ----------
+    attribute_profile: dict
+        Attribute profiles returned by attribute_profiles()
+    screen_profile: dict
+        Well count and per attribute richness of the screen to imitate
+    screen_id: int
+        Synthetic screen ID
+    pool_sizes: dict
+        Pool size per attribute, possibly scaled beyond the real pools
+    rng: numpy.random.Generator
+        Random number generator
+    wells_per_plate: int
+        Number of wells assigned to each plate
+
+    Returns
+    -------
+    screen_metadata_df: pandas.DataFrame
+        One row per synthetic well
+    """
+    n_wells = screen_profile["n_wells"]
+    screen_metadata = dict()
+
+    for attribute in METADATA_ATTRIBUTES + ["Imaging Method", "Sample"]:
+        if attribute not in attribute_profile:
+            screen_metadata[attribute] = np.full(n_wells, "Not listed", dtype=object)
+            continue
+
+        profile = attribute_profile[attribute]
+        pool_size = pool_sizes[attribute]
+        weights = 1.0 / np.arange(1, pool_size + 1) ** profile["zipf_exponent"]
+        cdf = np.cumsum(weights) / weights.sum()
+
+        # Distinct elements of this screen, then Zipf distributed well assignments
+        richness = min(screen_profile["richness"].get(attribute, 1), n_wells)
+        ranks = draw_screen_ranks(rng=rng, cdf=cdf, richness=richness)
+        within_weights = 1.0 / np.arange(1, len(ranks) + 1) ** profile["zipf_exponent"]
+        assignments = rng.choice(
+            len(ranks), size=n_wells, p=within_weights / within_weights.sum()
+        )
+
+        names = profile["element_names"]
+        elements = np.array(
+            [
+                names[rank] if rank < len(names) else element_name(attribute, rank)
+                for rank in ranks
+            ],
+            dtype=object,
+        )
+        screen_metadata[attribute] = elements[assignments]
+
+    first_well = WELL_ID_OFFSET + screen_id * 1_000_000
+    well_ids = np.arange(first_well, first_well + n_wells)
+    plate_ids = (
+        PLATE_ID_OFFSET + screen_id * 10_000 + np.arange(n_wells) // wells_per_plate
+    )
+    screen_metadata["plate_id"] = plate_ids.astype(str)
+    screen_metadata["well_id"] = well_ids.astype(str)
+    screen_metadata["screen_id"] = np.full(n_wells, screen_id)
+
+    column_order = METADATA_ATTRIBUTES + [
+        "plate_id",
+        "well_id",
+        "screen_id",
+        "Imaging Method",
+        "Sample",
+    ]
+
+    return pd.DataFrame(screen_metadata)[column_order]
+
+
+def write_synthetic_metadata(
+    output_dir,
+    scale=1.0,
+    seed=0,
+    elements_and_counts_file=ELEMENTS_AND_COUNTS_FILE,
+    wells_per_plate=384,
+):
+    """Writes a synthetic metadata directory of per-screen .parquet files
+
+    The real screens are resampled round(scale * n_real_screens) times, keeping each
+    screen's well count and per attribute richness, and attribute pools grow with scale.
+
+    Parameters
+    ----------
+    output_dir: str or pathlib.Path
+        Directory replacing IDR/data/metadata for the synthetic databank
+    scale: float
+        Size of the synthetic databank relative to the real one
+    seed: int
+        Random seed
+    elements_and_counts_file: str or pathlib.Path
+        unique_elements_and_counts.parquet used for calibration
+    wells_per_plate: int
+        Number of wells assigned to each plate
+
+    Returns
+    -------
+    metadata_files: list
+        Paths of the written .parquet files
+    """
+    attribute_profile, screen_profiles = attribute_profiles(
+        elements_and_counts_file=elements_and_counts_file
+    )
+    rng = np.random.default_rng(seed)
+    pool_sizes = {
+        attribute: max(1, math.ceil(profile["pool_size"] * scale))
+        for attribute, profile in attribute_profile.items()
+    }
+
+    n_screens = max(1, round(scale * len(screen_profiles)))
+    screen_choices = rng.choice(len(screen_profiles), size=n_screens)
+
+    metadata_files = list()
+    for screen_index, profile_index in enumerate(screen_choices):
+        screen_id = SCREEN_ID_OFFSET + screen_index
+        screen_metadata_df = generate_screen_metadata(
+            attribute_profile=attribute_profile,
+            screen_profile=screen_profiles[profile_index],
+            screen_id=screen_id,
+            pool_sizes=pool_sizes,
+            rng=rng,
+            wells_per_plate=wells_per_plate,
+        )
+
+        study_name = f"idr{screen_id:04d}-synthetic-screen"
+        screen_dir = pathlib.Path(output_dir, study_name, "screenA")
+        pathlib.Path.mkdir(screen_dir, exist_ok=True, parents=True)
+        output_file = pathlib.Path(
+            screen_dir, f"{study_name}_screenA_{screen_id}.parquet"
+        )
+        write_metadata(screen_metadata_df, output_file)
+        metadata_files.append(output_file)
+
+    return metadata_files
+
+
+def write_synthetic_json(output_dir, layout):
+    """Writes well annotation JSON trees laid out like IDR/data/json_metadata
+
+    Parameters
+    ----------
+    output_dir: str or pathlib.Path
+        Directory replacing IDR/data/json_metadata for the synthetic databank
+    layout: SyntheticLayout
+        Synthetic databank layout
+
+    Returns
+    -------
+    n_files: int
+        Number of written well .json files
+    """
+    n_files = 0
+    for screen_id in layout.screen_ids():
+        for plate_id in layout.plate_ids(screen_id):
+            plate_dir = pathlib.Path(output_dir, str(screen_id), str(plate_id))
+            pathlib.Path.mkdir(plate_dir, exist_ok=True, parents=True)
+            for well_id in layout.well_ids(plate_id):
+                output_file = pathlib.Path(plate_dir, f"{well_id}.json")
+                with open(output_file, "w", encoding="utf-8") as file:
+                    json.dump(
+                        well_annotations(layout, well_id),
+                        file,
+                        ensure_ascii=False,
+                        indent=4,
+                    )
+                n_files += 1
+
+    return n_files
+
+
+if __name__ == "__main__":
+    from utils.args import synthetic_metadata_parser
+
+    # Define arguments
+    args = synthetic_metadata_parser().parse_args(sys.argv[1:])
+    output_dir = pathlib.Path(args.output_dir)
+
+    if args.output_format in ["parquet", "both"]:
+        metadata_files = write_synthetic_metadata(
+            output_dir=pathlib.Path(output_dir, "metadata"),
+            scale=args.scale,
+            seed=args.seed,
+            elements_and_counts_file=args.elements_and_counts_file,
+        )
+        print(f"Wrote {len(metadata_files)} synthetic screen metadata files.")
+
+    if args.output_format in ["json", "both"]:
+        attribute_profile, _ = attribute_profiles(
+            elements_and_counts_file=args.elements_and_counts_file
+        )
+        layout = layout_from_profiles(
+            attribute_profile=attribute_profile,
+            n_screens=args.json_screens,
+            plates_per_screen=args.json_plates,
+            wells_per_plate=args.json_wells,
+            scale=args.scale,
+            seed=args.seed,
+        )
+        n_files = write_synthetic_json(
+            output_dir=pathlib.Path(output_dir, "json_metadata"), layout=layout
+        )
+        print(f"Wrote {n_files} synthetic well annotation files.")
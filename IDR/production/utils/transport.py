@@ -0,0 +1,763 @@
+import abc
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+import zipfile
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+# Define path to the production directory
+parent_dir = str(pathlib.Path(__file__).parents[1])
+sys.path.append(parent_dir)
+from utils import instrumentation
+from utils.synthetic import (
+    SyntheticLayout,
+    annotation_csv,
+    plate_grid,
+    plate_listing,
+    screen_annotations,
+    screen_listing,
+    well_annotations,
+)
+
+IDR_BASE_URL = "https://idr.openmicroscopy.org"
+TRANSPORTS = ["live", "record", "replay", "synthetic"]
+
+# Headers describing the wire encoding are dropped since fixtures store decoded bodies
+WIRE_HEADERS = ["content-encoding", "content-length", "transfer-encoding"]
+
+# Seconds that cached responses are served without revalidation, by URL path prefix.
+# Listings change with every IDR release while plate grids and annotations rarely do
+DEFAULT_CACHE_TTLS = {
+    "/api/v0/m/": 24 * 3600,
+    "/webclient/api/plates/": 7 * 24 * 3600,
+    "/webgateway/plate/": 30 * 24 * 3600,
+    "/webclient/api/annotations/": 30 * 24 * 3600,
+}
+DEFAULT_CACHE_TTL = 24 * 3600
+
+
+def request_url(method, url, params=None):
+    """Fully qualified URL of a request, including encoded query parameters"""
+    return requests.Request(method=method, url=url, params=params).prepare().url
+
+
+def fixture_key(method, url):
+    """Name of the fixture archive members holding a recorded response
+
+    Parameters
+    ----------
+    method: str
+        HTTP method of the request
+    url: str
+        Fully qualified request URL
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest of the method and URL
+    """
+    return hashlib.sha1(f"{method.upper()} {url}".encode("utf-8")).hexdigest()
+
+
+class FixtureResponse:
+    """Minimal stand-in for requests.Response served by offline transports
+
+    Parameters
+    ----------
+    url: str
+        Request URL
+    status_code: int
+        HTTP status code
+    content: bytes
+        Response body
+    headers: dict
+        Response headers
+    """
+
+    def __init__(self, url, status_code=200, content=b"", headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = requests.structures.CaseInsensitiveDict(headers or dict())
+        self.encoding = "utf-8"
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start : start + chunk_size]
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(
+                f"{self.status_code} Error for url: {self.url}", response=self
+            )
+
+    def close(self):
+        pass
+
+
+class RecordingSession(requests.Session):
+    """requests.Session that captures every response into a fixture archive
+
+    Parameters
+    ----------
+    fixture_archive: str or pathlib.Path
+        Zip archive that recorded responses are appended to
+    """
+
+    def __init__(self, fixture_archive):
+        super().__init__()
+        self.fixture_archive = pathlib.Path(fixture_archive)
+        self._lock = threading.Lock()
+        self._archive = None
+        self._recorded = set()
+        if self.fixture_archive.exists():
+            with zipfile.ZipFile(self.fixture_archive) as archive:
+                self._recorded = {name.split(".")[0] for name in archive.namelist()}
+
+    def request(self, method, url, params=None, **kwargs):
+        response = super().request(method, url, params=params, **kwargs)
+        key = fixture_key(method, request_url(method, url, params))
+
+        meta = {
+            "method": method.upper(),
+            "url": request_url(method, url, params),
+            "status_code": response.status_code,
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in WIRE_HEADERS
+            },
+        }
+        with self._lock:
+            if key not in self._recorded:
+                if self._archive is None:
+                    self.fixture_archive.parent.mkdir(parents=True, exist_ok=True)
+                    self._archive = zipfile.ZipFile(
+                        self.fixture_archive, mode="a", compression=zipfile.ZIP_DEFLATED
+                    )
+                self._archive.writestr(f"{key}.json", json.dumps(meta))
+                self._archive.writestr(f"{key}.body", response.content)
+                self._recorded.add(key)
+
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+        super().close()
+
+
+class OfflineSession(abc.ABC):
+    """Session interface shared by transports that never touch the network
+
+    Parameters
+    ----------
+    latency: float
+        Seconds to sleep before answering each request, emulating network round trips
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    @abc.abstractmethod
+    def respond(self, method, url, headers=None):
+        """Response to a request, implemented by each transport
+
+        Parameters
+        ----------
+        method: str
+            Upper case HTTP method
+        url: str
+            Full request URL including the query string
+        headers: dict
+            Request headers, e.g. conditional request headers
+
+        Returns
+        -------
+        FixtureResponse
+        """
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        url = request_url(method, url, params)
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return self.respond(method.upper(), url, headers=headers)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def prepare_request(self, request):
+        return request.prepare()
+
+    def send(self, prepared, **kwargs):
+        return self.request(prepared.method, prepared.url, headers=prepared.headers)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplaySession(OfflineSession):
+    """Serves responses previously captured by RecordingSession
+
+    Parameters
+    ----------
+    fixture_archive: str or pathlib.Path
+        Zip archive written by RecordingSession
+    latency: float
+        Seconds to sleep before answering each request
+    """
+
+    def __init__(self, fixture_archive, latency=0.0):
+        super().__init__(latency=latency)
+        self.fixture_archive = pathlib.Path(fixture_archive)
+        self._lock = threading.Lock()
+        self._archive = None
+        self._names = set()
+
+    def respond(self, method, url, headers=None):
+        key = fixture_key(method, url)
+        with self._lock:
+            # Reopen lazily so that the session stays usable after close()
+            if self._archive is None:
+                self._archive = zipfile.ZipFile(self.fixture_archive)
+                self._names = set(self._archive.namelist())
+
+            if f"{key}.json" not in self._names:
+                raise LookupError(f"No recorded fixture for {method} {url}")
+
+            meta = json.loads(self._archive.read(f"{key}.json"))
+            content = self._archive.read(f"{key}.body")
+
+        return FixtureResponse(
+            url=url,
+            status_code=meta["status_code"],
+            content=content,
+            headers=meta["headers"],
+        )
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+
+class SyntheticSession(OfflineSession):
+    """Generates IDR API responses for a synthetic databank of any scale
+
+    Parameters
+    ----------
+    layout: utils.synthetic.SyntheticLayout
+        Screen, plate and well layout to serve
+    latency: float
+        Seconds to sleep before answering each request
+    """
+
+    def __init__(self, layout=None, latency=0.0):
+        super().__init__(latency=latency)
+        self.layout = layout or SyntheticLayout()
+
+    def route(self, path, query):
+        """Response body for an IDR API path, or None if the path has no data"""
+        layout = self.layout
+
+        if path.startswith("/api/v0/m/screens"):
+            return screen_listing(
+                layout,
+                offset=int(query.get("offset", 0)),
+                limit=int(query.get("limit", 200)),
+            )
+
+        if path.startswith("/api/v0/m/projects"):
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 200))
+            meta = {"offset": offset, "limit": limit, "maxLimit": 500, "totalCount": 0}
+            return {"data": list(), "meta": meta}
+
+        if path.startswith("/webclient/api/plates"):
+            screen_id = int(query["id"])
+            return (
+                plate_listing(layout, screen_id)
+                if layout.has_screen(screen_id)
+                else None
+            )
+
+        if path.startswith("/webgateway/plate/"):
+            plate_id = int(path.rstrip("/").split("/")[-1])
+            return plate_grid(layout, plate_id) if layout.has_plate(plate_id) else None
+
+        if path.endswith("-annotation.csv"):
+            # Study names of synthetic screens start with idr{screen_id:04d}
+            screen_id = int(path.split("/")[-1][3:7])
+            return (
+                annotation_csv(layout, screen_id)
+                if layout.has_screen(screen_id)
+                else None
+            )
+
+        if path.startswith("/webclient/api/annotations"):
+            if "screen" in query and layout.has_screen(int(query["screen"])):
+                return screen_annotations(layout, int(query["screen"]))
+            # Synthetic images share the ID of the well they belong to
+            well_id = int(query.get("well", query.get("image", -1)))
+            return (
+                well_annotations(layout, well_id) if layout.has_well(well_id) else None
+            )
+
+        return None
+
+    def respond(self, method, url, headers=None):
+        split_url = urlsplit(url)
+        query = {key: values[0] for key, values in parse_qs(split_url.query).items()}
+
+        if split_url.path.rstrip("/") == "/webclient":
+            return FixtureResponse(
+                url=url, content=b"<html></html>", headers={"Content-Type": "text/html"}
+            )
+
+        body = self.route(path=split_url.path, query=query)
+        if body is None:
+            return FixtureResponse(
+                url=url,
+                status_code=404,
+                content=json.dumps({"message": "Not found"}).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+
+        if isinstance(body, str):
+            content = body.encode("utf-8")
+            content_type = "text/csv"
+        else:
+            content = json.dumps(body).encode("utf-8")
+            content_type = "application/json"
+
+        # Synthetic responses never change, so a digest of the body serves as ETag
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        headers = requests.structures.CaseInsensitiveDict(headers or dict())
+        if headers.get("If-None-Match") == etag:
+            return FixtureResponse(url=url, status_code=304, headers={"ETag": etag})
+
+        return FixtureResponse(
+            url=url,
+            content=content,
+            headers={"Content-Type": content_type, "ETag": etag},
+        )
+
+
+class CachingSession:
+    """Wraps a session with a persistent on-disk cache of GET responses
+
+    Responses are keyed on their fully qualified URL. A cached response is served
+    without a request until the TTL of its endpoint expires. It is then revalidated
+    with a conditional request (If-None-Match / If-Modified-Since) and a
+    304 Not Modified answer renews it. Concurrent requests for the same URL share a
+    single request. The cache is bounded in size by evicting the least recently used
+    responses, tracked by the modification time of their files.
+
+    Parameters
+    ----------
+    session: requests.Session or OfflineSession
+        Session performing the requests that the cache cannot answer
+    cache_dir: str or pathlib.Path
+        Directory holding {key[:2]}/{key}.json metadata and {key}.body files
+    ttls: dict
+        Seconds to serve responses without revalidation by URL path prefix, added to
+        DEFAULT_CACHE_TTLS. The longest matching prefix applies
+    max_bytes: int
+        Size bound of the cache. Eviction trims the cache to 90% of the bound. Sizes
+        are tracked per session, so concurrent processes may briefly exceed it
+
+    The running size of the cache is kept in {cache_dir}/size.json. It is read when
+    a session first stores a response and updated on close() and after eviction, so
+    that sessions do not walk the cache when they are created. The cache is only
+    walked when the index is missing, and by eviction, which corrects the index.
+    """
+
+    def __init__(self, session, cache_dir, ttls=None, max_bytes=2 * 2**30):
+        self.session = session
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.ttls = dict(DEFAULT_CACHE_TTLS, **(ttls or dict()))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_flight = dict()
+
+        # Cache size, read from the index on the first store
+        self._size = None
+        # Bytes stored by this session since the index was last written
+        self._unsaved = 0
+
+        pathlib.Path.mkdir(self.cache_dir, exist_ok=True, parents=True)
+        self.size_file = pathlib.Path(self.cache_dir, "size.json")
+
+    def ttl(self, url):
+        """Seconds a response of url is served without revalidation"""
+        path = urlsplit(url).path
+        prefixes = [prefix for prefix in self.ttls if path.startswith(prefix)]
+        if not prefixes:
+            return DEFAULT_CACHE_TTL
+
+        return self.ttls[max(prefixes, key=len)]
+
+    def _paths(self, key):
+        entry_dir = pathlib.Path(self.cache_dir, key[:2])
+        return pathlib.Path(entry_dir, f"{key}.json"), pathlib.Path(
+            entry_dir, f"{key}.body"
+        )
+
+    def _entries(self):
+        """(last use, key, size) of every cached response"""
+        for entry_dir in os.scandir(self.cache_dir):
+            if not entry_dir.is_dir():
+                continue
+            for entry in os.scandir(entry_dir.path):
+                if entry.name.endswith(".body"):
+                    key = entry.name.removesuffix(".body")
+                    meta_file, _ = self._paths(key)
+                    try:
+                        meta_size = meta_file.stat().st_size
+                        body_stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield body_stat.st_mtime, key, body_stat.st_size + meta_size
+
+    def _read_size(self):
+        """Cache size recorded in the index, or None if it is missing"""
+        try:
+            with open(self.size_file) as file:
+                return json.load(file)["bytes"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def _write_size(self, size):
+        self._write(self.size_file, json.dumps({"bytes": size}).encode("utf-8"))
+        self._unsaved = 0
+
+    def _cache_size(self):
+        """Cache size from the index, walking the cache if there is none yet"""
+        size = self._read_size()
+        if size is None:
+            size = sum(entry_size for _, _, entry_size in self._entries())
+            self._write_size(size)
+
+        return size
+
+    def _load(self, key):
+        meta_file, body_file = self._paths(key)
+        try:
+            with open(meta_file) as file:
+                meta = json.load(file)
+            content = body_file.read_bytes()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        return meta, content
+
+    def _write(self, path, data):
+        partial_file = pathlib.Path(path.parent, f".{path.name}.partial")
+        partial_file.write_bytes(data)
+        os.replace(partial_file, path)
+
+    def _store(self, key, meta, content):
+        meta_file, body_file = self._paths(key)
+        pathlib.Path.mkdir(body_file.parent, exist_ok=True)
+        meta_data = json.dumps(meta).encode("utf-8")
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._cache_size()
+
+        previous_size = sum(
+            path.stat().st_size for path in [meta_file, body_file] if path.exists()
+        )
+        # The body is written first, so that a metadata file marks a complete entry
+        self._write(body_file, content)
+        self._write(meta_file, meta_data)
+
+        with self._lock:
+            self._size += len(content) + len(meta_data) - previous_size
+            self._unsaved += len(content) + len(meta_data) - previous_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Deletes least recently used responses down to 90% of max_bytes"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            for path in self._paths(key):
+                path.unlink(missing_ok=True)
+            self._size -= size
+            instrumentation.count("cache_evictions")
+
+        # The walk gives the exact size, so it replaces the index
+        self._write_size(self._size)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._paths(key)[1])
+        except FileNotFoundError:
+            pass
+
+    def _fetch(self, url, key):
+        """Metadata and content of url from the cache, revalidated or requested"""
+        cached = self._load(key)
+        headers = dict()
+        if cached is not None:
+            meta, content = cached
+            if time.time() - meta["stored_at"] < self.ttl(url):
+                instrumentation.count("cache_hits")
+                self._touch(key)
+                return cached
+            if meta.get("etag") is not None:
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified") is not None:
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = self.session.get(url, headers=headers or None)
+        if cached is not None and response.status_code == 304:
+            instrumentation.count("cache_revalidated")
+            meta["stored_at"] = time.time()
+            self._store(key, meta, content)
+            return meta, content
+
+        instrumentation.count("cache_misses")
+        meta = {
+            "url": url,
+            "status_code": response.status_code,
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in WIRE_HEADERS
+            },
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "stored_at": time.time(),
+        }
+        if response.status_code == 200:
+            self._store(key, meta, response.content)
+
+        return meta, response.content
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        if method.upper() != "GET":
+            return self.session.request(
+                method, url, params=params, headers=headers, **kwargs
+            )
+
+        url = request_url(method, url, params)
+        key = fixture_key(method, url)
+
+        # The first request for a URL fetches it, later concurrent ones wait for it
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+
+        if leader:
+            try:
+                future.set_result(self._fetch(url, key))
+            except BaseException as error:
+                future.set_exception(error)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+        else:
+            instrumentation.count("cache_shared")
+        meta, content = future.result()
+
+        # Answer conditional requests of the caller from the cache
+        headers = requests.structures.CaseInsensitiveDict(headers or dict())
+        if (
+            meta["status_code"] == 200
+            and meta.get("etag") is not None
+            and headers.get("If-None-Match") == meta["etag"]
+        ):
+            return FixtureResponse(url=url, status_code=304, headers=meta["headers"])
+
+        return FixtureResponse(
+            url=url,
+            status_code=meta["status_code"],
+            content=content,
+            headers=meta["headers"],
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def prepare_request(self, request):
+        return self.session.prepare_request(request)
+
+    def send(self, prepared, **kwargs):
+        return self.request(prepared.method, prepared.url, headers=prepared.headers)
+
+    def close(self):
+        # Stores of this session are added to the size recorded by other sessions
+        with self._lock:
+            if self._unsaved:
+                size = self._read_size()
+                if size is None:
+                    self._cache_size()
+                else:
+                    self._write_size(size + self._unsaved)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_session(transport="live", fixture_archive=None, latency=0.0, layout=None):
+    """Build a session for accessing the IDR API through the selected transport
+
+    Parameters
+    ----------
+    transport: str
+        One of TRANSPORTS
+            - live: plain requests.Session against idr.openmicroscopy.org
+            - record: live session that captures responses into fixture_archive
+            - replay: serve responses from fixture_archive without network access
+            - synthetic: generate responses for a synthetic databank
+    fixture_archive: str or pathlib.Path
+        Zip archive of recorded responses. Required for record and replay
+    latency: float
+        Seconds added to each replay or synthetic request
+    layout: utils.synthetic.SyntheticLayout
+        Synthetic databank served in synthetic mode
+
+    Returns
+    -------
+    Session exposing the requests.Session get(), request(), prepare_request() and send() methods
+    """
+    if transport in ["record", "replay"] and fixture_archive is None:
+        raise ValueError(f"The {transport} transport requires a fixture archive")
+
+    if transport == "live":
+        return requests.Session()
+    if transport == "record":
+        return RecordingSession(fixture_archive=fixture_archive)
+    if transport == "replay":
+        return ReplaySession(fixture_archive=fixture_archive, latency=latency)
+    if transport == "synthetic":
+        return SyntheticSession(layout=layout, latency=latency)
+
+    raise ValueError(f"Unknown transport {transport}. Choose from {TRANSPORTS}")
+
+
+def parse_cache_ttls(values):
+    """Converts PREFIX=SECONDS arguments into a TTL per URL path prefix"""
+    ttls = dict()
+    for value in values or list():
+        prefix, _, seconds = value.rpartition("=")
+        ttls[prefix] = float(seconds)
+
+    return ttls
+
+
+def session_from_args(args, ttls=None):
+    """Build a session from the transport arguments added by utils.args.add_transport_args()
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Parsed transport arguments
+    ttls: dict
+        Cache TTLs by URL path prefix that take precedence over --cache-ttl, e.g. 0 for
+        endpoints that must always be revalidated
+    """
+    layout = SyntheticLayout(
+        n_screens=args.synthetic_screens,
+        plates_per_screen=args.synthetic_plates,
+        wells_per_plate=args.synthetic_wells,
+    )
+
+    session = get_session(
+        transport=args.transport,
+        fixture_archive=args.fixture_archive,
+        latency=args.latency,
+        layout=layout,
+    )
+    if args.cache_dir is None:
+        return session
+
+    return CachingSession(
+        session=session,
+        cache_dir=args.cache_dir,
+        ttls=dict(parse_cache_ttls(args.cache_ttls), **(ttls or dict())),
+        max_bytes=int(args.cache_max_mb * 2**20),
+    )
+
+
+class ThreadSessions:
+    """Sessions built by session_from_args(), one per calling thread
+
+    requests.Session keeps its cookies and connection pools unsynchronised and is not
+    documented as thread-safe, so each worker thread of a pool requests through its
+    own session. The sessions are closed together on exit.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Arguments holding the transport arguments of utils.args.add_transport_args()
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = list()
+
+    def get(self):
+        """Session of the calling thread, built on first use"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = session_from_args(self.args)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+
+        return session
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, list()
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()